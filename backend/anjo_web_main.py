@@ -1,23 +1,22 @@
 # -*- coding: utf-8 -*-
 
+# Primeiro import: o relógio do relatório de subida (/debug/startup) começa aqui
+from services.startup import BOOT, Preguicoso
+
 import os
+import asyncio
+import atexit
 import ssl
 import smtplib
 import sqlite3
 import secrets
-import hashlib
-import hmac
-import base64
 import json
 import time
 import re
 import socket
-import io
-import csv
 from datetime import datetime, timedelta
 from email.message import EmailMessage
 from email.utils import formataddr, formatdate
-from string import Template
 from typing import Optional, Dict, Any, List, Tuple
 from urllib.parse import urlencode
 from urllib.request import Request as UrlRequest, urlopen
@@ -25,16 +24,20 @@ from urllib.error import URLError, HTTPError
 import html as _html
 import logging
 
-import requests
 import urllib3.util.connection as urllib3_cn
-from dotenv import load_dotenv
 
 # ---------------------------------------------------------
 # .env deve ser carregado ANTES de importar services que leem env no import
+# (backend/.env sobrescreve o ambiente, como o load_dotenv(override=True))
 # ---------------------------------------------------------
-BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-ENV_PATH = os.path.join(BASE_DIR, ".env")  # backend/.env
-load_dotenv(ENV_PATH, override=True)
+from services.config import (
+    carregar_env_arquivos,
+    instalar_sighup,
+    settings,
+)
+
+carregar_env_arquivos(sobrescrever=True)
+BOOT.marco("stdlib+env")
 
 
 from fastapi import (
@@ -42,6 +45,7 @@ from fastapi import (
     Request,
     Form,
     BackgroundTasks,
+    Header,
     HTTPException,
     Query,
 )
@@ -50,12 +54,71 @@ from fastapi.responses import (
     HTMLResponse,
     RedirectResponse,
     PlainTextResponse,
+    StreamingResponse,
 )
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel
 
 from services.metrics import registrar_sos_event
+from services.zenvia_batch import (
+    enviar_em_lote,
+    zenvia_base_url,
+    zenvia_session,
+    fila_pendente as zenvia_fila_pendente,
+)
+from services.circuit_breaker import (
+    proteger,
+    falha_provedor,
+    snapshot_all,
+    estados_numericos,
+)
+from services.instrumentacao import (
+    CONTENT_TYPE as METRICS_CONTENT_TYPE,
+    ConexaoInstrumentada,
+    MetricsMiddleware,
+    SOS_LATENCIA,
+    gauge,
+    render_prometheus,
+)
+from services.tracing import TracingMiddleware, span
+from services.admissao import (
+    DESCARTES as ADMISSAO_DESCARTES,
+    LIMITE_LIVE_SESSAO,
+    LIMITE_SOS_FONE,
+    AdmissaoMiddleware,
+)
+from services.zenvia_dlr import DlrIngestor
+from services.send_ledger import registrar_envios, timeline_sos, zenvia_message_id
+from services.sos_rollup import rollup_diario, sos_por_telefone
+from services.manutencao import Manutencao
+from services.plano_disparo import PlanoCache, PlanoDisparo
+from services.sos_idempotencia import (
+    ESPERA_S as SOS_IDEM_ESPERA_S,
+    Entrada as SosIdemEntrada,
+    Resposta as SosResposta,
+    SosIdempotencia,
+    chave_sos,
+    registrar_duplicado,
+)
+from services.mensagens_sos import (
+    ContextoSos,
+    compilar as compilar_mensagens_sos,
+    renderizar as renderizar_mensagens_sos,
+)
+from services.sos_projector import (
+    SosProjector,
+    registrar_sos_inicio,
+    registrar_sos_resultado,
+)
+from services.telegram_rate_limit import (
+    TelegramScheduler,
+    PRIORIDADE_SOS,
+    PRIORIDADE_LOCALIZACAO,
+    PRIORIDADE_EDICAO,
+    resultado_imediato,
+)
 from services.service_email import SosEmailRequest, send_sos_email_via_smtp
 from services.service_mapa import (
     central_page as render_central_page,
@@ -73,18 +136,21 @@ from services.routes_live_track import (
     live_track_delete_handler,
     api_live_track_points_handler,
 )
-from services.service_assinaturas import (
-    registrar_assinatura_site,
-    listar_assinaturas_debug,
-    listar_comissoes_por_vendedor,
-)
-from services.vendedor_comissao import (
-    listar_comissoes_por_vendedor,
-    resumir_comissoes_por_vendedor,
+from services.csv_stream import csv_em_blocos, intervalo_utc
+from services.senhas import (
+    SenhaOcupada,
+    hash_senha_async,
+    pendentes as senhas_pendentes,
 )
 
-from services.service_email_assinatura import enviar_email_boas_vindas_assinatura
-from services.service_pagamento import gerar_checkout_url
+# Fora do caminho do SOS: importados só no primeiro request que usar
+# (services/startup.py). service_pagamento puxa o SDK do Mercado Pago.
+_assinaturas = Preguicoso("services.service_assinaturas")
+_comissoes = Preguicoso("services.vendedor_comissao")
+_comissao_totais = Preguicoso("services.comissao_totais")
+_email_assinatura = Preguicoso("services.service_email_assinatura")
+_pagamento = Preguicoso("services.service_pagamento")
+
 from services.service_clientes import link_phone_to_user
 from schemas.assinaturas_sites import AssinaturaSiteIn
 from fastapi import Depends
@@ -95,6 +161,7 @@ from services.service_auth_central import (
     CENTRAL_COOKIE_NAME,
     create_central_session,
     require_central_session,
+    revoke_central_session,
     set_central_session_cookie,
     clear_central_session_cookie,
 )
@@ -120,6 +187,9 @@ def _check_debug_token(token: str) -> None:
 
 
 
+BOOT.marco("imports")
+
+
 # ---------------------------------------------------------
 # Logs + .env
 # ---------------------------------------------------------
@@ -128,7 +198,7 @@ logger = logging.getLogger("anjo_da_guarda")
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 ENV_PATH = os.path.join(BASE_DIR, ".env")
-# load_dotenv já executado no topo
+# .env já carregado no topo (services/config.py)
 logger.info("[ENV] usando .env em %s", ENV_PATH)
 
 DATA_DIR = os.path.normpath(os.path.join(BASE_DIR, "..", "data"))
@@ -140,33 +210,28 @@ SCHEMA_SQL_PATH = os.path.join(BASE_DIR, "db_schema.sql")
 # ---------------------------------------------------------
 # Config
 # ---------------------------------------------------------
-class CFG:
-    app_title: str = "Anjo da Guarda (Web)"
-    public_base_url: str = os.getenv("PUBLIC_BASE_URL", "http://localhost:8000")
+class _CfgAtual:
+    """
+    CFG.<campo> lê o Settings atual (services/config.py): validado na
+    subida, trocado inteiro no SIGHUP, sem os.getenv por request.
+    """
 
-    # E-mail
-    email_enabled: bool = os.getenv("EMAIL_ENABLED", "true").lower() == "true"
-    smtp_host: str = os.getenv("EMAIL_SMTP_HOST", "smtp.gmail.com")
-    smtp_port: int = int(os.getenv("EMAIL_SMTP_PORT", "587"))
-    smtp_user: str = os.getenv("EMAIL_USERNAME", "")
-    smtp_pass: str = os.getenv("EMAIL_PASSWORD", "")
-    email_from: str = os.getenv("EMAIL_FROM", "") or os.getenv("EMAIL_USERNAME", "")
-    email_from_name: str = os.getenv("EMAIL_FROM_NAME", "")
-    email_to_legacy: str = os.getenv("EMAIL_TO_LIST", "")
+    def __getattr__(self, nome: str):
+        return getattr(settings().cfg, nome)
 
-    # Telegram
-    tg_enabled: bool = os.getenv("TELEGRAM_ENABLED", "true").lower() == "true"
-    tg_token: str = os.getenv("TELEGRAM_BOT_TOKEN", "")
-    tg_bot_username: str = os.getenv("TELEGRAM_BOT_USERNAME", "")
-    tg_chat_id_legacy: str = os.getenv("TELEGRAM_CHAT_ID", "")
-    tg_chat_ids: str = os.getenv("TELEGRAM_CHAT_IDS", "")
-    tg_broadcast_throttle_ms: int = int(os.getenv("TELEGRAM_THROTTLE_MS", "120"))
+
+CFG = _CfgAtual()
+settings()  # valida na subida: erro de config derruba aqui, não no SOS
+instalar_sighup()
 
 
 # ---------------------------------------------------------
 # FastAPI + CORS
 # ---------------------------------------------------------
 app = FastAPI(title=CFG.app_title)
+# Prioridade por classe de rota + token bucket por IP (services/admissao.py);
+# dentro do CORS para o 429/503 chegar ao painel com os headers de CORS
+app.add_middleware(AdmissaoMiddleware)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -174,6 +239,11 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# Latência por rota para /metrics (mede também o CORS)
+app.add_middleware(MetricsMiddleware)
+# Trace + X-Request-ID por requisição (services/tracing.py); mais externo
+app.add_middleware(TracingMiddleware)
+BOOT.marco("config+app")
 
 
 # ---------------------------------------------------------
@@ -318,6 +388,22 @@ def live_track_start(payload: Dict[str, Any], request: Request):
     )
 
 
+def _live_limite_sessao(sessao: str) -> Optional[JSONResponse]:
+    """
+    Token bucket de updates de posição por sessão (services/admissao.py):
+    esses updates ficam fora do limite por IP (NAT da operadora).
+    """
+    espera = LIMITE_LIVE_SESSAO.tentar(sessao) if sessao else 0.0
+    if espera <= 0:
+        return None
+    ADMISSAO_DESCARTES.inc("live_update", "session_rate_limit")
+    return JSONResponse(
+        status_code=429,
+        content={"ok": False, "reason": "RATE_LIMITED"},
+        headers={"Retry-After": str(max(1, int(espera + 0.999)))},
+    )
+
+
 @app.post("/api/live-track/update")
 def live_track_update(payload: Dict[str, Any]):
     """
@@ -325,6 +411,11 @@ def live_track_update(payload: Dict[str, Any]):
     - Se o handler interno devolver 404 (sessão não encontrada ou payload estranho),
       convertemos em 200 com ok=False só para não poluir o log com 404.
     """
+    recusa = _live_limite_sessao(
+        str(payload.get("session_id") or payload.get("id") or "").strip()
+    )
+    if recusa is not None:
+        return recusa
     try:
         res = live_track_update_handler(
             payload=payload,
@@ -413,7 +504,7 @@ async def api_assinatura_site(body: AssinaturaSiteIn):
     valor_centavos = getattr(body, "valor_mensal_centavos", 0) or 0
 
     # 1) Salva assinatura no banco
-    novo_id = registrar_assinatura_site(
+    novo_id = _assinaturas.registrar_assinatura_site(
         user_email=body.user_email,
         plano=body.plano,
         valor_mensal_centavos=valor_centavos,
@@ -423,7 +514,7 @@ async def api_assinatura_site(body: AssinaturaSiteIn):
     )
 
     # 2) Gera link de pagamento no Mercado Pago (ou link padrão, se não configurado)
-    checkout_url = gerar_checkout_url(
+    checkout_url = _pagamento.gerar_checkout_url(
         assinatura_id=novo_id,
         plano=body.plano,
         valor_centavos=valor_centavos,
@@ -431,7 +522,7 @@ async def api_assinatura_site(body: AssinaturaSiteIn):
     )
 
     # 3) Envia e-mail de boas-vindas com link/QR code
-    enviar_email_boas_vindas_assinatura(
+    _email_assinatura.enviar_email_boas_vindas_assinatura(
         destinatario=body.user_email,
         plano=body.plano,
         checkout_url=checkout_url,
@@ -447,6 +538,8 @@ async def api_assinatura_site(body: AssinaturaSiteIn):
                 types=("sms", "whatsapp"),
             )
             logger.info("[ASSINATURAS][LINK_PHONE] %s", link_res)
+            if link_res.get("created"):
+                PLANOS.invalidar_email(body.user_email)
     except Exception as e:
         logger.error("[ASSINATURAS][LINK_PHONE] erro ao vincular telefone: %s", e)
 
@@ -466,80 +559,100 @@ def listar_assinaturas_debug_endpoint(
     if (not ASSINATURAS_DEBUG_TOKEN) or (token != ASSINATURAS_DEBUG_TOKEN):
         raise HTTPException(status_code=401, detail="Não autorizado.")
 
-    items = listar_assinaturas_debug(limit=500)
+    items = _assinaturas.listar_assinaturas_debug(limit=500)
     return {"items": items}
 
 
+@app.get(
+    "/api/assinaturas/debug/page",
+    summary="(Interno) Assinaturas paginadas por cursor",
+    tags=["assinaturas-debug"],
+)
+def listar_assinaturas_pagina_endpoint(
+    token: str = Query(..., description="Token interno de acesso"),
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: Optional[str] = Query(None, description="next_cursor da página anterior"),
+):
+    """
+    Mesmo conteúdo do /api/assinaturas/debug, sem o teto de 500 linhas:
+    repita a chamada com `cursor=next_cursor` até vir null.
+    """
+    _check_debug_token(token)
+    try:
+        return _assinaturas.listar_assinaturas_pagina(limit=limit, cursor=cursor)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Cursor inválido.")
+
+
+def _csv_download(
+    linhas_bytes, filename: str, gzip: bool
+) -> StreamingResponse:
+    if gzip:
+        return StreamingResponse(
+            linhas_bytes,
+            media_type="application/gzip",
+            headers={"Content-Disposition": f'attachment; filename="{filename}.gz"'},
+        )
+    return StreamingResponse(
+        linhas_bytes,
+        media_type="text/csv; charset=utf-8",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+
+def _intervalo_ou_400(de: Optional[str], ate: Optional[str]):
+    try:
+        return intervalo_utc(de, ate)
+    except ValueError:
+        raise HTTPException(
+            status_code=400, detail="Datas inválidas (use YYYY-MM-DD ou ISO 8601)."
+        )
+
+
 @app.get(
     "/api/assinaturas/debug/csv",
-    response_class=PlainTextResponse,
+    response_class=StreamingResponse,
     summary="(Interno) Exportar assinaturas em CSV",
     tags=["assinaturas-debug"],
 )
 async def assinaturas_debug_csv(
     token: str = Query(..., description="Token interno de acesso"),
+    de: Optional[str] = Query(None, alias="from", description="created_at_utc >= (YYYY-MM-DD ou ISO)"),
+    ate: Optional[str] = Query(None, alias="to", description="created_at_utc <= (YYYY-MM-DD inclui o dia)"),
+    gzip: bool = Query(False, description="Compactar (.csv.gz)"),
 ):
     # 1) Valida token interno (não mostrar isso para cliente)
     expected = os.getenv("ASSINATURAS_DEBUG_TOKEN", "")
     if not expected or token != expected:
         raise HTTPException(status_code=401, detail="Não autorizado.")
 
-    # 2) Reaproveita a mesma função que já funciona no JSON
-    rows = listar_assinaturas_debug()  # retorna lista de dicts
+    de_utc, ate_utc = _intervalo_ou_400(de, ate)
 
-    # 3) Monta CSV em memória
-    output = io.StringIO()
-    writer = csv.writer(output, delimiter=";")
+    colunas = [
+        "id",
+        "user_email",
+        "plano",
+        "valor_mensal_centavos",
+        "status",
+        "origem",
+        "billing_provider",
+        "external_id",
+        "data_inicio_utc",
+        "data_prox_cobranca_utc",
+        "data_cancelamento_utc",
+        "created_at_utc",
+        "updated_at_utc",
+    ]
 
-    # Cabeçalho
-    writer.writerow(
-        [
-            "id",
-            "user_email",
-            "plano",
-            "valor_mensal_centavos",
-            "status",
-            "origem",
-            "billing_provider",
-            "external_id",
-            "data_inicio_utc",
-            "data_prox_cobranca_utc",
-            "data_cancelamento_utc",
-            "created_at_utc",
-            "updated_at_utc",
-        ]
+    # 2) Linhas saem do cursor em blocos (memória constante)
+    linhas = (
+        [r.get(c, "") for c in colunas]
+        for r in _assinaturas.iterar_assinaturas(de_utc, ate_utc)
     )
 
-    # Linhas
-    for r in rows:
-        writer.writerow(
-            [
-                r.get("id", ""),
-                r.get("user_email", ""),
-                r.get("plano", ""),
-                r.get("valor_mensal_centavos", ""),
-                r.get("status", ""),
-                r.get("origem", ""),
-                r.get("billing_provider", ""),
-                r.get("external_id", ""),
-                r.get("data_inicio_utc", ""),
-                r.get("data_prox_cobranca_utc", ""),
-                r.get("data_cancelamento_utc", ""),
-                r.get("created_at_utc", ""),
-                r.get("updated_at_utc", ""),
-            ]
-        )
-
-    csv_text = output.getvalue()
-    output.close()
-
-    # 4) Devolve como download
-    return PlainTextResponse(
-        content=csv_text,
-        media_type="text/csv; charset=utf-8",
-        headers={
-            "Content-Disposition": 'attachment; filename="assinaturas_debug.csv"'
-        },
+    # 3) Devolve como download em streaming
+    return _csv_download(
+        csv_em_blocos(colunas, linhas, gzip=gzip), "assinaturas_debug.csv", gzip
     )
 
 
@@ -564,10 +677,97 @@ async def assinaturas_comissoes_por_vendedor(
     if not ASSINATURAS_DEBUG_TOKEN or token != ASSINATURAS_DEBUG_TOKEN:
         raise HTTPException(status_code=401, detail="Não autorizado.")
 
-    data = listar_comissoes_por_vendedor(vendedor_email=vendedor_email)
+    data = _comissoes.listar_comissoes_por_vendedor(vendedor_email=vendedor_email)
     return data
 
 
+_MES_RE = re.compile(r"^\d{4}-(0[1-9]|1[0-2])$")
+
+
+@app.get(
+    "/api/assinaturas/comissoes/resumo",
+    tags=["assinaturas"],
+    summary="Totais de comissão de um vendedor, por mês (interno)",
+)
+async def assinaturas_comissoes_resumo(
+    token: str = Query(..., description="Token interno de acesso"),
+    vendedor_email: str = Query(..., description="E-mail do vendedor (login corporativo)"),
+    de_mes: Optional[str] = Query(None, alias="from", description="Mês inicial YYYY-MM (inclusivo)"),
+    ate_mes: Optional[str] = Query(None, alias="to", description="Mês final YYYY-MM (inclusivo)"),
+):
+    """
+    Totais (bruto, desconto, líquido, comissão) + quebra mensal, sem listar
+    as assinaturas. Lido de comissoes_totais_mensais.
+    """
+    _check_debug_token(token)
+    for v in (de_mes, ate_mes):
+        if v and not _MES_RE.match(v):
+            raise HTTPException(status_code=400, detail="Mês inválido (use YYYY-MM).")
+    return _comissoes.totais_comissao_vendedor(vendedor_email, de_mes, ate_mes)
+
+
+@app.get(
+    "/api/assinaturas/comissoes/relatorio",
+    tags=["assinaturas"],
+    summary="Fechamento de comissões de todos os vendedores (interno)",
+)
+async def assinaturas_comissoes_relatorio(
+    token: str = Query(..., description="Token interno de acesso"),
+    de_mes: Optional[str] = Query(None, alias="from", description="Mês inicial YYYY-MM (inclusivo)"),
+    ate_mes: Optional[str] = Query(None, alias="to", description="Mês final YYYY-MM (inclusivo)"),
+    formato: str = Query("json", alias="format", pattern="^(json|csv)$"),
+    gzip: bool = Query(False, description="Compactar (.csv.gz), só com format=csv"),
+):
+    """
+    Uma seção por vendedor (meses + total) para o período, numa consulta só
+    em vez de um /comissoes por vendedor. Cache por período, invalidado a
+    cada nova assinatura com vendedor.
+
+    format=csv sai em streaming: linhas por mês, "TOTAL" por vendedor e
+    "TOTAL GERAL" no fim.
+    """
+    _check_debug_token(token)
+    for v in (de_mes, ate_mes):
+        if v and not _MES_RE.match(v):
+            raise HTTPException(status_code=400, detail="Mês inválido (use YYYY-MM).")
+
+    secoes = _comissoes.relatorio_comissoes(de_mes, ate_mes)
+    if formato == "csv":
+        nome = "comissoes_{}_{}.csv".format(de_mes or "inicio", ate_mes or "hoje")
+        return _csv_download(
+            csv_em_blocos(
+                _comissao_totais.CABECALHO_RELATORIO,
+                _comissao_totais.linhas_relatorio(secoes),
+                gzip=gzip,
+            ),
+            nome,
+            gzip,
+        )
+    return {"from": de_mes, "to": ate_mes, "vendedores": secoes}
+
+
+@app.get(
+    "/api/assinaturas/comissoes/page",
+    tags=["assinaturas"],
+    summary="Comissões de um vendedor paginadas por cursor (interno)",
+)
+async def assinaturas_comissoes_pagina(
+    token: str = Query(..., description="Token interno de acesso"),
+    vendedor_email: str = Query(..., description="E-mail do vendedor (login corporativo)"),
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: Optional[str] = Query(None, description="next_cursor da página anterior"),
+):
+    """
+    Itens de /api/assinaturas/comissoes em páginas (mais novos primeiro).
+    Retorna {"items": [...], "next_cursor": ...}; `next_cursor` null = fim.
+    """
+    _check_debug_token(token)
+    try:
+        return _comissoes.listar_comissoes_pagina(vendedor_email, limit=limit, cursor=cursor)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Cursor inválido.")
+
+
 @app.get(
     "/api/assinaturas/comissoes/csv",
     summary="(DEBUG) Exportar comissões de um vendedor em CSV",
@@ -575,19 +775,15 @@ async def assinaturas_comissoes_por_vendedor(
 async def assinaturas_comissoes_csv(
     token: str = Query(..., description="Token interno de acesso"),
     vendedor_email: str = Query(..., description="E-mail do vendedor"),
+    de: Optional[str] = Query(None, alias="from", description="created_at_utc >= (YYYY-MM-DD ou ISO)"),
+    ate: Optional[str] = Query(None, alias="to", description="created_at_utc <= (YYYY-MM-DD inclui o dia)"),
+    gzip: bool = Query(False, description="Compactar (.csv.gz)"),
 ):
     # Valida token interno (mesmo esquema do /api/assinaturas/debug)
     _check_debug_token(token)
+    de_utc, ate_utc = _intervalo_ou_400(de, ate)
 
-    # Busca as assinaturas desse vendedor
-    rows = listar_comissoes_por_vendedor(vendedor_email)
-
-    # Prepara CSV em memória
-    output = io.StringIO()
-    writer = csv.writer(output, delimiter=";")
-
-    # Cabeçalho
-    writer.writerow([
+    cabecalho = [
         "id",
         "user_email",
         "plano",
@@ -599,97 +795,67 @@ async def assinaturas_comissoes_csv(
         "status",
         "data_inicio_utc",
         "created_at_utc",
-    ])
-
-    total_bruto = 0
-    total_desc = 0
-    total_liq = 0
-    total_com = 0
-
-    for row in rows:
-        # Garante que não quebra se faltar algum campo
-        valor_bruto = int(row.get("valor_mensal_centavos", 0) or 0)
-        desconto = int(row.get("desconto_centavos", 0) or 0)
-        # se não tiver salvo valor_liquido, calcula bruto - desconto
-        valor_liq = int(row.get("valor_liquido_centavos", valor_bruto - desconto) or 0)
-        comissao = int(row.get("comissao_centavos", 0) or 0)
-
-        total_bruto += valor_bruto
-        total_desc += desconto
-        total_liq += valor_liq
-        total_com += comissao
-
-        writer.writerow([
-            row.get("id", ""),
-            row.get("user_email", ""),
-            row.get("plano", ""),
-            row.get("vendedor_email", ""),
-            valor_bruto,
-            desconto,
-            valor_liq,
-            comissao,
-            row.get("status", ""),
-            row.get("data_inicio_utc", ""),
-            row.get("created_at_utc", ""),
-        ])
-
-    # Linha de totais
-    writer.writerow([
-        "TOTAL",
-        "",
-        "",
-        vendedor_email,
-        total_bruto,
-        total_desc,
-        total_liq,
-        total_com,
-        "",
-        "",
-        "",
-    ])
-
-    csv_content = output.getvalue()
+    ]
+
+    def _linhas():
+        total_bruto = 0
+        total_desc = 0
+        total_liq = 0
+        total_com = 0
+
+        for row in _comissoes.iterar_comissoes_por_vendedor(vendedor_email, de_utc, ate_utc):
+            # Garante que não quebra se faltar algum campo
+            valor_bruto = int(row.get("valor_mensal_centavos", 0) or 0)
+            desconto = int(row.get("desconto_centavos", 0) or 0)
+            # se não tiver salvo valor_liquido, calcula max(bruto - desconto, 0)
+            valor_liq = int(
+                row.get("valor_liquido_centavos", _comissao_totais.valor_liquido(valor_bruto, desconto)) or 0
+            )
+            comissao = int(row.get("comissao_centavos", 0) or 0)
+
+            total_bruto += valor_bruto
+            total_desc += desconto
+            total_liq += valor_liq
+            total_com += comissao
+
+            yield [
+                row.get("id", ""),
+                row.get("user_email", ""),
+                row.get("plano", ""),
+                row.get("vendedor_email", ""),
+                valor_bruto,
+                desconto,
+                valor_liq,
+                comissao,
+                row.get("status", ""),
+                row.get("data_inicio_utc", ""),
+                row.get("created_at_utc", ""),
+            ]
+
+        # Linha de totais (acumulada durante o streaming)
+        yield [
+            "TOTAL",
+            "",
+            "",
+            vendedor_email,
+            total_bruto,
+            total_desc,
+            total_liq,
+            total_com,
+            "",
+            "",
+            "",
+        ]
 
     # Nome “seguro” pro arquivo (sem @ e .)
     safe_email = vendedor_email.replace("@", "_").replace(".", "_")
     filename = f"comissoes_{safe_email}.csv"
 
-    return PlainTextResponse(
-        content=csv_content,
-        media_type="text/csv; charset=utf-8",
-        headers={
-            "Content-Disposition": f'attachment; filename="{filename}"'
-        },
-    )
+    return _csv_download(csv_em_blocos(cabecalho, _linhas(), gzip=gzip), filename, gzip)
 
 
 def _central_users_env() -> dict:
-    # garante que backend/.env seja carregado também
-    try:
-        auth_central._load_env_from_file()
-    except Exception:
-        pass
-
-    users = {}
-    raw = (os.getenv("CENTRAL_USERS", "") or "").strip()
-    if raw:
-        for item in raw.split(";"):
-            item = item.strip()
-            if not item or ":" not in item:
-                continue
-            u, p = item.split(":", 1)
-            u = u.strip()
-            p = p.strip()
-            if u and p:
-                users[u] = p
-
-    # fallback opcional (se existir)
-    u1 = (os.getenv("CENTRAL_USER", "") or "").strip()
-    p1 = (os.getenv("CENTRAL_PASS", "") or "").strip()
-    if u1 and p1 and u1 not in users:
-        users[u1] = p1
-
-    return users
+    return dict(settings().central.users)
 
 
 def _render_central_login_html(error: str = "") -> str:
@@ -783,6 +949,11 @@ def central_login_do(
 
 @app.get("/central/logout")
 def central_logout(request: Request):
+    # revoga no DB (e no cache de sessões) antes de limpar o cookie
+    token = request.cookies.get(CENTRAL_COOKIE_NAME) or ""
+    if token:
+        revoke_central_session(token)
+
     resp = RedirectResponse(url="/central/login", status_code=302)
     clear_central_session_cookie(resp)
     return resp
@@ -902,7 +1073,9 @@ async def tracking_public(session_id: str):
 # DB helpers (SQLite)
 # ---------------------------------------------------------
 def db() -> sqlite3.Connection:
-    conn = sqlite3.connect(DB_PATH, check_same_thread=False)
+    conn = sqlite3.connect(
+        DB_PATH, check_same_thread=False, factory=ConexaoInstrumentada
+    )
     conn.row_factory = sqlite3.Row
     return conn
 
@@ -951,6 +1124,7 @@ def db_init():
             created_at TEXT NOT NULL,
             expires_at TEXT NOT NULL
         );
+        CREATE INDEX IF NOT EXISTS idx_email_tokens_exp ON email_tokens(expires_at);
 
         CREATE TABLE IF NOT EXISTS consents (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -972,6 +1146,7 @@ def db_init():
             birthdate TEXT,
             created_at TEXT NOT NULL
         );
+        CREATE INDEX IF NOT EXISTS idx_profiles_user ON profiles(user_id);
 
         ----------------------------------------------------------------------
         -- MÉTRICAS
@@ -1044,6 +1219,96 @@ def db_init():
         CREATE INDEX IF NOT EXISTS idx_sms_dlr_msg ON sms_dlr(message_id);
         CREATE INDEX IF NOT EXISTS idx_sms_dlr_received ON sms_dlr(received_at);
 
+        ----------------------------------------------------------------------
+        -- LOG DE SOS (append-only) + LEDGER DE ENVIOS
+        -- sos_audit / metrics_events / sos_events são projeções do log
+        -- (services/sos_projector.py); o ledger tem 1 linha por
+        -- destinatário/canal de cada SOS.
+        ----------------------------------------------------------------------
+        CREATE TABLE IF NOT EXISTS sos_event_log (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            created_at TEXT NOT NULL,
+            user_id INTEGER,
+            phone TEXT,
+            payload_json TEXT NOT NULL,
+            lat REAL,
+            lon REAL,
+            tracking_id TEXT,
+            tracking_url TEXT,
+            dispatch_json TEXT,
+            dispatched_at TEXT,
+            projected_at TEXT
+        );
+        CREATE INDEX IF NOT EXISTS idx_sos_event_log_pending
+            ON sos_event_log(id) WHERE projected_at IS NULL;
+
+        -- SOS repetidos (retry/toques) respondidos sem novo disparo
+        -- (services/sos_idempotencia.py)
+        CREATE TABLE IF NOT EXISTS sos_duplicates (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            sos_id INTEGER,
+            idem_key TEXT NOT NULL,
+            key_source TEXT NOT NULL,
+            phone TEXT,
+            payload_json TEXT NOT NULL,
+            created_at TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_sos_duplicates_sos ON sos_duplicates(sos_id);
+
+        -- Reserva da chave de idempotência do SOS, vale para todos os workers
+        -- (services/sos_idempotencia.py; state: pending | done | failed)
+        CREATE TABLE IF NOT EXISTS sos_idempotency (
+            idem_key TEXT PRIMARY KEY,
+            key_source TEXT NOT NULL,
+            lat REAL,
+            lon REAL,
+            state TEXT NOT NULL,
+            sos_id INTEGER,
+            tracking_url TEXT,
+            status_code INTEGER,
+            response_json TEXT,
+            created_at TEXT NOT NULL,
+            expires_at TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_sos_idempotency_expires
+            ON sos_idempotency(expires_at);
+
+        -- Rollups de SOS (services/sos_rollup.py)
+        CREATE TABLE IF NOT EXISTS sos_rollup_hourly (
+            bucket TEXT NOT NULL,
+            phone TEXT NOT NULL,
+            channel TEXT NOT NULL,
+            outcome TEXT NOT NULL,
+            total INTEGER NOT NULL,
+            first_at TEXT NOT NULL,
+            last_at TEXT NOT NULL,
+            PRIMARY KEY (bucket, phone, channel, outcome)
+        ) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS sos_rollup_daily (
+            bucket TEXT NOT NULL,
+            phone TEXT NOT NULL,
+            channel TEXT NOT NULL,
+            outcome TEXT NOT NULL,
+            total INTEGER NOT NULL,
+            first_at TEXT NOT NULL,
+            last_at TEXT NOT NULL,
+            PRIMARY KEY (bucket, phone, channel, outcome)
+        ) WITHOUT ROWID;
+
+        CREATE TABLE IF NOT EXISTS send_ledger (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            sos_id INTEGER NOT NULL,
+            channel TEXT NOT NULL,
+            recipient TEXT,
+            provider_message_id TEXT,
+            status TEXT NOT NULL,
+            detail TEXT,
+            sent_at TEXT NOT NULL,
+            updated_at TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_send_ledger_sos ON send_ledger(sos_id);
+        CREATE INDEX IF NOT EXISTS idx_send_ledger_msg ON send_ledger(provider_message_id);
+
         ----------------------------------------------------------------------
         -- SESSÕES DE LIVE LOCATION (Telegram live)
         ----------------------------------------------------------------------
@@ -1063,6 +1328,7 @@ def db_init():
         );
         CREATE INDEX IF NOT EXISTS idx_live_chat ON live_sessions(chat_id);
         CREATE INDEX IF NOT EXISTS idx_live_active ON live_sessions(active);
+        CREATE INDEX IF NOT EXISTS idx_live_expires ON live_sessions(expires_at);
 
         ----------------------------------------------------------------------
         -- TRILHA DO MAPA (live_track_points)
@@ -1087,6 +1353,15 @@ def db_init():
             con.execute("ALTER TABLE sos_audit ADD COLUMN phone TEXT")
         except Exception:
             pass
+        con.execute(
+            "CREATE INDEX IF NOT EXISTS idx_sos_audit_phone_created ON sos_audit(phone, created_at)"
+        )
+        # sos_event_log.id do SOS projetado (correção de resultado tardio)
+        try:
+            con.execute("ALTER TABLE sos_audit ADD COLUMN sos_id INTEGER")
+        except Exception:
+            pass
+        con.execute("CREATE INDEX IF NOT EXISTS idx_sos_audit_sos ON sos_audit(sos_id)")
 
         try:
             con.execute("ALTER TABLE metrics_events ADD COLUMN phone TEXT")
@@ -1133,43 +1408,29 @@ def db_init():
         """
         )
 
+BOOT.marco("modulo")
 db_init()
+BOOT.marco("db_init")
 
+# iniciar() (SELECT MAX + reprocessar pendentes) roda no fim da subida, em
+# background; um SOS antes disso chama notificar(), que também inicia.
+SOS_PROJECTOR = SosProjector(db, registrar_sos_event)
 
-# ---------------------------------------------------------
-# Utils: password hash
-# ---------------------------------------------------------
-def _hash_password(pwd: str, salt: Optional[bytes] = None) -> Tuple[str, str]:
-    salt = salt or secrets.token_bytes(16)
-    dk = hashlib.pbkdf2_hmac("sha256", pwd.encode("utf-8"), salt, 120000)
-    return base64.b64encode(dk).decode(), base64.b64encode(salt).decode()
-
-
-def _verify_password(pwd: str, b64hash: str, b64salt: str) -> bool:
-    salt = base64.b64decode(b64salt)
-    dk2, _ = _hash_password(pwd, salt)
-    return hmac.compare_digest(dk2, b64hash)
+# Limpeza periódica de sessões/tokens vencidos (services/manutencao.py)
+MANUTENCAO = Manutencao(db)
+MANUTENCAO.iniciar()
+atexit.register(MANUTENCAO.parar)
 
 
 # ---------------------------------------------------------
-# Templates Telegram
+# Utils: password hash -> services/senhas.py (executor limitado, formato
+# pbkdf2_sha256$iter$salt$hash, compatível com os hashes antigos)
 # ---------------------------------------------------------
-TEMPLATES_DIR = os.path.normpath(os.path.join(BASE_DIR, "..", "templates"))
-TG_SOS_TEMPLATE_PATH = os.path.join(TEMPLATES_DIR, "tg_sos.html")
-_DEFAULT_TG_SOS = "<b>🚨 SOS - ANJO DA GUARDA</b>\n$TEXT_LINE\n$MAPS_LINE"
-try:
-    with open(TG_SOS_TEMPLATE_PATH, "r", encoding="utf-8") as f:
-        _TG_SOS_TEMPLATE = Template(f.read())
-except FileNotFoundError:
-    _TG_SOS_TEMPLATE = Template(_DEFAULT_TG_SOS)
 
 
-def render_tg_sos_html(user_text: Optional[str], maps_link: Optional[str]) -> str:
-    text_line = _html.escape(user_text) if user_text else ""
-    maps_line = _html.escape(maps_link) if maps_link else ""
-    return _TG_SOS_TEMPLATE.safe_substitute(
-        TEXT_LINE=text_line, MAPS_LINE=maps_line
-    ).strip()
+# ---------------------------------------------------------
+# Templates do SOS (todos os canais) -> services/mensagens_sos.py
+# ---------------------------------------------------------
 
 
 # ---------------------------------------------------------
@@ -1185,40 +1446,47 @@ def _msisdn_clean(s: str) -> str:
 
 
 def _wa_headers_and_proxy():
-    token = os.getenv("ZENVIA_API_TOKEN", "").strip()
-    if not token:
+    z = settings().zenvia
+    if not z.api_token:
         raise RuntimeError("WA_NO_TOKEN")
     headers = {
         "Content-Type": "application/json",
         "Accept": "application/json",
-        "X-API-Token": token,
+        "X-API-Token": z.api_token,
         "User-Agent": "curl/8.4.0",
     }
-    proxy = os.getenv("ZENVIA_HTTP_PROXY") or os.getenv("HTTPS_PROXY") or os.getenv(
-        "HTTP_PROXY"
-    )
-    proxies = {"http": proxy, "https": proxy} if proxy else None
+    proxies = {"http": z.proxy, "https": z.proxy} if z.proxy else None
     return headers, proxies
 
 
 def send_wa_zenvia_once(_from: str, to: str, text: str) -> dict:
     urllib3_cn.allowed_gai_family = lambda: socket.AF_INET
-    url = "https://api.zenvia.com/v2/channels/whatsapp/messages"
+    url = f"{zenvia_base_url()}/channels/whatsapp/messages"
     payload = {"from": _from, "to": to, "contents": [{"type": "text", "text": text[:700]}]}
-    cb = (os.getenv("ZENVIA_WA_CALLBACK_URL") or os.getenv("ZENVIA_CALLBACK_URL") or "").strip()
+    cb = settings().zenvia.wa_callback_url
     if cb:
         payload["callbackUrl"] = cb
 
     headers, proxies = _wa_headers_and_proxy()
-    try:
-        resp = requests.post(url, headers=headers, json=payload, timeout=20, proxies=proxies)
-        ok = 200 <= resp.status_code < 300
-        raw = resp.text
-        logger.info("[WA] TEXT to=%s status=%s ok=%s resp=%s", to, resp.status_code, ok, raw)
-        return {"ok": ok, "status": resp.status_code, "response": raw, "to": to}
-    except Exception as e:
-        logger.error("[WA] TEXT EXC to=%s %s", to, e)
-        return {"ok": False, "reason": str(e), "to": to}
+
+    def _post() -> dict:
+        try:
+            resp = zenvia_session().post(url, headers=headers, json=payload, timeout=20, proxies=proxies)
+            ok = 200 <= resp.status_code < 300
+            raw = resp.text
+            logger.info("[WA] TEXT to=%s status=%s ok=%s resp=%s", to, resp.status_code, ok, raw)
+            return {
+                "ok": ok,
+                "status": resp.status_code,
+                "response": raw,
+                "to": to,
+                "message_id": zenvia_message_id(raw) if ok else None,
+            }
+        except Exception as e:
+            logger.error("[WA] TEXT EXC to=%s %s", to, e)
+            return {"ok": False, "reason": str(e), "to": to}
+
+    return proteger("whatsapp", _post, {"to": to})
 
 
 def send_wa_template_zenvia_once(
@@ -1228,56 +1496,62 @@ def send_wa_template_zenvia_once(
     if not template_id:
         raise RuntimeError("WA_NO_TEMPLATE_ID")
 
-    url = "https://api.zenvia.com/v2/channels/whatsapp/messages"
+    url = f"{zenvia_base_url()}/channels/whatsapp/messages"
     f = {k: ("" if v is None else str(v)) for k, v in (fields or {}).items()}
     payload = {
         "from": _from,
         "to": _msisdn_clean(to),
         "contents": [{"type": "template", "templateId": template_id, "fields": f}],
     }
-    cb = (os.getenv("ZENVIA_WA_CALLBACK_URL") or os.getenv("ZENVIA_CALLBACK_URL") or "").strip()
+    cb = settings().zenvia.wa_callback_url
     if cb:
         payload["callbackUrl"] = cb
 
     headers, proxies = _wa_headers_and_proxy()
     logger.warning("[WA DEBUG PAYLOAD] %s", json.dumps(payload, ensure_ascii=False))
 
-    try:
-        resp = requests.post(url, headers=headers, json=payload, timeout=20, proxies=proxies)
-        ok = 200 <= resp.status_code < 300
-        raw = resp.text
-        logger.info("[WA] TPL  to=%s status=%s ok=%s resp=%s", to, resp.status_code, ok, raw)
-        return {"ok": ok, "status": resp.status_code, "response": raw, "to": to}
-    except Exception as e:
-        logger.error("[WA] TPL  EXC to=%s %s", to, e)
-        return {"ok": False, "reason": str(e), "to": to}
+    def _post() -> dict:
+        try:
+            resp = zenvia_session().post(url, headers=headers, json=payload, timeout=20, proxies=proxies)
+            ok = 200 <= resp.status_code < 300
+            raw = resp.text
+            logger.info("[WA] TPL  to=%s status=%s ok=%s resp=%s", to, resp.status_code, ok, raw)
+            return {
+                "ok": ok,
+                "status": resp.status_code,
+                "response": raw,
+                "to": to,
+                "message_id": zenvia_message_id(raw) if ok else None,
+            }
+        except Exception as e:
+            logger.error("[WA] TPL  EXC to=%s %s", to, e)
+            return {"ok": False, "reason": str(e), "to": to}
+
+    return proteger("whatsapp", _post, {"to": to})
 
 
 def send_wa_to_numbers(
     numbers: List[str], text: str, tpl_fields: Optional[Dict[str, Any]] = None
 ) -> List[dict]:
-    from_alias = (os.getenv("ZENVIA_WA_FROM") or os.getenv("ZENVIA_WHATSAPP_FROM") or "").strip()
+    z = settings().zenvia
+    from_alias = z.wa_from
     if not from_alias:
         return [{"ok": False, "reason": "WA_FROM_MISSING"}]
-    template_id = (os.getenv("ZENVIA_WA_TEMPLATE_ID") or "").strip()
-    use_simple = (
-        os.getenv("ZENVIA_WA_SIMPLE", "false").lower() in ("1", "true", "yes", "on")
-    )
+    template_id = z.wa_template_id
+    use_simple = z.wa_simple
     logger.warning(
         "[WA CHOICE] use_simple=%s template_id=%s tpl_fields=%s",
         use_simple,
         template_id,
         json.dumps(tpl_fields, ensure_ascii=False) if tpl_fields else None,
     )
-    results = []
-    for raw in numbers:
-        to = _msisdn_clean(raw)
+    def _enviar(to: str) -> dict:
         if not use_simple and template_id and tpl_fields:
-            r = send_wa_template_zenvia_once(from_alias, to, template_id, tpl_fields)
-        else:
-            r = send_wa_zenvia_once(from_alias, to, (text or "")[:700])
-        results.append(r)
-    return results
+            return send_wa_template_zenvia_once(from_alias, to, template_id, tpl_fields)
+        return send_wa_zenvia_once(from_alias, to, (text or "")[:700])
+
+    # todos os contatos em paralelo (1 resultado por número, mesma ordem)
+    return enviar_em_lote([_msisdn_clean(raw) for raw in numbers], _enviar)
 
 
 # ---------------------------------------------------------
@@ -1294,13 +1568,13 @@ def send_email(subject: str, body: str, to_list: Optional[List[str]] = None) ->
         return {"ok": False, "reason": "EMAIL_NO_RECIPIENTS"}
 
     msg = EmailMessage()
-    from_name = (os.getenv("EMAIL_FROM_NAME") or "").strip()
+    from_name = CFG.email_from_name
     from_addr = CFG.email_from
     msg["From"] = formataddr((from_name, from_addr)) if from_name else from_addr
     msg["To"] = ", ".join(to_list)
     msg["Subject"] = subject
     msg["Date"] = formatdate(localtime=True)
-    reply_to = (os.getenv("EMAIL_REPLY_TO") or "").strip()
+    reply_to = CFG.email_reply_to
     if reply_to:
         msg["Reply-To"] = reply_to
     msg["Sender"] = CFG.smtp_user
@@ -1325,130 +1599,139 @@ def send_email(subject: str, body: str, to_list: Optional[List[str]] = None) ->
             s.login(CFG.smtp_user, CFG.smtp_pass)
             s.send_message(msg)
 
-    tried = []
-    try:
-        if int(CFG.smtp_port) == 465:
-            _via_ssl465()
-            logger.info("[EMAIL] OK via SSL465 to=%s", to_list)
-            return {"ok": True, "mode": "SSL465"}
-        else:
-            _via_starttls()
-            logger.info("[EMAIL] OK via STARTTLS to=%s", to_list)
-            return {"ok": True, "mode": "STARTTLS"}
-    except Exception as e1:
-        tried.append(f"{type(e1).__name__}: {e1}")
-        if int(CFG.smtp_port) != 465:
-            logger.warning("[EMAIL] STARTTLS falhou (%s); fallback para SSL:465 ...", e1)
-            try:
+    def _smtp() -> Dict[str, Any]:
+        tried = []
+        try:
+            if int(CFG.smtp_port) == 465:
                 _via_ssl465()
-                logger.info("[EMAIL] OK via SSL465 (fallback) to=%s", to_list)
-                return {"ok": True, "mode": "SSL465_FALLBACK"}
-            except Exception as e2:
-                tried.append(f"{type(e2).__name__}: {e2}")
-
-        logger.error(
-            "[EMAIL] FALHA DEFINITIVA host=%s port=%s user=%s from=%s err=%s",
-            CFG.smtp_host,
-            CFG.smtp_port,
-            CFG.smtp_user,
-            from_addr,
-            " | ".join(tried),
-        )
-        return {"ok": False, "reason": "EMAIL_SEND_FAILED", "errors": tried}
+                logger.info("[EMAIL] OK via SSL465 to=%s", to_list)
+                return {"ok": True, "mode": "SSL465"}
+            else:
+                _via_starttls()
+                logger.info("[EMAIL] OK via STARTTLS to=%s", to_list)
+                return {"ok": True, "mode": "STARTTLS"}
+        except Exception as e1:
+            tried.append(f"{type(e1).__name__}: {e1}")
+            if int(CFG.smtp_port) != 465:
+                logger.warning("[EMAIL] STARTTLS falhou (%s); fallback para SSL:465 ...", e1)
+                try:
+                    _via_ssl465()
+                    logger.info("[EMAIL] OK via SSL465 (fallback) to=%s", to_list)
+                    return {"ok": True, "mode": "SSL465_FALLBACK"}
+                except Exception as e2:
+                    tried.append(f"{type(e2).__name__}: {e2}")
+
+            logger.error(
+                "[EMAIL] FALHA DEFINITIVA host=%s port=%s user=%s from=%s err=%s",
+                CFG.smtp_host,
+                CFG.smtp_port,
+                CFG.smtp_user,
+                from_addr,
+                " | ".join(tried),
+            )
+            return {"ok": False, "reason": "EMAIL_SEND_FAILED", "errors": tried}
+
+    res = proteger("email", _smtp, {})
+    res.setdefault("to", to_list)
+    return res
 
 
 # ---------------------------------------------------------
 # SMS Zenvia (legado/env)
 # ---------------------------------------------------------
 def _resolve_sms_sender() -> str:
-    return (os.getenv("ZENVIA_SMS_FROM") or os.getenv("ZENVIA_FROM") or "glaucusmotta").strip()
+    return settings().zenvia.sms_from
 
 
 def send_sms_zenvia_once(_from: str, to: str, text: str) -> dict:
     urllib3_cn.allowed_gai_family = lambda: socket.AF_INET
 
-    token = os.getenv("ZENVIA_API_TOKEN", "").strip()
-    if not token:
+    z = settings().zenvia
+    if not z.api_token:
         logger.error("[SMS] NO_TOKEN")
         return {"ok": False, "reason": "NO_TOKEN", "to": to}
 
-    url = "https://api.zenvia.com/v2/channels/sms/messages"
+    url = f"{zenvia_base_url()}/channels/sms/messages"
     payload = {"from": _from, "to": to, "contents": [{"type": "text", "text": text[:700]}]}
-    cb = (os.getenv("ZENVIA_CALLBACK_URL") or "").strip()
-    if cb:
-        payload["callbackUrl"] = cb
+    if z.callback_url:
+        payload["callbackUrl"] = z.callback_url
 
     headers = {
         "Content-Type": "application/json",
         "Accept": "application/json",
-        "X-API-Token": token,
+        "X-API-Token": z.api_token,
         "User-Agent": "curl/8.4.0",
     }
 
-    proxy = os.getenv("ZENVIA_HTTP_PROXY") or os.getenv("HTTPS_PROXY") or os.getenv(
-        "HTTP_PROXY"
-    )
-    proxies = {"http": proxy, "https": proxy} if proxy else None
+    proxies = {"http": z.proxy, "https": z.proxy} if z.proxy else None
 
-    try:
-        resp = requests.post(url, headers=headers, json=payload, timeout=20, proxies=proxies)
-        ok = 200 <= resp.status_code < 300
-        raw = resp.text
-
-        if resp.status_code == 403 and "Attention Required" in raw:
-            m = re.search(r"Ray ID:\s*<strong[^>]*>([^<]+)</strong>", raw)
-            ray = m.group(1) if m else None
-            logger.error("[SMS] CLOUDFLARE_WAF_BLOCK to=%s ray=%s", to, ray)
+    def _post() -> dict:
+        try:
+            resp = zenvia_session().post(url, headers=headers, json=payload, timeout=20, proxies=proxies)
+            ok = 200 <= resp.status_code < 300
+            raw = resp.text
+
+            if resp.status_code == 403 and "Attention Required" in raw:
+                m = re.search(r"Ray ID:\s*<strong[^>]*>([^<]+)</strong>", raw)
+                ray = m.group(1) if m else None
+                logger.error("[SMS] CLOUDFLARE_WAF_BLOCK to=%s ray=%s", to, ray)
+                return {
+                    "ok": False,
+                    "status": 403,
+                    "reason": "CLOUDFLARE_WAF_BLOCK",
+                    "ray_id": ray,
+                    "to": to,
+                }
+
+            logger.info("[SMS] to=%s status=%s ok=%s resp=%s", to, resp.status_code, ok, raw)
             return {
-                "ok": False,
-                "status": 403,
-                "reason": "CLOUDFLARE_WAF_BLOCK",
-                "ray_id": ray,
+                "ok": ok,
+                "status": resp.status_code,
+                "response": raw,
                 "to": to,
+                "message_id": zenvia_message_id(raw) if ok else None,
             }
+        except Exception as e:
+            logger.error("[SMS] EXC to=%s %s", to, e)
+            return {"ok": False, "reason": str(e), "to": to}
 
-        logger.info("[SMS] to=%s status=%s ok=%s resp=%s", to, resp.status_code, ok, raw)
-        return {"ok": ok, "status": resp.status_code, "response": raw, "to": to}
-    except Exception as e:
-        logger.error("[SMS] EXC to=%s %s", to, e)
-        return {"ok": False, "reason": str(e), "to": to}
+    # WAF/timeout em sequência abre o circuito: os próximos SOS não esperam 20 s
+    return proteger("sms", _post, {"to": to})
 
 
 def send_sms_zenvia_list(text: str) -> list:
     from_alias = _resolve_sms_sender()
-    to_list = [
-        x.strip() for x in os.getenv("ZENVIA_SMS_TO_LIST", "").split(",") if x.strip()
-    ]
-    results = []
-    for to_raw in to_list:
-        results.append(send_sms_zenvia_once(from_alias, _msisdn_clean(to_raw), text))
-    return results
+    return enviar_em_lote(
+        [_msisdn_clean(to_raw) for to_raw in settings().zenvia.sms_to_list],
+        lambda to: send_sms_zenvia_once(from_alias, to, text),
+    )
 
 
 # ---------------------------------------------------------
 # WA Zenvia (legado/env)
 # ---------------------------------------------------------
 def send_wa_zenvia_list(text: str) -> list:
-    from_alias = (os.getenv("ZENVIA_WA_FROM") or os.getenv("ZENVIA_WHATSAPP_FROM") or "").strip()
-    to_raw = (os.getenv("ZENVIA_WA_TO_LIST") or os.getenv("ZENVIA_WHATSAPP_TO_LIST") or "").strip()
-    to_list = [x.strip() for x in to_raw.split(",") if x.strip()]
-    results = []
-    for to in to_list:
-        results.append(send_wa_zenvia_once(from_alias, _msisdn_clean(to), text))
-    return results
+    z = settings().zenvia
+    from_alias = z.wa_from
+    return enviar_em_lote(
+        [_msisdn_clean(to) for to in z.wa_to_list],
+        lambda to: send_wa_zenvia_once(from_alias, to, text),
+    )
 
 
 def send_wa_zenvia_list_template(fields: Dict[str, Any]) -> list:
-    from_alias = (os.getenv("ZENVIA_WA_FROM") or os.getenv("ZENVIA_WHATSAPP_FROM") or "").strip()
-    to_raw = (os.getenv("ZENVIA_WA_TO_LIST") or os.getenv("ZENVIA_WHATSAPP_TO_LIST") or "").strip()
-    template_id = (os.getenv("ZENVIA_WA_TEMPLATE_ID") or "").strip()
-    to_list = [x.strip() for x in to_raw.split(",") if x.strip()]
-    results = []
-    for to in to_list:
-        results.append(
-            send_wa_template_zenvia_once(from_alias, _msisdn_clean(to), template_id, fields)
-        )
-    return results
+    z = settings().zenvia
+    from_alias = z.wa_from
+    template_id = z.wa_template_id
+    to_list = z.wa_to_list
+    # erros de configuração continuam subindo (api_sos cai para texto)
+    if not template_id:
+        raise RuntimeError("WA_NO_TEMPLATE_ID")
+    _wa_headers_and_proxy()
+    return enviar_em_lote(
+        [_msisdn_clean(to) for to in to_list],
+        lambda to: send_wa_template_zenvia_once(from_alias, to, template_id, fields),
+    )
 
 
 # ---------------------------------------------------------
@@ -1475,94 +1758,150 @@ def _parse_chat_ids_from_env() -> List[str]:
     return valid
 
 
-def _send_telegram_once(
-    chat_id: str,
-    text: str,
-    reply_markup: Optional[Dict[str, Any]] = None,
-    parse_mode: Optional[str] = "HTML",
-) -> Dict[str, Any]:
-    if not CFG.tg_enabled:
-        return {"ok": False, "reason": "TELEGRAM_DISABLED", "chat_id": chat_id}
-    if not CFG.tg_token:
-        return {"ok": False, "reason": "TELEGRAM_MISSING_TOKEN", "chat_id": chat_id}
+# Agendador único da Bot API (limite global + por chat + retry_after do 429)
+TG_SCHEDULER = TelegramScheduler(
+    global_rate=CFG.tg_global_rate,
+    per_chat_rate=CFG.tg_per_chat_rate,
+    per_chat_burst=CFG.tg_per_chat_burst,
+    max_workers=CFG.tg_workers,
+    max_retries=CFG.tg_max_retries,
+)
 
-    txt = (text or "").strip()
-    if not txt:
-        return {"ok": False, "reason": "TEXT_EMPTY", "chat_id": chat_id}
 
-    url = f"https://api.telegram.org/bot{CFG.tg_token}/sendMessage"
-    payload: Dict[str, Any] = {
-        "chat_id": chat_id,
-        "text": txt[:4096],
-        "disable_web_page_preview": True,
-    }
-    if parse_mode:
-        payload["parse_mode"] = parse_mode
-    if reply_markup:
-        payload["reply_markup"] = json.dumps(reply_markup, ensure_ascii=False)
+def _tg_retry_after(raw: str) -> Optional[float]:
+    try:
+        j = json.loads(raw or "{}")
+        ra = (j.get("parameters") or {}).get("retry_after")
+        return float(ra) if ra is not None else None
+    except Exception:
+        return None
+
+
+def _tg_falha(res: Dict[str, Any]) -> bool:
+    # 429 é limite nosso (o agendador trata) e 400/403 costumam ser
+    # chat inválido/bot bloqueado: nenhum dos dois é indisponibilidade.
+    if res.get("ok") or res.get("status") in (400, 403, 429):
+        return False
+    return falha_provedor(res)
+
+
+def _tg_http(method: str, payload: Dict[str, Any], chat_id: str, tag: str) -> Dict[str, Any]:
+    """
+    Faz a chamada HTTP à Bot API (executada pelas threads do TG_SCHEDULER),
+    protegida pelo circuit breaker "telegram".
+    Em 429, devolve `retry_after` para o agendador reenfileirar.
+    """
+    return proteger(
+        "telegram",
+        lambda: _tg_http_raw(method, payload, chat_id, tag),
+        {"chat_id": chat_id},
+        _tg_falha,
+    )
+
 
+def _tg_http_raw(method: str, payload: Dict[str, Any], chat_id: str, tag: str) -> Dict[str, Any]:
+    url = f"https://api.telegram.org/bot{CFG.tg_token}/{method}"
     data = urlencode(payload).encode("utf-8")
     req = UrlRequest(url, data=data, headers={"Content-Type": "application/x-www-form-urlencoded"})
     try:
         with urlopen(req, timeout=20) as resp:
             raw = resp.read().decode("utf-8", "ignore")
-            logger.info("[TG] OK chat=%s %s", chat_id, raw)
-            return {"ok": True, "status": resp.status, "response": raw, "chat_id": chat_id}
+            logger.info("%s OK chat=%s %s", tag, chat_id, raw)
+            try:
+                mid = json.loads(raw).get("result", {}).get("message_id")
+            except Exception:
+                mid = None
+            return {
+                "ok": True,
+                "status": resp.status,
+                "response": raw,
+                "chat_id": chat_id,
+                "message_id": mid,
+            }
     except HTTPError as e:
         raw = e.read().decode("utf-8", "ignore") if e.fp else ""
-        logger.error("[TG] HTTP %s chat=%s %s", e.code, chat_id, raw)
-        return {
+        logger.error("%s HTTP %s chat=%s %s", tag, e.code, chat_id, raw)
+        res = {
             "ok": False,
+            "status": e.code,
             "reason": f"HTTP {e.code}",
             "response": raw,
             "chat_id": chat_id,
         }
+        if e.code == 429:
+            res["retry_after"] = _tg_retry_after(raw) or 1.0
+        return res
     except URLError as e:
-        logger.error("[TG] URLERROR chat=%s %s", chat_id, getattr(e, "reason", str(e)))
+        logger.error("%s URLERROR chat=%s %s", tag, chat_id, getattr(e, "reason", str(e)))
         return {
             "ok": False,
             "reason": f"URLERROR {getattr(e, 'reason', str(e))}",
             "chat_id": chat_id,
         }
     except Exception as e:
-        logger.error("[TG] EXC chat=%s %s", chat_id, e)
+        logger.error("%s EXC chat=%s %s", tag, chat_id, e)
         return {"ok": False, "reason": str(e), "chat_id": chat_id}
 
 
-def _send_telegram_location_once(chat_id: str, lat: float, lon: float) -> Dict[str, Any]:
-    if not CFG.tg_enabled:
-        return {"ok": False, "reason": "TELEGRAM_DISABLED", "chat_id": chat_id}
-    if not CFG.tg_token:
-        return {"ok": False, "reason": "TELEGRAM_MISSING_TOKEN", "chat_id": chat_id}
+def _queue_telegram_message(
+    chat_id: str,
+    text: str,
+    reply_markup: Optional[Dict[str, Any]] = None,
+    parse_mode: Optional[str] = "HTML",
+    prioridade: int = PRIORIDADE_SOS,
+):
+    """
+    Enfileira sendMessage no TG_SCHEDULER e devolve o Future do resultado.
+    """
+    if not CFG.tg_enabled:
+        return resultado_imediato({"ok": False, "reason": "TELEGRAM_DISABLED", "chat_id": chat_id})
+    if not CFG.tg_token:
+        return resultado_imediato({"ok": False, "reason": "TELEGRAM_MISSING_TOKEN", "chat_id": chat_id})
+
+    txt = (text or "").strip()
+    if not txt:
+        return resultado_imediato({"ok": False, "reason": "TEXT_EMPTY", "chat_id": chat_id})
+
+    payload: Dict[str, Any] = {
+        "chat_id": chat_id,
+        "text": txt[:4096],
+        "disable_web_page_preview": True,
+    }
+    if parse_mode:
+        payload["parse_mode"] = parse_mode
+    if reply_markup:
+        payload["reply_markup"] = json.dumps(reply_markup, ensure_ascii=False)
+
+    return TG_SCHEDULER.submit(
+        chat_id, lambda: _tg_http("sendMessage", payload, chat_id, "[TG]"), prioridade
+    )
+
+
+def _send_telegram_once(
+    chat_id: str,
+    text: str,
+    reply_markup: Optional[Dict[str, Any]] = None,
+    parse_mode: Optional[str] = "HTML",
+) -> Dict[str, Any]:
+    return _queue_telegram_message(chat_id, text, reply_markup, parse_mode).result()
+
+
+def _queue_telegram_location(chat_id: str, lat: float, lon: float):
+    if not CFG.tg_enabled:
+        return resultado_imediato({"ok": False, "reason": "TELEGRAM_DISABLED", "chat_id": chat_id})
+    if not CFG.tg_token:
+        return resultado_imediato({"ok": False, "reason": "TELEGRAM_MISSING_TOKEN", "chat_id": chat_id})
 
-    url = f"https://api.telegram.org/bot{CFG.tg_token}/sendLocation"
     payload = {"chat_id": chat_id, "latitude": str(lat), "longitude": str(lon)}
-    data = urlencode(payload).encode("utf-8")
-    req = UrlRequest(url, data=data, headers={"Content-Type": "application/x-www-form-urlencoded"})
-    try:
-        with urlopen(req, timeout=20) as resp:
-            raw = resp.read().decode("utf-8", "ignore")
-            logger.info("[TG] LOC OK chat=%s %s", chat_id, raw)
-            return {"ok": True, "status": resp.status, "response": raw, "chat_id": chat_id}
-    except HTTPError as e:
-        raw = e.read().decode("utf-8", "ignore") if e.fp else ""
-        logger.error("[TG] LOC HTTP %s chat=%s %s", e.code, chat_id, raw)
-        return {
-            "ok": False,
-            "reason": f"HTTP {e.code}",
-            "response": raw,
-            "chat_id": chat_id,
-        }
-    except URLError as e:
-        logger.error("[TG] LOC URLERROR chat=%s %s", chat_id, getattr(e, "reason", str(e)))
-        return {
-            "ok": False,
-            "reason": f"URLERROR {getattr(e, 'reason', str(e))}",
-            "chat_id": chat_id,
-        }
-    except Exception as e:
-        logger.error("[TG] LOC EXC chat=%s %s", chat_id, e)
-        return {"ok": False, "reason": str(e), "chat_id": chat_id}
+    return TG_SCHEDULER.submit(
+        chat_id,
+        lambda: _tg_http("sendLocation", payload, chat_id, "[TG] LOC"),
+        PRIORIDADE_LOCALIZACAO,
+    )
+
+
+def _send_telegram_location_once(chat_id: str, lat: float, lon: float) -> Dict[str, Any]:
+    return _queue_telegram_location(chat_id, lat, lon).result()
 
 
 # ---------------------------------------------------------
@@ -1610,105 +1949,69 @@ def _live_destinations_for(user_email: Optional[str]):
     return user_id, chat_ids
 
 
-def _send_telegram_live_start_once(
+def _queue_telegram_live_start(
     chat_id: str, lat: float, lon: float, live_period: int = 900
 ):
     if not CFG.tg_enabled or not CFG.tg_token:
-        return {"ok": False, "reason": "TELEGRAM_DISABLED_OR_NO_TOKEN", "chat_id": chat_id}
-    url = f"https://api.telegram.org/bot{CFG.tg_token}/sendLocation"
+        return resultado_imediato(
+            {"ok": False, "reason": "TELEGRAM_DISABLED_OR_NO_TOKEN", "chat_id": chat_id}
+        )
     payload = {
         "chat_id": chat_id,
         "latitude": str(lat),
         "longitude": str(lon),
         "live_period": str(min(max(live_period, 60), 86400)),
     }
-    data = urlencode(payload).encode("utf-8")
-    req = UrlRequest(url, data=data, headers={"Content-Type": "application/x-www-form-urlencoded"})
-    try:
-        with urlopen(req, timeout=20) as resp:
-            raw = resp.read().decode("utf-8", "ignore")
-            logger.info("[TG] LIVE START chat=%s %s", chat_id, raw)
-            try:
-                j = json.loads(raw)
-                mid = j.get("result", {}).get("message_id")
-            except Exception:
-                mid = None
-            return {
-                "ok": True,
-                "status": resp.status,
-                "response": raw,
-                "chat_id": chat_id,
-                "message_id": mid,
-            }
-    except HTTPError as e:
-        raw = e.read().decode("utf-8", "ignore") if e.fp else ""
-        logger.error("[TG] LIVE START HTTP %s chat=%s %s", e.code, chat_id, raw)
-        return {
-            "ok": False,
-            "reason": f"HTTP {e.code}",
-            "response": raw,
-            "chat_id": chat_id,
-        }
-    except Exception as e:
-        logger.error("[TG] LIVE START EXC chat=%s %s", chat_id, e)
-        return {"ok": False, "reason": str(e), "chat_id": chat_id}
+    return TG_SCHEDULER.submit(
+        chat_id,
+        lambda: _tg_http("sendLocation", payload, chat_id, "[TG] LIVE START"),
+        PRIORIDADE_SOS,
+    )
 
 
-def _edit_telegram_live_once(chat_id: str, message_id: int, lat: float, lon: float):
+def _send_telegram_live_start_once(
+    chat_id: str, lat: float, lon: float, live_period: int = 900
+):
+    return _queue_telegram_live_start(chat_id, lat, lon, live_period).result()
+
+
+def _queue_telegram_live_edit(chat_id: str, message_id: int, lat: float, lon: float):
     if not CFG.tg_enabled or not CFG.tg_token:
-        return {"ok": False, "reason": "TELEGRAM_DISABLED_OR_NO_TOKEN", "chat_id": chat_id}
-    url = f"https://api.telegram.org/bot{CFG.tg_token}/editMessageLiveLocation"
+        return resultado_imediato(
+            {"ok": False, "reason": "TELEGRAM_DISABLED_OR_NO_TOKEN", "chat_id": chat_id}
+        )
     payload = {
         "chat_id": chat_id,
         "message_id": str(message_id),
         "latitude": str(lat),
         "longitude": str(lon),
     }
-    data = urlencode(payload).encode("utf-8")
-    req = UrlRequest(url, data=data, headers={"Content-Type": "application/x-www-form-urlencoded"})
-    try:
-        with urlopen(req, timeout=20) as resp:
-            raw = resp.read().decode("utf-8", "ignore")
-            logger.info("[TG] LIVE EDIT chat=%s msg=%s %s", chat_id, message_id, raw)
-            return {"ok": True, "status": resp.status, "response": raw, "chat_id": chat_id}
-    except HTTPError as e:
-        raw = e.read().decode("utf-8", "ignore") if e.fp else ""
-        logger.error("[TG] LIVE EDIT HTTP %s chat=%s msg=%s %s", e.code, chat_id, message_id, raw)
-        return {
-            "ok": False,
-            "reason": f"HTTP {e.code}",
-            "response": raw,
-            "chat_id": chat_id,
-        }
-    except Exception as e:
-        logger.error("[TG] LIVE EDIT EXC chat=%s msg=%s", chat_id, e)
-        return {"ok": False, "reason": str(e), "chat_id": chat_id}
+    return TG_SCHEDULER.submit(
+        chat_id,
+        lambda: _tg_http("editMessageLiveLocation", payload, chat_id, f"[TG] LIVE EDIT msg={message_id}"),
+        PRIORIDADE_EDICAO,
+    )
 
 
-def _stop_telegram_live_once(chat_id: str, message_id: int):
+def _edit_telegram_live_once(chat_id: str, message_id: int, lat: float, lon: float):
+    return _queue_telegram_live_edit(chat_id, message_id, lat, lon).result()
+
+
+def _queue_telegram_live_stop(chat_id: str, message_id: int):
     if not CFG.tg_enabled or not CFG.tg_token:
-        return {"ok": False, "reason": "TELEGRAM_DISABLED_OR_NO_TOKEN", "chat_id": chat_id}
-    url = f"https://api.telegram.org/bot{CFG.tg_token}/stopMessageLiveLocation"
+        return resultado_imediato(
+            {"ok": False, "reason": "TELEGRAM_DISABLED_OR_NO_TOKEN", "chat_id": chat_id}
+        )
     payload = {"chat_id": chat_id, "message_id": str(message_id)}
-    data = urlencode(payload).encode("utf-8")
-    req = UrlRequest(url, data=data, headers={"Content-Type": "application/x-www-form-urlencoded"})
-    try:
-        with urlopen(req, timeout=20) as resp:
-            raw = resp.read().decode("utf-8", "ignore")
-            logger.info("[TG] LIVE STOP chat=%s msg=%s %s", chat_id, message_id, raw)
-            return {"ok": True, "status": resp.status, "response": raw, "chat_id": chat_id}
-    except HTTPError as e:
-        raw = e.read().decode("utf-8", "ignore") if e.fp else ""
-        logger.error("[TG] LIVE STOP HTTP %s chat=%s msg=%s %s", e.code, chat_id, message_id, raw)
-        return {
-            "ok": False,
-            "reason": f"HTTP {e.code}",
-            "response": raw,
-            "chat_id": chat_id,
-        }
-    except Exception as e:
-        logger.error("[TG] LIVE STOP EXC chat=%s msg=%s", chat_id, e)
-        return {"ok": False, "reason": str(e), "chat_id": chat_id}
+    return TG_SCHEDULER.submit(
+        chat_id,
+        lambda: _tg_http("stopMessageLiveLocation", payload, chat_id, f"[TG] LIVE STOP msg={message_id}"),
+        PRIORIDADE_EDICAO,
+    )
+
+
+def _stop_telegram_live_once(chat_id: str, message_id: int):
+    return _queue_telegram_live_stop(chat_id, message_id).result()
 
 
 @app.post("/api/live/start")
@@ -1729,12 +2032,17 @@ def live_start(payload: LiveStartIn):
         + timedelta(seconds=min(max(payload.duration, 60), 86400))
     ).isoformat()
 
+    futures = [
+        (cid, _queue_telegram_live_start(
+            cid, float(payload.lat), float(payload.lon), payload.duration
+        ))
+        for cid in chat_ids
+    ]
+
     results = []
     any_ok = False
-    for cid in chat_ids:
-        r = _send_telegram_live_start_once(
-            cid, float(payload.lat), float(payload.lon), payload.duration
-        )
+    for cid, fut in futures:
+        r = fut.result()
         results.append(r)
         if r.get("ok"):
             any_ok = True
@@ -1782,6 +2090,9 @@ def live_start(payload: LiveStartIn):
 
 @app.post("/api/live/update")
 def live_update(payload: LiveUpdateIn):
+    recusa = _live_limite_sessao(payload.live_id)
+    if recusa is not None:
+        return recusa
     with db() as con:
         rows = con.execute(
             """
@@ -1796,15 +2107,19 @@ def live_update(payload: LiveUpdateIn):
             content={"ok": False, "reason": "LIVE_NOT_FOUND_OR_INACTIVE"},
         )
 
-    results = []
-    any_ok = False
-    for r in rows:
-        res = _edit_telegram_live_once(
+    futures = [
+        _queue_telegram_live_edit(
             str(r["chat_id"]),
             int(r["message_id"]),
             float(payload.lat),
             float(payload.lon),
         )
+        for r in rows
+    ]
+    results = []
+    any_ok = False
+    for fut in futures:
+        res = fut.result()
         results.append(res)
         any_ok = any_ok or res.get("ok", False)
 
@@ -1837,12 +2152,14 @@ def live_stop(payload: LiveStopIn):
             content={"ok": False, "reason": "LIVE_NOT_FOUND_OR_INACTIVE"},
         )
 
+    futures = [
+        _queue_telegram_live_stop(str(r["chat_id"]), int(r["message_id"]))
+        for r in rows
+    ]
     results = []
     any_ok = False
-    for r in rows:
-        res = _stop_telegram_live_once(
-            str(r["chat_id"]), int(r["message_id"])
-        )
+    for fut in futures:
+        res = fut.result()
         results.append(res)
         any_ok = any_ok or res.get("ok", False)
 
@@ -1968,8 +2285,14 @@ class RegisterIn(BaseModel):
 # ---------------------------------------------------------
 # AUTH: registro + confirmação + consentimento
 # ---------------------------------------------------------
+def _email_existe(email: str) -> bool:
+    with db() as con:
+        cur = con.execute("SELECT id FROM users WHERE email=?", (email,))
+        return cur.fetchone() is not None
+
+
 @app.post("/auth/register")
-def auth_register(payload: RegisterIn):
+async def auth_register(payload: RegisterIn):
     email = (payload.email or "").strip().lower()
     pwd = payload.password
     if not pwd:
@@ -1977,6 +2300,26 @@ def auth_register(payload: RegisterIn):
             status_code=400, content={"ok": False, "reason": "PASSWORD_EMPTY"}
         )
 
+    # checa antes de gastar CPU com o hash
+    if email and await run_in_threadpool(_email_existe, email):
+        return JSONResponse(
+            status_code=400, content={"ok": False, "reason": "EMAIL_EXISTS"}
+        )
+
+    # PBKDF2 no executor de senhas (fora do event loop, concorrência limitada)
+    try:
+        h, salt = await hash_senha_async(pwd)
+    except SenhaOcupada:
+        return JSONResponse(
+            status_code=503,
+            content={"ok": False, "reason": "BUSY"},
+            headers={"Retry-After": "2"},
+        )
+
+    return await run_in_threadpool(_auth_register_gravar, email, h, salt)
+
+
+def _auth_register_gravar(email: str, h: str, salt: str):
     with db() as con:
         if email:
             cur = con.execute("SELECT id FROM users WHERE email=?", (email,))
@@ -1985,7 +2328,6 @@ def auth_register(payload: RegisterIn):
                     status_code=400, content={"ok": False, "reason": "EMAIL_EXISTS"}
                 )
 
-        h, salt = _hash_password(pwd)
         email_verified = 0 if email else 1
 
         con.execute(
@@ -2016,6 +2358,7 @@ O link expira em 24 horas.
 Se não foi você, ignore este e-mail.
 """
             send_email(subject, body, [email])
+    PLANOS.invalidar_email(email)
 
     return {"ok": True, "email_verification": "sent" if email else "skipped"}
 
@@ -2062,6 +2405,7 @@ def auth_consent(
         con.execute(
             "INSERT INTO consents(user_id, consent_at, ip) VALUES(?,?,?)", (uid, _now(), ip)
         )
+    PLANOS.invalidar_usuario(uid)
 
     return RedirectResponse(url=f"/onboarding/profile?token={token}", status_code=302)
 
@@ -2071,16 +2415,14 @@ def auth_consent(
 # ---------------------------------------------------------
 @app.get("/debug/zenvia_conf")
 def debug_zenvia_conf():
-    to_list = [
-        x.strip() for x in (os.getenv("ZENVIA_WA_TO_LIST") or "").split(",") if x.strip()
-    ]
+    z = settings().zenvia
     return {
-        "wa_from": os.getenv("ZENVIA_WA_FROM", ""),
-        "wa_to_list": to_list,
-        "template_id": os.getenv("ZENVIA_WA_TEMPLATE_ID", ""),
-        "simple": os.getenv("ZENVIA_WA_SIMPLE", "false"),
-        "callback": os.getenv("ZENVIA_CALLBACK_URL", ""),
-        "token_set": bool(os.getenv("ZENVIA_API_TOKEN", "").strip()),
+        "wa_from": z.wa_from,
+        "wa_to_list": list(z.wa_to_list),
+        "template_id": z.wa_template_id,
+        "simple": z.wa_simple,
+        "callback": z.callback_url,
+        "token_set": bool(z.api_token),
     }
 
 
@@ -2129,6 +2471,7 @@ def profile_save(
                 "INSERT INTO profiles(user_id, full_name, cpf, address, created_at) VALUES(?,?,?,?,?)",
                 (uid, full_name, cpf, address, _now()),
             )
+    PLANOS.invalidar_usuario(uid)
 
     return RedirectResponse(url=f"/onboarding/contacts?token={token}", status_code=302)
 
@@ -2233,6 +2576,7 @@ async def contacts_save(request: Request):
                 else:
                     tg_link = f"https://t.me/<SEU_BOT>?start={act}"
                 tg_links.append((label or f"Contato {i+1}", tg_link))
+    PLANOS.invalidar_usuario(uid)
 
     li = "".join(
         [
@@ -2287,15 +2631,18 @@ async def telegram_webhook(update: Dict[str, Any], bg: BackgroundTasks):
                         "UPDATE contacts SET status='active' WHERE id=?",
                         (row["contact_id"],),
                     )
-                    bg.add_task(
-                        _send_telegram_once,
-                        chat_id,
-                        "<b>Notificações ativadas!</b>\nVocê passará a receber alertas SOS deste aplicativo.",
-                        None,
-                        "HTML",
-                    )
+            if row:
+                PLANOS.invalidar_usuario(row["user_id"])
+                bg.add_task(
+                    _send_telegram_once,
+                    chat_id,
+                    "<b>Notificações ativadas!</b>\nVocê passará a receber alertas SOS deste aplicativo.",
+                    None,
+                    "HTML",
+                )
         else:
-            _send_telegram_once(
+            # não espera o envio: o webhook responde na hora
+            _queue_telegram_message(
                 chat_id,
                 "Olá! Para ativar, toque no link de convite enviado pelo aplicativo.",
                 None,
@@ -2307,163 +2654,37 @@ async def telegram_webhook(update: Dict[str, Any], bg: BackgroundTasks):
 # ---------------------------------------------------------
 # Webhook Zenvia (DLR)
 # ---------------------------------------------------------
+DLR_INGESTOR = DlrIngestor(db)
+atexit.register(DLR_INGESTOR.parar)
+
+
 @app.post("/webhooks/zenvia")
 async def zenvia_webhook(request: Request):
+    # Só enfileira: parse e INSERT em lote ficam com o DLR_INGESTOR
     try:
         raw_bytes = await request.body()
-        raw_str = raw_bytes.decode("utf-8", "ignore")
-        logger.info("[ZENVIA WH] %s", raw_str)
-
-        try:
-            payload = json.loads(raw_str)
-        except Exception:
-            payload = None
-
-        if isinstance(payload, dict):
-            events = [payload]
-        elif isinstance(payload, list):
-            events = payload
-        else:
-            events = []
-
-        if (
-            len(events) == 1
-            and isinstance(events[0], dict)
-            and events[0].get("ping") == "ok"
-        ):
-            msg_id = events[0].get("messageId") or f"ping-{secrets.token_hex(4)}"
-            with db() as con:
-                con.execute(
-                    """
-                    INSERT INTO sms_dlr (message_id, to_number, status, code, description, raw_json, received_at)
-                    VALUES (?,?,?,?,?,?,?)
-                """,
-                    (msg_id, "", "PING", "PING", "PING", raw_str, _now()),
-                )
-            return JSONResponse({"ok": True})
-
-        with db() as con:
-            for ev in events:
-                if not isinstance(ev, dict):
-                    continue
-
-                msg_node = ev.get("message") or {}
-
-                msg_id = (
-                    (ev.get("messageId") or ev.get("id") or "")
-                    or (msg_node.get("messageId") or msg_node.get("id") or "")
-                )
-                msg_id = str(msg_id).strip()
-
-                def _extract_to(obj: dict) -> str:
-                    to_raw = obj.get("to") or obj.get("destination") or obj.get("recipient")
-                    if isinstance(to_raw, dict):
-                        return str(
-                            to_raw.get("phoneNumber")
-                            or to_raw.get("id")
-                            or to_raw.get("number")
-                            or ""
-                        ).strip()
-                    return str(to_raw or "").strip()
-
-                channel = (
-                    (ev.get("channel") or ev.get("type") or "")
-                    or (msg_node.get("channel") or msg_node.get("type") or "")
-                    or (
-                        isinstance(ev.get("to"), dict)
-                        and ev.get("to", {}).get("type")
-                        or ""
-                    )
-                )
-                channel = str(channel).strip().lower()
-
-                to_number = _extract_to(ev) or _extract_to(msg_node)
-
-                st = (
-                    ev.get("status")
-                    or ev.get("messageStatus")
-                    or ev.get("event")
-                    or ev.get("state")
-                )
-                code = description = status = ""
-                if isinstance(st, dict):
-                    code = str(
-                        st.get("code")
-                        or st.get("status")
-                        or st.get("event")
-                        or st.get("state")
-                        or ""
-                    ).strip()
-                    description = str(
-                        st.get("description")
-                        or st.get("reason")
-                        or st.get("detail")
-                        or ""
-                    ).strip()
-                    status = code or "UNKNOWN"
-                elif isinstance(st, str):
-                    status = code = description = st.strip()
-                else:
-                    status = "UNKNOWN"
-
-                if channel == "whatsapp":
-                    con.execute(
-                        """
-                        INSERT INTO wa_dlr (message_id, to_number, status, code, description, channel, raw_json, received_at)
-                        VALUES (?,?,?,?,?,?,?,?)
-                    """,
-                        (
-                            msg_id,
-                            to_number,
-                            status,
-                            code,
-                            description,
-                            channel,
-                            raw_str,
-                            _now(),
-                        ),
-                    )
-                else:
-                    con.execute(
-                        """
-                        INSERT INTO sms_dlr (message_id, to_number, status, code, description, raw_json, received_at)
-                        VALUES (?,?,?,?,?,?,?)
-                    """,
-                        (msg_id, to_number, status, code, description, raw_str, _now()),
-                    )
-
-        return JSONResponse({"ok": True})
+        DLR_INGESTOR.receber(raw_bytes.decode("utf-8", "ignore"))
     except Exception as e:
-        logger.error("[ZENVIA WH][DB] %s", e)
-        return JSONResponse(status_code=200, content={"ok": True})
+        logger.error("[ZENVIA WH] %s", e)
+    return JSONResponse({"ok": True})
 
 
 # ---------------------------------------------------------
-# Helpers: contatos / nome template
+# Helpers: plano de disparo (contatos, chats Telegram, nome) / nome template
 # ---------------------------------------------------------
-def _contacts_for_user(uid: int) -> Dict[str, List[sqlite3.Row]]:
-    with db() as con:
-        rows = con.execute(
-            "SELECT * FROM contacts WHERE user_id=? AND status IN ('pending','active')",
-            (uid,),
-        ).fetchall()
-    out = {"email": [], "sms": [], "whatsapp": [], "telegram": []}
-    for r in rows:
-        out[r["type"]].append(r)
-    return out
+# Invalidado por auth_register, auth_consent, profile_save, contacts_save e
+# pelo /start do telegram_webhook (services/plano_disparo.py).
+PLANOS = PlanoCache(db)
 
 
-def _resolve_nome_for_template(user_id: Optional[int], payload: SosIn) -> Optional[str]:
-    env_nome = (os.getenv("ZENVIA_WA_NOME") or "").strip()
+def _resolve_nome_for_template(
+    plano: Optional[PlanoDisparo], payload: SosIn
+) -> Optional[str]:
+    env_nome = settings().zenvia.wa_nome
     if env_nome:
         return env_nome
-    if user_id:
-        with db() as con:
-            r = con.execute(
-                "SELECT full_name FROM profiles WHERE user_id=?", (user_id,),
-            ).fetchone()
-        if r and (r["full_name"] or "").strip():
-            return r["full_name"].strip()
+    if plano and plano.nome_perfil:
+        return plano.nome_perfil
     if payload.s1 and payload.s1.strip():
         return payload.s1.strip()
     return None
@@ -2477,9 +2698,45 @@ def ping():
     return {"pong": True}
 
 
+# ---------------------------------------------------------
+# Métricas (formato Prometheus)
+# ---------------------------------------------------------
+gauge(
+    "anjo_live_track_sessions", "Sessoes de live tracking em memoria."
+).set_function(lambda: len(LIVE_TRACK_SESSIONS))
+gauge(
+    "anjo_queue_depth", "Itens aguardando nas filas internas.", ("queue",)
+).set_function(
+    lambda: {
+        ("telegram",): TG_SCHEDULER.pending(),
+        ("zenvia",): zenvia_fila_pendente(),
+        ("dlr",): DLR_INGESTOR.pendentes(),
+        ("sos_projector",): SOS_PROJECTOR.pendentes(),
+        ("audit_central",): auth_central.audit_pendentes(),
+        ("password_hash",): senhas_pendentes(),
+    }
+)
+gauge(
+    "anjo_provider_circuit_state",
+    "Estado do circuit breaker (0=closed, 1=half_open, 2=open).",
+    ("provider",),
+).set_function(estados_numericos)
+
+
+@app.get("/metrics")
+def metrics():
+    return PlainTextResponse(render_prometheus(), media_type=METRICS_CONTENT_TYPE)
+
+
 @app.get("/api/health")
 def health():
-    return {"ok": True, "ts": _now()}
+    providers = snapshot_all()
+    return {
+        "ok": True,
+        "ts": _now(),
+        "degraded": any(p["state"] != "closed" for p in providers.values()),
+        "providers": providers,
+    }
 
 
 # ---------------------------------------------------------
@@ -2511,9 +2768,132 @@ def api_email_sos(payload: SosEmailRequest):
 # ---------------------------------------------------------
 # SOS principal
 # ---------------------------------------------------------
+# Retry do app / toques repetidos: mesma resposta, sem novo disparo
+# (services/sos_idempotencia.py)
+SOS_IDEM = SosIdempotencia(db)
+
+
 @app.post("/api/sos")
-async def api_sos(payload: SosIn):
+async def api_sos(
+    payload: SosIn,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
+):
+    # disparos observam SOS_LATENCIA em _sos_disparar; aqui, as respostas
+    # que saem antes (429 por telefone, repetido) para os 4xx/429 do SOS
+    # também entrarem no histograma
+    t0_sos = time.perf_counter()
+    phone = (payload.phone or payload.s2 or "").strip() or None
+    chave = chave_sos(idempotency_key, phone, payload.user_email)
+    if chave is None:
+        recusa = _sos_limite_remetente(payload, phone)
+        if recusa is not None:
+            SOS_LATENCIA.observe(time.perf_counter() - t0_sos, "rate_limited")
+            return recusa
+        status_code, content = await _sos_disparar(payload, None)
+        return JSONResponse(status_code=status_code, content=content)
+
+    k, origem, ttl = chave
+    valido = _valid_coords(payload.lat, payload.lon)
+    primeiro, entrada = await run_in_threadpool(
+        SOS_IDEM.reservar,
+        k,
+        origem,
+        ttl,
+        float(payload.lat) if valido else None,
+        float(payload.lon) if valido else None,
+    )
+    if not primeiro:
+        resposta_repetido = await _sos_repetido(payload, phone, k, entrada)
+        SOS_LATENCIA.observe(time.perf_counter() - t0_sos, "duplicate")
+        return resposta_repetido
+    recusa = _sos_limite_remetente(payload, phone)
+    if recusa is not None:
+        # libera a chave
+        await run_in_threadpool(SOS_IDEM.concluir, k, entrada, (429, {"ok": False}))
+        SOS_LATENCIA.observe(time.perf_counter() - t0_sos, "rate_limited")
+        return recusa
+    try:
+        resposta = await _sos_disparar(payload, entrada)
+    except BaseException as e:
+        SOS_IDEM.falhar(k, entrada, e)
+        raise
+    await run_in_threadpool(SOS_IDEM.concluir, k, entrada, resposta)
+    return JSONResponse(status_code=resposta[0], content=resposta[1])
+
+
+def _sos_limite_remetente(payload: SosIn, phone: Optional[str]) -> Optional[JSONResponse]:
+    """
+    Token bucket de SOS novos por telefone (ou e-mail) do remetente
+    (services/admissao.py). Repetidos não chegam aqui: a idempotência
+    responde antes, sem gastar ficha.
+    """
+    remetente = re.sub(r"\D", "", phone or "") or (payload.user_email or "").strip().lower()
+    espera = LIMITE_SOS_FONE.tentar(remetente) if remetente else 0.0
+    if espera <= 0:
+        return None
+    ADMISSAO_DESCARTES.inc("sos", "phone_rate_limit")
+    logger.warning("[SOS] limite de SOS por telefone atingido: %s", remetente)
+    return JSONResponse(
+        status_code=429,
+        content={"ok": False, "reason": "RATE_LIMITED"},
+        headers={"Retry-After": str(max(1, int(espera + 0.999)))},
+    )
+
+
+async def _sos_repetido(
+    payload: SosIn, phone: Optional[str], chave: str, entrada: SosIdemEntrada
+) -> JSONResponse:
+    """Espera o SOS original e devolve a resposta dele; grava o repetido."""
+    try:
+        status_code, content = await SOS_IDEM.esperar(entrada, SOS_IDEM_ESPERA_S)
+        content = dict(content, duplicate=True)
+    except asyncio.TimeoutError:
+        # original ainda disparando: já tem sos_id/rastreio, não dispara de novo
+        status_code, content = 202, {
+            "ok": True,
+            "duplicate": True,
+            "pending": True,
+            "sos_id": entrada.sos_id,
+            "status": {"tracking_url": entrada.tracking_url},
+        }
+    except Exception:
+        status_code, content = 500, {
+            "ok": False,
+            "duplicate": True,
+            "reason": "ORIGINAL_FAILED",
+            "sos_id": entrada.sos_id,
+        }
+
+    def _gravar_duplicado() -> None:
+        with db() as con:
+            registrar_duplicado(
+                con,
+                sos_id=entrada.sos_id,
+                chave=chave,
+                origem=entrada.origem,
+                phone=phone,
+                payload_json=json.dumps(payload.dict()),
+            )
+
+    try:
+        await run_in_threadpool(_gravar_duplicado)
+    except Exception as e:
+        logger.error("[SOS] erro ao registrar SOS repetido (sos %s): %s", entrada.sos_id, e)
+    logger.info("[SOS] repetido (%s) -> sos %s", entrada.origem, entrada.sos_id)
+    return JSONResponse(
+        status_code=status_code,
+        content=content,
+        headers={"Idempotent-Replayed": "true"},
+    )
+
+
+async def _sos_disparar(
+    payload: SosIn, entrada: Optional[SosIdemEntrada]
+) -> SosResposta:
+    t0_sos = time.perf_counter()
     lat, lon, acc = payload.lat, payload.lon, payload.acc
+    # uma leitura da config para o SOS inteiro (mesmo se houver reload no meio)
+    z = settings().zenvia
 
     # Telefone do remetente (vem do app em phone ou s2)
     phone = (payload.phone or payload.s2 or "").strip() or None
@@ -2524,413 +2904,269 @@ async def api_sos(payload: SosIn):
 
     tracking_id: Optional[str] = None
     tracking_url: Optional[str] = None
-    if _valid_coords(lat, lon):
-        res = _create_live_tracking_session(nome_for_track, phone_for_track, lat, lon)
-        if res:
-            tracking_id, tracking_url = res
-
-    loc_lines, maps_link = [], ""
-    if _valid_coords(lat, lon):
-        maps_link = _maps_url(float(lat), float(lon))
-        acc_txt = f" (±{int(acc)}m)" if isinstance(acc, (int, float)) else ""
-        loc_lines.append(
-            f"Localização: lat={float(lat):.5f} lon={float(lon):.5f}{acc_txt}"
-        )
-        loc_lines.append(maps_link)
-        if tracking_url:
-            loc_lines.append(f"Rastreamento: {tracking_url}")
-    else:
-        loc_lines.append("Localização: não informada")
-
-    subject = "SOS - ANJO DA GUARDA"
-    body_lines = ["Alerta de emergência (ANJO DA GUARDA)", ""]
-    if payload.text:
-        body_lines.append(payload.text)
-        body_lines.append("")
-    body_lines.extend(loc_lines)
-    body = "\n".join(body_lines)
-
-    # Telegram: texto + botão com rastreamento (se existir)
-    tg_maps_part = maps_link
-    if tracking_url:
-        if maps_link:
-            tg_maps_part = f"{maps_link}\nRastreamento: {tracking_url}"
-        else:
-            tg_maps_part = f"Rastreamento: {tracking_url}"
+    with span("sos.tracking_session"):
+        if _valid_coords(lat, lon):
+            res = await run_in_threadpool(
+                _create_live_tracking_session, nome_for_track, phone_for_track, lat, lon
+            )
+            if res:
+                tracking_id, tracking_url = res
 
-    tg_text = render_tg_sos_html(payload.text, tg_maps_part)
+    maps_link = _maps_url(float(lat), float(lon)) if _valid_coords(lat, lon) else ""
 
-    link_for_button = tracking_url or maps_link
-    reply_markup = (
-        {"inline_keyboard": [[{"text": "Abrir rastreamento", "url": link_for_button}]]}
-        if link_for_button
-        else None
-    )
+    # Usuário verificado + contatos + chats + nome: uma consulta, em cache
+    plano: Optional[PlanoDisparo] = None
+    with span("sos.dispatch_plan"):
+        if payload.user_email:
+            plano = await run_in_threadpool(PLANOS.obter, payload.user_email)
+    user_id = plano.user_id if plano else None
 
-    user_id = None
-    if payload.user_email:
+    # Registro do SOS ANTES do disparo (queda no meio não perde o evento)
+    def _gravar_inicio() -> int:
         with db() as con:
-            row = con.execute(
-                "SELECT id, email_verified FROM users WHERE email=?",
-                (payload.user_email.strip().lower(),),
-            ).fetchone()
-            if row and row["email_verified"]:
-                user_id = row["id"]
+            return registrar_sos_inicio(
+                con,
+                user_id=user_id,
+                phone=phone,
+                payload_json=json.dumps(payload.dict()),
+                lat=float(lat) if _valid_coords(lat, lon) else None,
+                lon=float(lon) if _valid_coords(lat, lon) else None,
+                tracking_id=tracking_id,
+                tracking_url=tracking_url,
+            )
+
+    with span("sos.event_log_insert"):
+        sos_id = await run_in_threadpool(_gravar_inicio)
+    if entrada is not None:
+        # repetidos que cansarem de esperar já recebem o sos_id/rastreio
+        await run_in_threadpool(SOS_IDEM.iniciado, entrada, sos_id, tracking_url)
 
     sent_email = sent_sms = sent_whatsapp = sent_telegram = 0
     sms_results: List[Dict[str, Any]] = []
     wa_results: List[Dict[str, Any]] = []
+    tg_results: List[Dict[str, Any]] = []
+    email_result: Optional[Dict[str, Any]] = None
 
-    nome_tpl = _resolve_nome_for_template(user_id, payload)
-
-    if user_id:
-        contacts = _contacts_for_user(user_id)
-
-        if contacts["email"]:
-            email_list = [c["value"] for c in contacts["email"]]
-            r = send_email(subject, body, email_list)
-            logger.info("[EMAIL] result=%s", r)
-            sent_email = 1 if r.get("ok") else 0
-
-        wa_numbers = [c["value"] for c in contacts["whatsapp"]]
-        if wa_numbers:
-            use_simple_wa = (
-                os.getenv("ZENVIA_WA_SIMPLE", "false").lower()
-                in ("1", "true", "yes", "on")
+    erro_disparo: Optional[str] = None
+    try:
+        with span("sos.resolve_nome"):
+            nome_tpl = _resolve_nome_for_template(plano, payload)
+
+        # Textos de todos os canais numa passada (services/mensagens_sos.py)
+        with span("sos.mensagens"):
+            msgs = renderizar_mensagens_sos(
+                ContextoSos(
+                    text=payload.text,
+                    nome=payload.nome,
+                    s1=payload.s1,
+                    nome_tpl=nome_tpl,
+                    lat=lat,
+                    lon=lon,
+                    acc=acc,
+                    maps_link=maps_link,
+                    tracking_url=tracking_url,
+                ),
+                z,
             )
-            template_id = (os.getenv("ZENVIA_WA_TEMPLATE_ID") or "").strip()
-            nome_env = (os.getenv("ZENVIA_WA_NOME") or (payload.s1 or "")).strip()
-            nome_final = nome_tpl or nome_env or ""
-
-            if use_simple_wa or not template_id:
-                wa_text = f"SOS - {maps_link or ''}".strip()
-                tpl_fields = None
-                if tracking_url:
-                    wa_text = f"{wa_text}\nRastreamento: {tracking_url}".strip()
-            else:
-                # Template SOS_ALERTA:
-                # {{1}} -> nome, {{2}} -> link Google Maps, {{3}} -> link rastreável
-                gm_link = maps_link
-                if not gm_link and _valid_coords(lat, lon):
-                    gm_link = _maps_url(float(lat), float(lon))
-                tpl_fields = {
-                    "1": nome_final,
-                    "2": gm_link or "",
-                    "3": tracking_url or "",
-                }
-                wa_text = ""
-
-            wa_user_results = send_wa_to_numbers(wa_numbers, wa_text, tpl_fields)
-            wa_results.extend(wa_user_results)
-            logger.info("[WA][USER] results=%s", wa_user_results)
-            sent_whatsapp = 1 if any(r.get("ok") for r in wa_user_results) else 0
-
-        if contacts["sms"]:
-            # SMS por contato cadastrado (futuro)
-            sent_sms = sent_sms or 0
-
-        if contacts["telegram"] and CFG.tg_enabled:
-            with db() as con:
-                rows = con.execute(
-                    """
-                    SELECT tc.chat_id FROM telegram_contacts tc
-                    JOIN contacts c ON c.id = tc.contact_id
-                    WHERE c.user_id=? AND c.type='telegram' AND c.status='active' AND tc.chat_id IS NOT NULL
-                """,
-                    (user_id,),
-                ).fetchall()
-            res_all = []
-            any_ok = False
-            for i, rr in enumerate(rows):
-                cid = rr["chat_id"]
-                res_all.append(_send_telegram_once(cid, tg_text, reply_markup, "HTML"))
-                any_ok = any_ok or res_all[-1].get("ok", False)
-                if CFG.tg_broadcast_throttle_ms and i < len(rows) - 1:
-                    time.sleep(CFG.tg_broadcast_throttle_ms / 1000.0)
-            if any_ok and _valid_coords(lat, lon):
-                for i, rr in enumerate(rows):
-                    _send_telegram_location_once(rr["chat_id"], float(lat), float(lon))
-                    if CFG.tg_broadcast_throttle_ms and i < len(rows) - 1:
-                        time.sleep(CFG.tg_broadcast_throttle_ms / 1000.0)
-            sent_telegram = 1 if any_ok else 0
-
-    else:
-        # LEGADO (.env)
-        r = send_email(subject, body, None)
-        sent_email = 1 if r.get("ok") else 0
+            for v in msgs.problemas():
+                logger.warning("[SOS] texto %s acima do limite: %s", v.canal, v.as_dict())
+        reply_markup = (
+            {"inline_keyboard": [[{"text": "Abrir rastreamento", "url": msgs.botao_url}]]}
+            if msgs.botao_url
+            else None
+        )
 
-        # SMS legado
-        try:
-            token_ok = bool(os.getenv("ZENVIA_API_TOKEN"))
-            to_raw = os.getenv("ZENVIA_SMS_TO_LIST", "")
-            if token_ok and to_raw:
-                _get = (
-                    lambda o, k, d="": (o.get(k, d) if isinstance(o, dict) else getattr(o, k, d))
-                )
+        if plano:
+            contacts = plano.contatos
 
-                def _sanitize(s: str) -> str:
-                    return (
-                        (s or "")
-                        .replace("–", "-")
-                        .replace("—", "-")
-                        .replace("…", "...")
-                        .replace("’", "'")
-                        .replace("“", '"')
-                        .replace("”", '"')
+            with span("sos.email", mode="user"):
+                if contacts["email"]:
+                    email_list = list(contacts["email"])
+                    email_result = await run_in_threadpool(
+                        send_email, msgs.assunto, msgs.email, email_list
                     )
+                    logger.info("[EMAIL] result=%s", email_result)
+                    sent_email = 1 if email_result.get("ok") else 0
+
+            with span("sos.whatsapp", mode="user"):
+                wa_numbers = list(contacts["whatsapp"])
+                if wa_numbers:
+                    if z.wa_simple or not z.wa_template_id:
+                        wa_text, tpl_fields = msgs.wa_usuario, None
+                    else:
+                        # Template SOS_ALERTA:
+                        # {{1}} -> nome, {{2}} -> link Google Maps, {{3}} -> link rastreável
+                        wa_text, tpl_fields = "", msgs.wa_usuario_campos
+
+                    wa_user_results = await run_in_threadpool(
+                        send_wa_to_numbers, wa_numbers, wa_text, tpl_fields
+                    )
+                    wa_results.extend(wa_user_results)
+                    logger.info("[WA][USER] results=%s", wa_user_results)
+                    sent_whatsapp = 1 if any(r.get("ok") for r in wa_user_results) else 0
+
+            if contacts["sms"]:
+                # SMS por contato cadastrado (futuro)
+                sent_sms = sent_sms or 0
+
+            with span("sos.telegram", mode="user"):
+                if contacts["telegram"] and CFG.tg_enabled:
+                    chat_ids = plano.telegram_chat_ids
+                    # Todos os chats entram na fila de uma vez; o TG_SCHEDULER
+                    # respeita os limites do Telegram sem sleep no handler.
+                    futures = [
+                        _queue_telegram_message(cid, msgs.telegram, reply_markup, "HTML")
+                        for cid in chat_ids
+                    ]
+                    tg_results = list(
+                        await asyncio.gather(*(asyncio.wrap_future(f) for f in futures))
+                    )
+                    any_ok = any(r.get("ok", False) for r in tg_results)
+                    if any_ok and _valid_coords(lat, lon):
+                        # localização vai com prioridade menor; não precisa esperar
+                        for cid in chat_ids:
+                            _queue_telegram_location(cid, float(lat), float(lon))
+                    sent_telegram = 1 if any_ok else 0
 
-                nome = (_get(payload, "nome", "") or os.getenv("ZENVIA_WA_NOME") or "").strip()
-                text_line = _get(payload, "text", "").strip()
-
-                has_coords = _valid_coords(lat, lon) and bool(maps_link)
-
-                use_simple = (
-                    os.getenv("ZENVIA_SMS_SIMPLE", "false").lower()
-                    in ("1", "true", "yes", "on")
+        else:
+            # LEGADO (.env)
+            with span("sos.email", mode="legacy"):
+                email_result = await run_in_threadpool(
+                    send_email, msgs.assunto, msgs.email, None
                 )
-                if use_simple:
-                    sms_text = f"SOS - {(maps_link if has_coords else (text_line or 'SOS pessoal'))}".strip()
-                    if tracking_url:
-                        sms_text = f"{sms_text}\nRastreamento: {tracking_url}"
-                else:
-                    titulo = f"ALERTA de {nome}" if nome else "ALERTA"
-                    linhas = [
-                        titulo,
-                        f"Situacao: {text_line or 'SOS pessoal'}",
-                        (
-                            f"Localizacao (mapa): {maps_link}"
-                            if has_coords
-                            else "Localizacao: nao informada"
-                        ),
-                    ]
-                    if tracking_url:
-                        linhas.append(f"Rastreamento: {tracking_url}")
-                    sms_text = "\n".join(linhas).strip()
-
-                sms_text = _sanitize(sms_text)
-                logger.info("[SMS] body=%s", sms_text)
-
-                override = (os.getenv("ZENVIA_SMS_TEST") or "").strip()
-                if override:
-                    try:
-                        sms_text = override.format(
-                            maps_link=maps_link or "",
-                            MAPS_LINK=maps_link or "",
-                            text_line=text_line,
-                            text=text_line,
-                            TEXT=text_line,
-                            nome=nome,
-                            NOME=nome,
+                sent_email = 1 if email_result.get("ok") else 0
+
+            # SMS legado
+            with span("sos.sms", mode="legacy"):
+                try:
+                    token_ok = bool(z.api_token)
+                    to_raw = ",".join(z.sms_to_list)
+                    if token_ok and to_raw:
+                        sms_text = msgs.sms
+                        logger.info("[SMS] body=%s", sms_text)
+                        logger.info("[SMS] sending... from=%s to_list=%s", _resolve_sms_sender(), to_raw)
+                        sms_results = await run_in_threadpool(send_sms_zenvia_list, sms_text)
+                        sent_sms = 1 if any(r.get("ok") for r in sms_results) else 0
+                        logger.info("[SMS] results=%s", sms_results)
+                    else:
+                        logger.info(
+                            "[SMS] skipped: token_ok=%s to_list_present=%s", token_ok, bool(to_raw)
                         )
-                    except Exception as e:
-                        logger.warning(
-                            "[SMS] override.format falhou: %s; usando fallback literal", e
+                except Exception as e:
+                    logger.error("[SMS] erro ao enviar: %s", e)
+
+            # WA legado
+            with span("sos.whatsapp", mode="legacy"):
+                try:
+                    wa_enabled = z.wa_enabled
+                    from_wa = z.wa_from
+                    to_wa_raw = ",".join(z.wa_to_list)
+                    template_id = z.wa_template_id
+
+                    if wa_enabled and from_wa and to_wa_raw:
+                        use_simple_wa = z.wa_simple
+                        tpl_fields = msgs.wa_legado_campos
+
+                        logger.info(
+                            "[WA] sending... from=%s to_list=%s mode=%s",
+                            from_wa,
+                            to_wa_raw,
+                            "template" if (not use_simple_wa and template_id) else "text",
                         )
-                        sms_text = (
-                            override.replace("{maps_link}", maps_link or "")
-                            .replace("{MAPS_LINK}", maps_link or "")
-                            .replace("{text}", text_line)
-                            .replace("{TEXT}", text_line)
-                            .replace("{nome}", nome)
-                            .replace("{NOME}", nome)
+                        wa_fallback_text = (
+                            msgs.wa_legado
+                            if (use_simple_wa or not template_id)
+                            else msgs.wa_legado_curto
                         )
 
-                sms_text = _sanitize(
-                    sms_text.replace("\\n", "\n").replace("\\r\\n", "\n")
-                )[:700]
-
-                logger.info("[SMS] sending... from=%s to_list=%s", _resolve_sms_sender(), to_raw)
-                sms_results = send_sms_zenvia_list(sms_text)
-                sent_sms = 1 if any(r.get("ok") for r in sms_results) else 0
-                logger.info("[SMS] results=%s", sms_results)
-            else:
-                logger.info(
-                    "[SMS] skipped: token_ok=%s to_list_present=%s", token_ok, bool(to_raw)
-                )
-        except Exception as e:
-            logger.error("[SMS] erro ao enviar: %s", e)
-
-        # WA legado
-        try:
-            wa_enabled = (
-                os.getenv(
-                    "ZENVIA_WA_ENABLED",
-                    os.getenv("ZENVIA_WHATSAPP_ENABLED", "false"),
-                ).lower()
-                in ("1", "true", "yes", "on")
-            )
-            from_wa = (
-                os.getenv("ZENVIA_WA_FROM") or os.getenv("ZENVIA_WHATSAPP_FROM") or ""
-            ).strip()
-            to_wa_raw = (
-                os.getenv("ZENVIA_WA_TO_LIST")
-                or os.getenv("ZENVIA_WHATSAPP_TO_LIST")
-                or ""
-            ).strip()
-            template_id = (os.getenv("ZENVIA_WA_TEMPLATE_ID") or "").strip()
-
-            if wa_enabled and from_wa and to_wa_raw:
-                use_simple_wa = (
-                    os.getenv("ZENVIA_WA_SIMPLE", "false").lower()
-                    in ("1", "true", "yes", "on")
-                )
-
-                if use_simple_wa or not template_id:
-                    wa_text = (
-                        f"🚨 ALERTA de {(nome_tpl or 'contato')}\n"
-                        f"Situação: {(payload.text or '').strip()}\n"
-                        f"Localização (mapa): {maps_link or ''}"
-                        + (f"\nRastreamento: {tracking_url}" if tracking_url else "")
-                    ).strip()
-                    tpl_fields = None
-                else:
-                    gm_link = maps_link
-                    if not gm_link and _valid_coords(lat, lon):
-                        gm_link = _maps_url(float(lat), float(lon))
-                    tpl_fields = {
-                        "1": (nome_tpl or ""),
-                        "2": gm_link or "",
-                        "3": tracking_url or "",
-                    }
-                    wa_text = ""
-
-                logger.info(
-                    "[WA] sending... from=%s to_list=%s mode=%s",
-                    from_wa,
-                    to_wa_raw,
-                    "template" if (not use_simple_wa and template_id) else "text",
-                )
-                wa_fallback_text = wa_text or (
-                    "🚨 ALERTA de "
-                    + (nome_tpl or "contato")
-                    + (f"\nLocalização (mapa): {maps_link}" if maps_link else "")
-                    + (f"\nRastreamento: {tracking_url}" if tracking_url else "")
-                ).strip()
-
-                if not use_simple_wa and template_id:
-                    try:
-                        wa_results = send_wa_zenvia_list_template(tpl_fields)
-                    except Exception as e_tpl:
-                        logger.warning(
-                            "[WA] template falhou (%s); usando texto", e_tpl
+                        if not use_simple_wa and template_id:
+                            try:
+                                wa_results = await run_in_threadpool(
+                                    send_wa_zenvia_list_template, tpl_fields
+                                )
+                            except Exception as e_tpl:
+                                logger.warning(
+                                    "[WA] template falhou (%s); usando texto", e_tpl
+                                )
+                                wa_results = await run_in_threadpool(
+                                    send_wa_zenvia_list, wa_fallback_text
+                                )
+                        else:
+                            wa_results = await run_in_threadpool(
+                                send_wa_zenvia_list, wa_fallback_text
+                            )
+
+                        sent_whatsapp = 1 if any(r.get("ok") for r in wa_results) else 0
+                        logger.info("[WA] results=%s", wa_results)
+                    else:
+                        logger.info(
+                            "[WA] skipped: enabled=%s from=%s to_list_present=%s",
+                            wa_enabled,
+                            bool(from_wa),
+                            bool(to_wa_raw),
                         )
-                        wa_results = send_wa_zenvia_list(wa_fallback_text)
-                else:
-                    wa_results = send_wa_zenvia_list(wa_fallback_text)
-
-                sent_whatsapp = 1 if any(r.get("ok") for r in wa_results) else 0
-                logger.info("[WA] results=%s", wa_results)
-            else:
-                logger.info(
-                    "[WA] skipped: enabled=%s from=%s to_list_present=%s",
-                    wa_enabled,
-                    bool(from_wa),
-                    bool(to_wa_raw),
-                )
-        except Exception as e:
-            logger.error("[WA] erro ao enviar: %s", e)
-
-        any_ok = False
-        if CFG.tg_enabled and (CFG.tg_chat_ids or CFG.tg_chat_id_legacy):
-            chat_ids = _parse_chat_ids_from_env()
-            for i, cid in enumerate(chat_ids):
-                res = _send_telegram_once(cid, tg_text, reply_markup, "HTML")
-                any_ok = any_ok or res.get("ok", False)
-                if CFG.tg_broadcast_throttle_ms and i < len(chat_ids) - 1:
-                    time.sleep(CFG.tg_broadcast_throttle_ms / 1000.0)
-            if any_ok and _valid_coords(lat, lon):
-                for i, cid in enumerate(chat_ids):
-                    _send_telegram_location_once(cid, float(lat), float(lon))
-                    if CFG.tg_broadcast_throttle_ms and i < len(chat_ids) - 1:
-                        time.sleep(CFG.tg_broadcast_throttle_ms / 1000.0)
-        sent_telegram = 1 if any_ok else 0
-
-    # Auditoria SOS (com phone)
-    with db() as con:
-        con.execute(
-            """
-            INSERT INTO sos_audit(
-                user_id,
-                payload_json,
-                sent_email,
-                sent_sms,
-                sent_whatsapp,
-                sent_telegram,
-                created_at,
-                phone
-            )
-            VALUES(?,?,?,?,?,?,?,?)
-            """,
-            (
-                user_id,
-                json.dumps(payload.dict()),
-                sent_email,
-                sent_sms,
-                sent_whatsapp,
-                sent_telegram,
-                _now(),
-                phone,
-            ),
+                except Exception as e:
+                    logger.error("[WA] erro ao enviar: %s", e)
+
+            with span("sos.telegram", mode="legacy"):
+                any_ok = False
+                if CFG.tg_enabled and (CFG.tg_chat_ids or CFG.tg_chat_id_legacy):
+                    chat_ids = _parse_chat_ids_from_env()
+                    futures = [
+                        _queue_telegram_message(cid, msgs.telegram, reply_markup, "HTML")
+                        for cid in chat_ids
+                    ]
+                    tg_results = list(
+                        await asyncio.gather(*(asyncio.wrap_future(f) for f in futures))
+                    )
+                    any_ok = any(r.get("ok", False) for r in tg_results)
+                    if any_ok and _valid_coords(lat, lon):
+                        for cid in chat_ids:
+                            _queue_telegram_location(cid, float(lat), float(lon))
+                sent_telegram = 1 if any_ok else 0
+    except Exception as e:
+        # resultado parcial vai para o sos_event_log mesmo assim: o projetor
+        # não fica esperando o SOS_DISPATCH_TIMEOUT_S por esta linha
+        erro_disparo = f"{type(e).__name__}: {e}"
+        logger.exception("[SOS] erro no disparo do SOS %s: %s", sos_id, e)
+
+    # Resultado do disparo + ledger: uma transação. sos_audit,
+    # metrics_events e sos_events são projetados pelo SOS_PROJECTOR.
+    with span("sos.event_log_finish"):
+        # e-mail desabilitado/sem destinatário não gera linha no ledger
+        envios = (
+            [("email", email_result)]
+            if email_result and email_result.get("to")
+            else []
         )
+        envios += [("sms", r) for r in sms_results]
+        envios += [("whatsapp", r) for r in wa_results]
+        envios += [("telegram", r) for r in tg_results]
+        canais = {
+            "email": sent_email,
+            "sms": sent_sms,
+            "whatsapp": sent_whatsapp,
+            "telegram": sent_telegram,
+        }
 
-    # Métrica SOS para relatórios / Power BI (com phone)
-    try:
-        with db() as con:
-            con.execute(
-                """
-                INSERT INTO metrics_events(
-                    user_id,
-                    event_type,
-                    channel,
-                    lat,
-                    lon,
-                    created_at,
-                    phone
-                )
-                VALUES(?,?,?,?,?,?,?)
-                """,
-                (
-                    user_id,
-                    "sos_trigger",
-                    "multi",
-                    float(lat) if _valid_coords(lat, lon) else None,
-                    float(lon) if _valid_coords(lat, lon) else None,
-                    _now(),
-                    phone,
-                ),
-            )
-    except Exception as e:
-        logger.error("[METRICS] erro ao registrar evento SOS: %s", e)
+        def _gravar_resultado() -> None:
+            with db() as con:
+                registrar_sos_resultado(con, sos_id, canais, erro=erro_disparo)
+                registrar_envios(con, sos_id, envios)
 
-    # Registro detalhado em sos_events (para dashboards/KPI)
-    try:
-        registrar_sos_event(
-            extra={
-                "user_id": user_id,
-                "phone": phone,
-                "lat": float(lat) if _valid_coords(lat, lon) else None,
-                "lon": float(lon) if _valid_coords(lat, lon) else None,
-                "payload": payload.dict(),
-                "channels": {
-                    "email": sent_email,
-                    "sms": sent_sms,
-                    "whatsapp": sent_whatsapp,
-                    "telegram": sent_telegram,
-                },
-                "tracking": {
-                    "id": tracking_id,
-                    "url": tracking_url,
-                },
-            }
-        )
-    except Exception as e:
-        logger.error("[SOS_EVENTS] erro ao registrar evento detalhado: %s", e)
+        try:
+            await run_in_threadpool(_gravar_resultado)
+        except Exception as e:
+            logger.error("[SOS LOG] erro ao registrar resultado do SOS %s: %s", sos_id, e)
+        SOS_PROJECTOR.notificar()
 
     ok = any([sent_email, sent_sms, sent_whatsapp, sent_telegram])
-    return JSONResponse(
-        status_code=200 if ok else 500,
-        content={
+    SOS_LATENCIA.observe(time.perf_counter() - t0_sos, "ok" if ok else "failed")
+    return (
+        200 if ok else 500,
+        {
             "ok": ok,
+            "sos_id": sos_id,
             "status": {
                 "email": sent_email,
                 "sms": sent_sms,
@@ -2945,6 +3181,26 @@ async def api_sos(payload: SosIn):
     )
 
 
+@app.get("/api/sos/{sos_id}/delivery")
+def sos_delivery(sos_id: int, _user: str = Depends(require_central_session)):
+    """
+    Timeline de entrega do SOS por destinatário (send_ledger + DLRs).
+    """
+    with db() as con:
+        row = con.execute(
+            "SELECT id, created_at FROM sos_event_log WHERE id=?", (sos_id,)
+        ).fetchone()
+        if not row:
+            raise HTTPException(404, "SOS não encontrado")
+        itens = timeline_sos(con, sos_id)
+    return {
+        "ok": True,
+        "sos_id": sos_id,
+        "created_at": row["created_at"],
+        "recipients": itens,
+    }
+
+
 # ---------------------------------------------------------
 # Debug DLR SMS/WA
 # ---------------------------------------------------------
@@ -2978,6 +3234,31 @@ def debug_wa_dlr_recent(limit: int = 20):
     return {"rows": [dict(r) for r in rows]}
 
 
+# ---------------------------------------------------------
+# Debug subida (tempo por fase)
+# ---------------------------------------------------------
+@app.get("/debug/startup")
+def debug_startup(token: str = Query(..., description="Token interno de acesso")):
+    """Fases da subida deste worker (ms) + imports preguiçosos já feitos."""
+    _check_debug_token(token)
+    return BOOT.relatorio()
+
+
+# ---------------------------------------------------------
+# Debug manutenção (limpeza de sessões/tokens vencidos)
+# ---------------------------------------------------------
+@app.get("/debug/maintenance")
+def debug_maintenance(
+    token: str = Query(..., description="Token interno de acesso"),
+    run: bool = Query(False, description="Executa uma varredura agora"),
+):
+    """Última varredura da manutenção (linhas apagadas por tabela)."""
+    _check_debug_token(token)
+    if run:
+        return MANUTENCAO.executar()
+    return {"ultima": MANUTENCAO.ultima}
+
+
 # ---------------------------------------------------------
 # Métricas: SOS por telefone (para dashboards / Power BI)
 # ---------------------------------------------------------
@@ -2985,36 +3266,36 @@ def debug_wa_dlr_recent(limit: int = 20):
 def metrics_sos_by_phone(days: int = 30):
     """
     Retorna a contagem de disparos de SOS por telefone
-    nos últimos N dias (padrão 30).
+    nos últimos N dias (padrão 30), lida dos rollups (precisão de 1 hora).
     """
     if days <= 0 or days > 365:
         days = 30
 
     with db() as con:
-        rows = con.execute(
-            """
-            SELECT
-                phone,
-                COUNT(*) AS total_sos,
-                MIN(created_at) AS first_sos,
-                MAX(created_at) AS last_sos
-            FROM sos_audit
-            WHERE phone IS NOT NULL
-              AND phone <> ''
-              AND datetime(created_at) >= datetime('now', ?)
-            GROUP BY phone
-            ORDER BY total_sos DESC
-            """,
-            (f"-{days} days",),
-        ).fetchall()
+        rows = sos_por_telefone(con, days)
 
     return {
         "ok": True,
         "days": days,
-        "rows": [dict(r) for r in rows],
+        "rows": rows,
     }
 
 
+@app.get("/api/metrics/sos_daily")
+def metrics_sos_daily(days: int = 30, phone: Optional[str] = None):
+    """
+    Rollup diário (dia UTC x telefone x canal x resultado) para Power BI.
+    channel='any' conta cada SOS uma vez.
+    """
+    if days <= 0 or days > 365:
+        days = 30
+
+    with db() as con:
+        rows = rollup_diario(con, days, (phone or "").strip() or None)
+
+    return {"ok": True, "days": days, "rows": rows}
+
+
 # -----------------------------------------------------------------
 # GARANTIA: rotas do Localiza no app FINAL exportado
 # -----------------------------------------------------------------
@@ -3031,3 +3312,23 @@ WEB_DIR = os.path.normpath(os.path.join(BASE_DIR, "..", "web"))
 if not os.path.isdir(WEB_DIR):
     os.makedirs(WEB_DIR, exist_ok=True)
 app.mount("/", StaticFiles(directory=WEB_DIR, html=True), name="web")
+BOOT.marco("rotas")
+
+
+# ---------------------------------------------------------
+# Fim da subida: o resto aquece em background
+# ---------------------------------------------------------
+def _aquecer_banco() -> None:
+    """Lê as tabelas do caminho do SOS para o cache de páginas do SO."""
+    con = db()
+    try:
+        for tabela in ("users", "profiles", "contacts", "telegram_contacts"):
+            con.execute(f"SELECT COUNT(*) FROM {tabela}").fetchone()
+    finally:
+        con.close()
+    compilar_mensagens_sos()
+
+
+BOOT.marcar_pronto()
+BOOT.em_segundo_plano("sos_projector", SOS_PROJECTOR.iniciar)
+BOOT.em_segundo_plano("aquecer_banco", _aquecer_banco)
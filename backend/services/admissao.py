@@ -0,0 +1,282 @@
+# backend/services/admissao.py
+# -*- coding: utf-8 -*-
+"""
+admissao.py
+
+Controle de admissão por prioridade: sob carga, o /api/sos continua
+rápido e quem espera é o resto (dashboards, exportações, /debug).
+
+Classes de rota (da mais para a menos prioritária):
+- sos          POST /api/sos, POST /api/email-sos, /ping, /api/health:
+               nunca descartada e fora do limite por IP (operadora com NAT
+               divide IP; o limite do SOS é por telefone, no api_sos);
+- monitor      /metrics: nunca descartada (o scrape tem que funcionar
+               justamente na sobrecarga), mas com limite por IP;
+- live_update  posição/início/fim do live tracking e webhooks (Telegram,
+               Zenvia);
+- viewer       quem assiste: painel da central, /t/, /track/, listas e
+               estados do live tracking, onboarding (padrão para o resto);
+- report       /debug/*, /api/assinaturas/* (relatórios, CSV,
+               comissões), /api/metrics/*.
+
+Descarte por ocupação: com N requisições em andamento (todas as classes),
+uma nova requisição é recusada com 503 + Retry-After quando N passa da
+fração da classe em ADMISSION_MAX_INFLIGHT (padrão 64):
+    report 50%, viewer 75%, live_update 100%, sos nunca.
+Relatórios e polling são os primeiros a sair, e sobra folga para o SOS
+no threadpool e no banco.
+
+Limite por cliente: token bucket por IP (ADMISSION_IP_RPS por segundo,
+rajada ADMISSION_IP_BURST; padrão 20/40); estourou, 429 + Retry-After.
+Fora do limite por IP:
+- as rotas da classe sos;
+- os webhooks dos provedores (/webhooks/*): depois de um SOS em massa a
+  Zenvia manda a rajada de DLRs de poucos IPs, e um 429 ali atrasa ou
+  perde o DLR (services/zenvia_dlr.py já absorve a rajada);
+- os updates de posição (/api/live-track/update, /api/live/update):
+  celulares atrás de NAT da operadora dividem IP. O limite deles é por
+  sessão (session_id / live_id), no handler, com LIMITE_LIVE_SESSAO:
+  LIVE_UPDATE_RATE_PER_S (padrão 1) com rajada LIVE_UPDATE_BURST (padrão 10).
+Com ADMISSION_TRUST_PROXY=1 o IP vem do ÚLTIMO X-Forwarded-For (o que o
+proxy reverso acrescentou; os anteriores vêm do cliente e podem ser
+forjados). Alternativa: uvicorn --proxy-headers --forwarded-allow-ips=<ip
+do proxy> com ADMISSION_TRUST_PROXY=0, e o IP já chega em scope["client"].
+
+LimitePorChave (token bucket por chave) também é usado pelo api_sos, por
+telefone: SOS_PHONE_RATE_PER_MIN (padrão 3) com rajada SOS_PHONE_BURST
+(padrão 6). Retry/toques repetidos já são absorvidos antes pela
+idempotência (services/sos_idempotencia.py) e não gastam fichas.
+
+Métricas: anjo_admission_shed_total{class,reason} (reason = overload |
+rate_limit | phone_rate_limit | session_rate_limit) e
+anjo_inflight_requests{class}.
+ADMISSION_MAX_INFLIGHT=0 desliga o descarte por ocupação;
+ADMISSION_IP_RPS=0 desliga o limite por IP.
+"""
+
+import json
+import math
+import os
+import threading
+import time
+from typing import Dict, Tuple
+
+from services.instrumentacao import counter, gauge
+
+SOS = "sos"
+MONITOR = "monitor"
+LIVE_UPDATE = "live_update"
+VIEWER = "viewer"
+REPORT = "report"
+CLASSES = (SOS, MONITOR, LIVE_UPDATE, VIEWER, REPORT)
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, str(default)))
+    except Exception:
+        return default
+
+
+MAX_EM_ANDAMENTO = int(_env_float("ADMISSION_MAX_INFLIGHT", 64))
+IP_RPS = _env_float("ADMISSION_IP_RPS", 20.0)
+IP_RAJADA = _env_float("ADMISSION_IP_BURST", 40.0)
+CONFIAR_PROXY = os.getenv("ADMISSION_TRUST_PROXY", "0").strip().lower() in ("1", "true", "yes")
+SOS_FONE_POR_MIN = _env_float("SOS_PHONE_RATE_PER_MIN", 3.0)
+SOS_FONE_RAJADA = _env_float("SOS_PHONE_BURST", 6.0)
+LIVE_POR_S = _env_float("LIVE_UPDATE_RATE_PER_S", 1.0)
+LIVE_RAJADA = _env_float("LIVE_UPDATE_BURST", 10.0)
+
+# fração de MAX_EM_ANDAMENTO a partir da qual a classe é descartada
+# (sos e monitor: nunca)
+_LIMIAR = {LIVE_UPDATE: 1.0, VIEWER: 0.75, REPORT: 0.5}
+_MAX_CHAVES = 10000
+
+DESCARTES = counter(
+    "anjo_admission_shed_total",
+    "Requisições recusadas pelo controle de admissão.",
+    ("class", "reason"),
+)
+
+# (método ou "*", prefixo, classe, limite por IP): o primeiro que casar vale
+_ROTAS: Tuple[Tuple[str, str, str, bool], ...] = (
+    ("POST", "/api/sos", SOS, False),
+    ("POST", "/api/email-sos", SOS, False),
+    ("*", "/ping", SOS, False),
+    ("*", "/api/health", SOS, False),
+    ("*", "/metrics", MONITOR, True),
+    ("*", "/api/live-track/update", LIVE_UPDATE, False),
+    ("*", "/api/live-track/start", LIVE_UPDATE, True),
+    ("*", "/api/live-track/stop", LIVE_UPDATE, True),
+    ("*", "/api/live/update", LIVE_UPDATE, False),
+    ("*", "/api/live/start", LIVE_UPDATE, True),
+    ("*", "/api/live/stop", LIVE_UPDATE, True),
+    ("*", "/webhooks/", LIVE_UPDATE, False),
+    ("*", "/debug/", REPORT, True),
+    ("*", "/api/metrics/", REPORT, True),
+    ("POST", "/api/assinaturas/site", VIEWER, True),
+    ("*", "/api/assinaturas/", REPORT, True),
+)
+
+
+def _rota(metodo: str, caminho: str) -> Tuple[str, bool]:
+    """(classe, limitada por IP)."""
+    for m, prefixo, classe, por_ip in _ROTAS:
+        if (m == "*" or m == metodo) and (
+            caminho == prefixo or caminho.startswith(prefixo.rstrip("/") + "/")
+        ):
+            # /api/sos/{id}/delivery é consulta, não disparo
+            if classe == SOS and prefixo == "/api/sos" and caminho != prefixo:
+                continue
+            return classe, por_ip
+    return VIEWER, True
+
+
+def classificar(metodo: str, caminho: str) -> str:
+    return _rota(metodo, caminho)[0]
+
+
+# ----------------------------
+# Token buckets por chave
+# ----------------------------
+class LimitePorChave:
+    """
+    Um token bucket por chave (IP, telefone), thread-safe. Buckets cheios
+    (ociosos) são descartados quando o mapa passa de _MAX_CHAVES.
+    """
+
+    def __init__(self, por_segundo: float, rajada: float):
+        self.por_segundo = por_segundo
+        self.rajada = max(rajada, 1.0)
+        self._lock = threading.Lock()
+        # chave -> (fichas, instante monotônico)
+        self._buckets: Dict[str, Tuple[float, float]] = {}
+
+    @property
+    def ativo(self) -> bool:
+        return self.por_segundo > 0
+
+    def tentar(self, chave: str) -> float:
+        """0 = admitido (consome 1 ficha); > 0 = segundos até a próxima ficha."""
+        if not self.ativo:
+            return 0.0
+        agora = time.monotonic()
+        with self._lock:
+            fichas, ts = self._buckets.get(chave, (self.rajada, agora))
+            fichas = min(self.rajada, fichas + (agora - ts) * self.por_segundo)
+            if fichas >= 1.0:
+                self._buckets[chave] = (fichas - 1.0, agora)
+                if len(self._buckets) > _MAX_CHAVES:
+                    self._podar(agora)
+                return 0.0
+            self._buckets[chave] = (fichas, agora)
+            return (1.0 - fichas) / self.por_segundo
+
+    def _podar(self, agora: float) -> None:
+        cheios = [
+            k
+            for k, (f, ts) in self._buckets.items()
+            if f + (agora - ts) * self.por_segundo >= self.rajada
+        ]
+        for k in cheios:
+            del self._buckets[k]
+
+
+LIMITE_IP = LimitePorChave(IP_RPS, IP_RAJADA)
+LIMITE_SOS_FONE = LimitePorChave(SOS_FONE_POR_MIN / 60.0, SOS_FONE_RAJADA)
+LIMITE_LIVE_SESSAO = LimitePorChave(LIVE_POR_S, LIVE_RAJADA)
+
+
+# ----------------------------
+# Middleware
+# ----------------------------
+_em_andamento: Dict[str, int] = {c: 0 for c in CLASSES}
+_lock = threading.Lock()
+
+gauge(
+    "anjo_inflight_requests",
+    "Requisições HTTP em andamento, por classe de prioridade.",
+    ("class",),
+).set_function(lambda: {(c,): n for c, n in _em_andamento.items()})
+
+
+def em_andamento() -> Dict[str, int]:
+    return dict(_em_andamento)
+
+
+def _ip_cliente(scope) -> str:
+    if CONFIAR_PROXY:
+        # o proxy ACRESCENTA o IP de quem conectou nele: vale o último
+        # item (do último header, se vierem vários)
+        ultimo = ""
+        for k, v in scope.get("headers") or []:
+            if k == b"x-forwarded-for":
+                ultimo = v.decode("latin-1").split(",")[-1].strip() or ultimo
+        if ultimo:
+            return ultimo
+    cliente = scope.get("client")
+    return cliente[0] if cliente else ""
+
+
+def _admitir(classe: str) -> bool:
+    with _lock:
+        if classe in _LIMIAR and MAX_EM_ANDAMENTO > 0:
+            total = sum(_em_andamento.values())
+            if total >= MAX_EM_ANDAMENTO * _LIMIAR[classe]:
+                return False
+        _em_andamento[classe] += 1
+        return True
+
+
+def _liberar(classe: str) -> None:
+    with _lock:
+        _em_andamento[classe] -= 1
+
+
+async def _recusar(send, status: int, reason: str, retry_after: float) -> None:
+    corpo = json.dumps({"ok": False, "reason": reason}).encode()
+    await send(
+        {
+            "type": "http.response.start",
+            "status": status,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(corpo)).encode()),
+                (b"retry-after", str(max(1, math.ceil(retry_after))).encode()),
+            ],
+        }
+    )
+    await send({"type": "http.response.body", "body": corpo})
+
+
+class AdmissaoMiddleware:
+    """
+    Middleware ASGI puro (como MetricsMiddleware). Fica dentro do
+    MetricsMiddleware para as recusas aparecerem na latência por status.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope.get("type") != "http":
+            await self.app(scope, receive, send)
+            return
+
+        classe, por_ip = _rota(scope.get("method", ""), scope.get("path", ""))
+
+        if por_ip:
+            espera = LIMITE_IP.tentar(_ip_cliente(scope))
+            if espera > 0:
+                DESCARTES.inc(classe, "rate_limit")
+                await _recusar(send, 429, "RATE_LIMITED", espera)
+                return
+
+        if not _admitir(classe):
+            DESCARTES.inc(classe, "overload")
+            await _recusar(send, 503, "OVERLOADED", 1)
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _liberar(classe)
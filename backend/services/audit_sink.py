@@ -0,0 +1,164 @@
+# backend/services/audit_sink.py
+# -*- coding: utf-8 -*-
+"""
+audit_sink.py
+
+Gravação assíncrona da auditoria de acesso (central_access_audit e
+localiza_access_audit), usada pelo _audit() de service_auth_central e
+service_auth_localiza.
+
+- A tabela é garantida UMA vez, pela thread de gravação, antes do primeiro
+  lote (antes: CREATE TABLE IF NOT EXISTS + conexão + commit a cada
+  checagem de autenticação).
+- _audit() só enfileira (put_nowait) e volta. A thread junta até
+  AUDIT_BATCH_MAX registros ou espera AUDIT_FLUSH_MS e grava tudo com um
+  executemany numa transação.
+- Fila limitada (AUDIT_QUEUE_MAX): cheia -> o registro é descartado e
+  contado em anjo_audit_dropped_total{table}. Uma rajada de tentativas de
+  login não vira uma rajada de escritas no banco.
+
+Config (env):
+- AUDIT_QUEUE_MAX   tamanho da fila (padrão 5000)
+- AUDIT_BATCH_MAX   registros por lote (padrão 500)
+- AUDIT_FLUSH_MS    espera máxima para juntar um lote (padrão 1000)
+"""
+
+import atexit
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+from typing import Callable, List, Optional, Tuple
+
+from services.instrumentacao import counter
+
+logger = logging.getLogger("anjo_da_guarda")
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, str(default)))
+    except Exception:
+        return default
+
+
+AUDIT_DESCARTADOS = counter(
+    "anjo_audit_dropped_total",
+    "Registros de auditoria descartados (fila cheia ou erro de gravação).",
+    ("table", "reason"),
+)
+
+Registro = Tuple[str, str, str, str, int, str, str]
+
+
+class AuditSink:
+    def __init__(
+        self,
+        tabela: str,
+        connect: Callable[[], sqlite3.Connection],
+        garantir_tabela: Callable[[sqlite3.Connection], None],
+    ):
+        self._tabela = tabela
+        self._connect = connect
+        self._garantir_tabela = garantir_tabela
+        self._fila: "queue.Queue[Optional[Registro]]" = queue.Queue(
+            maxsize=max(1, _env_int("AUDIT_QUEUE_MAX", 5000))
+        )
+        self._batch_max = max(1, _env_int("AUDIT_BATCH_MAX", 500))
+        self._flush_s = max(0.0, _env_int("AUDIT_FLUSH_MS", 1000) / 1000.0)
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._tabela_ok = False
+        self._descartados = 0
+
+    def registrar(self, registro: Registro) -> None:
+        """(ts_utc, username, ip, path, ok, reason, user_agent). Nunca bloqueia."""
+        self._ensure_started()
+        try:
+            self._fila.put_nowait(registro)
+        except queue.Full:
+            AUDIT_DESCARTADOS.inc(self._tabela, "queue_full")
+            self._descartados += 1
+            if self._descartados == 1 or self._descartados % 1000 == 0:
+                logger.warning(
+                    "[AUDIT] fila de %s cheia; %s registros descartados até agora",
+                    self._tabela,
+                    self._descartados,
+                )
+
+    def pendentes(self) -> int:
+        return self._fila.qsize()
+
+    def parar(self, timeout: float = 5.0) -> None:
+        """Drena a fila (encerramento do processo)."""
+        th = self._thread
+        if th is None:
+            return
+        try:
+            self._fila.put(None, timeout=timeout)
+        except queue.Full:
+            return
+        th.join(timeout)
+
+    # ----------------------------
+    # Internos
+    # ----------------------------
+    def _ensure_started(self) -> None:
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                th = threading.Thread(
+                    target=self._loop, name=f"audit-{self._tabela}", daemon=True
+                )
+                th.start()
+                self._thread = th
+                atexit.register(self.parar)
+
+    def _loop(self) -> None:
+        while True:
+            item = self._fila.get()
+            if item is None:
+                return
+            lote = [item]
+            limite = time.monotonic() + self._flush_s
+            fim = False
+            while len(lote) < self._batch_max:
+                resto = limite - time.monotonic()
+                try:
+                    prox = (
+                        self._fila.get(timeout=resto) if resto > 0 else self._fila.get_nowait()
+                    )
+                except queue.Empty:
+                    break
+                if prox is None:
+                    fim = True
+                    break
+                lote.append(prox)
+            self._gravar(lote)
+            if fim:
+                return
+
+    def _gravar(self, lote: List[Registro]) -> None:
+        try:
+            conn = self._connect()
+            try:
+                if not self._tabela_ok:
+                    self._garantir_tabela(conn)
+                    self._tabela_ok = True
+                conn.executemany(
+                    f"""
+                    INSERT INTO {self._tabela}(ts_utc, username, ip, path, ok, reason, user_agent)
+                    VALUES(?,?,?,?,?,?,?)
+                    """,
+                    lote,
+                )
+                conn.commit()
+            finally:
+                conn.close()
+        except Exception as e:
+            # auditoria nunca derruba o sistema
+            AUDIT_DESCARTADOS.inc(self._tabela, "db_error", n=len(lote))
+            logger.error("[AUDIT] erro ao gravar %s registros em %s: %s", len(lote), self._tabela, e)
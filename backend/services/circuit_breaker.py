@@ -0,0 +1,270 @@
+# backend/services/circuit_breaker.py
+# -*- coding: utf-8 -*-
+"""
+circuit_breaker.py
+
+Circuit breaker por provedor (email, sms, whatsapp, telegram).
+
+Cada breaker guarda uma janela deslizante (CB_WINDOW_S) de chamadas com
+resultado e latência:
+- closed    -> chamadas normais; se a taxa de erro da janela passar de
+               CB_ERROR_RATE (com pelo menos CB_MIN_CALLS chamadas), abre.
+- open      -> falha na hora (reason=CIRCUIT_OPEN) por CB_OPEN_S segundos;
+               o SOS segue direto para o próximo canal.
+- half_open -> deixa passar UMA chamada de teste; sucesso fecha,
+               falha abre de novo. Chamadas concorrentes (fan-out do
+               mesmo SOS) aguardam o veredito do teste em vez de falhar.
+
+Chamadas mais lentas que CB_SLOW_CALL_S contam como falha: o que este
+módulo evita é justamente cada SOS esperar 20–25 s de timeout.
+
+O estado (com "score" de saúde) aparece em /api/health; latência e
+resultado de cada chamada vão para /metrics.
+"""
+
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Optional, Tuple
+
+from services.instrumentacao import observar_provedor, provedor_recusado
+from services.tracing import span
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, str(default)))
+    except Exception:
+        return default
+
+
+class CircuitBreaker:
+    def __init__(
+        self,
+        nome: str,
+        window_s: float = 60.0,
+        min_calls: int = 5,
+        error_rate: float = 0.5,
+        open_s: float = 30.0,
+        slow_call_s: float = 10.0,
+    ):
+        self.nome = nome
+        self.window_s = window_s
+        self.min_calls = max(1, int(min_calls))
+        self.error_rate = error_rate
+        self.open_s = open_s
+        self.slow_call_s = slow_call_s
+
+        self._lock = threading.Lock()
+        self._probe_done = threading.Condition(self._lock)
+        # (ts_monotonic, ok, latencia_s)
+        self._calls: Deque[Tuple[float, bool, float]] = deque()
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._last_error_at: Optional[float] = None
+
+    # ----------------------------
+    # Decisão
+    # ----------------------------
+    def allow(self) -> bool:
+        with self._lock:
+            now = time.monotonic()
+            if self._state == CLOSED:
+                return True
+            if self._state == OPEN:
+                if now - self._opened_at < self.open_s:
+                    return False
+                self._state = HALF_OPEN
+                self._probe_in_flight = False
+            # HALF_OPEN: só uma chamada de teste por vez; as demais
+            # esperam o resultado dela (no máximo slow_call_s)
+            if self._probe_in_flight:
+                self._probe_done.wait_for(
+                    lambda: not self._probe_in_flight, timeout=self.slow_call_s
+                )
+                return self._state == CLOSED
+            self._probe_in_flight = True
+            return True
+
+    def record(self, ok: bool, latencia_s: float) -> None:
+        if latencia_s >= self.slow_call_s:
+            ok = False
+        with self._lock:
+            now = time.monotonic()
+            if not ok:
+                self._last_error_at = now
+
+            if self._state == HALF_OPEN:
+                self._probe_in_flight = False
+                if ok:
+                    self._state = CLOSED
+                    self._calls.clear()
+                else:
+                    self._state = OPEN
+                    self._opened_at = now
+                self._calls.append((now, ok, latencia_s))
+                self._probe_done.notify_all()
+                return
+
+            self._calls.append((now, ok, latencia_s))
+            self._trim(now)
+
+            if self._state == CLOSED and len(self._calls) >= self.min_calls:
+                erros = sum(1 for _, c_ok, _ in self._calls if not c_ok)
+                if erros / len(self._calls) >= self.error_rate:
+                    self._state = OPEN
+                    self._opened_at = now
+
+    def _trim(self, now: float) -> None:
+        limite = now - self.window_s
+        while self._calls and self._calls[0][0] < limite:
+            self._calls.popleft()
+
+    # ----------------------------
+    # Saúde
+    # ----------------------------
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            now = time.monotonic()
+            self._trim(now)
+            total = len(self._calls)
+            erros = sum(1 for _, c_ok, _ in self._calls if not c_ok)
+            lats = sorted(lat for _, _, lat in self._calls)
+
+            def _pct(p: float) -> Optional[float]:
+                if not lats:
+                    return None
+                idx = min(len(lats) - 1, int(round(p * (len(lats) - 1))))
+                return round(lats[idx] * 1000.0, 1)
+
+            taxa_erro = (erros / total) if total else 0.0
+            state = self._state
+            if state == OPEN and now - self._opened_at >= self.open_s:
+                state = HALF_OPEN  # próxima chamada vira teste
+            return {
+                "state": state,
+                "score": round(1.0 - taxa_erro, 3),
+                "calls": total,
+                "errors": erros,
+                "error_rate": round(taxa_erro, 3),
+                "p50_ms": _pct(0.50),
+                "p95_ms": _pct(0.95),
+                "open_for_s": (
+                    round(max(0.0, self.open_s - (now - self._opened_at)), 1)
+                    if self._state == OPEN
+                    else 0.0
+                ),
+                "last_error_s_ago": (
+                    round(now - self._last_error_at, 1)
+                    if self._last_error_at is not None
+                    else None
+                ),
+            }
+
+
+# ----------------------------
+# Registro global por provedor
+# ----------------------------
+_registry_lock = threading.Lock()
+_BREAKERS: Dict[str, CircuitBreaker] = {}
+
+
+def circuit_breaker(nome: str) -> CircuitBreaker:
+    br = _BREAKERS.get(nome)
+    if br is None:
+        with _registry_lock:
+            br = _BREAKERS.get(nome)
+            if br is None:
+                br = CircuitBreaker(
+                    nome,
+                    window_s=_env_float("CB_WINDOW_S", 60.0),
+                    min_calls=int(_env_float("CB_MIN_CALLS", 5)),
+                    error_rate=_env_float("CB_ERROR_RATE", 0.5),
+                    open_s=_env_float("CB_OPEN_S", 30.0),
+                    slow_call_s=_env_float("CB_SLOW_CALL_S", 10.0),
+                )
+                _BREAKERS[nome] = br
+    return br
+
+
+def snapshot_all() -> Dict[str, Dict[str, Any]]:
+    return {nome: br.snapshot() for nome, br in sorted(_BREAKERS.items())}
+
+
+_STATE_NUM = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+def estados_numericos() -> Dict[Tuple[str, ...], float]:
+    """Estado por provedor para gauge (0=closed, 1=half_open, 2=open)."""
+    return {
+        (nome,): float(_STATE_NUM.get(snap["state"], 0))
+        for nome, snap in snapshot_all().items()
+    }
+
+
+def falha_provedor(res: Dict[str, Any]) -> bool:
+    """
+    Classificação padrão: conta como falha do PROVEDOR só o que indica
+    indisponibilidade (exceção/timeout, 5xx, 403 de WAF, 408, 429).
+    Erros de cliente (ex.: número inválido -> 400) não abrem o circuito.
+    """
+    if res.get("ok"):
+        return False
+    status = res.get("status")
+    if not status:
+        return True
+    try:
+        status = int(status)
+    except Exception:
+        return True
+    return status >= 500 or status in (403, 408, 429)
+
+
+def proteger(
+    nome: str,
+    fn: Callable[[], Dict[str, Any]],
+    recusado: Dict[str, Any],
+    eh_falha: Callable[[Dict[str, Any]], bool] = falha_provedor,
+) -> Dict[str, Any]:
+    """
+    Executa `fn` (chamada ao provedor) sob o breaker `nome`.
+
+    Circuito aberto -> devolve `recusado` + reason=CIRCUIT_OPEN sem chamar.
+    """
+    with span(f"provider.{nome}", provider=nome) as sp:
+        br = circuit_breaker(nome)
+        if not br.allow():
+            provedor_recusado(nome)
+            if sp:
+                sp.set(outcome="circuit_open")
+            res = dict(recusado)
+            res["ok"] = False
+            res["reason"] = "CIRCUIT_OPEN"
+            return res
+
+        t0 = time.monotonic()
+        try:
+            res = fn()
+        except Exception:
+            latencia = time.monotonic() - t0
+            br.record(False, latencia)
+            observar_provedor(nome, "exception", latencia)
+            raise
+        latencia = time.monotonic() - t0
+        if res.get("ok"):
+            outcome = "ok"
+        elif eh_falha(res):
+            outcome = "error"
+        else:
+            outcome = "rejected"  # erro de cliente (ex.: número inválido)
+        br.record(outcome != "error", latencia)
+        observar_provedor(nome, outcome, latencia)
+        if sp:
+            sp.set(outcome=outcome)
+        return res
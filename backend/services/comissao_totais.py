@@ -0,0 +1,413 @@
+# backend/services/comissao_totais.py
+# -*- coding: utf-8 -*-
+"""
+comissao_totais.py
+
+Totais de comissão por vendedor, sem varrer o histórico em Python.
+
+- comissoes_totais_mensais: uma linha por (vendedor_email, mês 'YYYY-MM'),
+  com qtd, bruto, desconto, líquido e comissão em centavos. Mantida por
+  registrar_assinatura_site() na MESMA transação do INSERT em assinaturas
+  (acumular_totais), então o resumo de um vendedor lê só os meses dele.
+- Na primeira vez que a tabela é criada, ela é preenchida a partir de
+  assinaturas com um único SUM ... GROUP BY (reconstruir_totais). Se as
+  assinaturas forem alteradas por fora (SQL manual, scripts), rode:
+      python -m services.comissao_totais reconstruir
+- totais_por_periodo(): SUM direto em assinaturas para intervalos que não
+  caem em meses inteiros (usa idx_assinaturas_vendedor_created).
+- relatorio_vendedores(): fechamento do mês para TODOS os vendedores numa
+  consulta só (tabela mensal, ordenada por vendedor), com cache por período.
+  O cache vale para a versão da tabela mensal: comissoes_totais_versao tem
+  uma linha só, incrementada por acumular_totais e reconstruir_totais na
+  MESMA transação que mexe nos totais. Cada leitura do cache confere a
+  versão com um SELECT de uma linha, então gravações de outros workers e
+  dos CLIs (reconstruir, reprecificacao --aplicar) valem no próximo
+  relatório. Além disso, cada entrada expira em COMISSAO_REPORT_TTL_S
+  segundos (padrão 300; 0 desliga o cache). invalidar_relatorio descarta
+  na hora o cache deste processo.
+  CLI:
+      python -m services.comissao_totais relatorio --from 2026-01 [--to 2026-03] [--csv saida.csv]
+
+Líquido = max(bruto - desconto, 0) em todo lugar (LIQUIDO_SQL/valor_liquido).
+"""
+
+import copy
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+LIQUIDO_SQL = "MAX(valor_mensal_centavos - COALESCE(desconto_centavos, 0), 0)"
+
+_CAMPOS = (
+    "valor_bruto_centavos",
+    "desconto_centavos",
+    "valor_liquido_centavos",
+    "comissao_centavos",
+)
+
+_TABELA_OK = False
+_TABELA_LOCK = threading.Lock()
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, str(default)))
+    except Exception:
+        return default
+
+
+CACHE_TTL_S = _env_float("COMISSAO_REPORT_TTL_S", 300.0)
+
+
+def valor_liquido(bruto: int, desconto: int) -> int:
+    return max(int(bruto or 0) - int(desconto or 0), 0)
+
+
+def garantir_tabela(conn: sqlite3.Connection) -> None:
+    """Cria a tabela (uma vez por processo); se for nova, já preenche."""
+    global _TABELA_OK
+    if _TABELA_OK:
+        return
+    with _TABELA_LOCK:
+        if _TABELA_OK:
+            return
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS comissoes_totais_versao (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                versao INTEGER NOT NULL
+            )
+            """
+        )
+        conn.execute(
+            "INSERT OR IGNORE INTO comissoes_totais_versao(id, versao) VALUES (1, 0)"
+        )
+        conn.commit()
+        existe = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type='table' "
+            "AND name='comissoes_totais_mensais'"
+        ).fetchone()
+        if not existe:
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS comissoes_totais_mensais (
+                    vendedor_email TEXT NOT NULL,
+                    mes TEXT NOT NULL,
+                    qtd INTEGER NOT NULL DEFAULT 0,
+                    valor_bruto_centavos INTEGER NOT NULL DEFAULT 0,
+                    desconto_centavos INTEGER NOT NULL DEFAULT 0,
+                    valor_liquido_centavos INTEGER NOT NULL DEFAULT 0,
+                    comissao_centavos INTEGER NOT NULL DEFAULT 0,
+                    PRIMARY KEY (vendedor_email, mes)
+                ) WITHOUT ROWID
+                """
+            )
+            reconstruir_totais(conn)
+            conn.commit()
+        _TABELA_OK = True
+
+
+def _nova_versao(conn: sqlite3.Connection) -> None:
+    conn.execute("UPDATE comissoes_totais_versao SET versao = versao + 1 WHERE id = 1")
+
+
+def versao_totais(conn: sqlite3.Connection) -> int:
+    r = conn.execute("SELECT versao FROM comissoes_totais_versao WHERE id = 1").fetchone()
+    return int(r[0]) if r else 0
+
+
+def reconstruir_totais(conn: sqlite3.Connection) -> int:
+    """Recalcula a tabela inteira com um SUM ... GROUP BY. Não faz commit."""
+    _nova_versao(conn)
+    conn.execute("DELETE FROM comissoes_totais_mensais")
+    cur = conn.execute(
+        f"""
+        INSERT INTO comissoes_totais_mensais(
+            vendedor_email, mes, qtd, valor_bruto_centavos, desconto_centavos,
+            valor_liquido_centavos, comissao_centavos
+        )
+        SELECT vendedor_email,
+               substr(created_at_utc, 1, 7),
+               COUNT(*),
+               COALESCE(SUM(valor_mensal_centavos), 0),
+               COALESCE(SUM(COALESCE(desconto_centavos, 0)), 0),
+               COALESCE(SUM({LIQUIDO_SQL}), 0),
+               COALESCE(SUM(COALESCE(comissao_centavos, 0)), 0)
+          FROM assinaturas
+         WHERE vendedor_email IS NOT NULL AND vendedor_email <> ''
+         GROUP BY vendedor_email, substr(created_at_utc, 1, 7)
+        """
+    )
+    return cur.rowcount
+
+
+def acumular_totais(
+    conn: sqlite3.Connection,
+    vendedor_email: Optional[str],
+    created_at_utc: str,
+    valor_bruto_centavos: int,
+    desconto_centavos: int,
+    comissao_centavos: int,
+) -> None:
+    """Soma UMA assinatura nova ao mês dela. Chamar na transação do INSERT."""
+    if not vendedor_email:
+        return
+    _nova_versao(conn)
+    bruto = int(valor_bruto_centavos or 0)
+    desc = int(desconto_centavos or 0)
+    conn.execute(
+        """
+        INSERT INTO comissoes_totais_mensais(
+            vendedor_email, mes, qtd, valor_bruto_centavos, desconto_centavos,
+            valor_liquido_centavos, comissao_centavos
+        )
+        VALUES (?, ?, 1, ?, ?, ?, ?)
+        ON CONFLICT(vendedor_email, mes) DO UPDATE SET
+            qtd = qtd + 1,
+            valor_bruto_centavos = valor_bruto_centavos + excluded.valor_bruto_centavos,
+            desconto_centavos = desconto_centavos + excluded.desconto_centavos,
+            valor_liquido_centavos = valor_liquido_centavos + excluded.valor_liquido_centavos,
+            comissao_centavos = comissao_centavos + excluded.comissao_centavos
+        """,
+        (
+            vendedor_email,
+            created_at_utc[:7],
+            bruto,
+            desc,
+            valor_liquido(bruto, desc),
+            int(comissao_centavos or 0),
+        ),
+    )
+
+
+def _vazio() -> Dict[str, int]:
+    return {c: 0 for c in _CAMPOS}
+
+
+def totais_vendedor(
+    conn: sqlite3.Connection,
+    vendedor_email: str,
+    de_mes: Optional[str] = None,
+    ate_mes: Optional[str] = None,
+) -> Dict[str, Any]:
+    """
+    Totais (e quebra por mês) de um vendedor a partir da tabela mensal.
+    `de_mes`/`ate_mes` ('YYYY-MM') são inclusivos.
+    """
+    garantir_tabela(conn)
+    sql = """
+        SELECT mes, qtd, valor_bruto_centavos, desconto_centavos,
+               valor_liquido_centavos, comissao_centavos
+          FROM comissoes_totais_mensais
+         WHERE vendedor_email = ?
+    """
+    params: List[Any] = [vendedor_email]
+    if de_mes:
+        sql += " AND mes >= ?"
+        params.append(de_mes)
+    if ate_mes:
+        sql += " AND mes <= ?"
+        params.append(ate_mes)
+    sql += " ORDER BY mes DESC"
+
+    totais = _vazio()
+    qtd = 0
+    meses = []
+    for r in conn.execute(sql, params).fetchall():
+        linha = {
+            "mes": r[0],
+            "qtd": int(r[1]),
+            **{c: int(r[i + 2]) for i, c in enumerate(_CAMPOS)},
+        }
+        meses.append(linha)
+        qtd += linha["qtd"]
+        for c in _CAMPOS:
+            totais[c] += linha[c]
+    return {"qtd": qtd, "totais": totais, "meses": meses}
+
+
+def totais_por_periodo(
+    conn: sqlite3.Connection,
+    vendedor_email: str,
+    de_utc: Optional[str] = None,
+    ate_utc: Optional[str] = None,
+) -> Dict[str, Any]:
+    """SUM direto em assinaturas (`de_utc` inclusivo, `ate_utc` exclusivo)."""
+    sql = f"""
+        SELECT COUNT(*),
+               COALESCE(SUM(valor_mensal_centavos), 0),
+               COALESCE(SUM(COALESCE(desconto_centavos, 0)), 0),
+               COALESCE(SUM({LIQUIDO_SQL}), 0),
+               COALESCE(SUM(COALESCE(comissao_centavos, 0)), 0)
+          FROM assinaturas
+         WHERE vendedor_email = ?
+    """
+    params: List[Any] = [vendedor_email]
+    if de_utc:
+        sql += " AND created_at_utc >= ?"
+        params.append(de_utc)
+    if ate_utc:
+        sql += " AND created_at_utc < ?"
+        params.append(ate_utc)
+    r = conn.execute(sql, params).fetchone()
+    return {
+        "qtd": int(r[0]),
+        "totais": {c: int(r[i + 1]) for i, c in enumerate(_CAMPOS)},
+    }
+
+
+# ----------------------------
+# Relatório de todos os vendedores (fechamento)
+# ----------------------------
+# (de_mes, ate_mes) -> (versão da tabela, expira monotonic, relatório). Só
+# guarda períodos pedidos; invalidar_relatorio descarta só os que contêm o
+# mês, e a versão no banco cobre as gravações dos outros processos.
+_CACHE_RELATORIO: Dict[
+    Tuple[Optional[str], Optional[str]], Tuple[int, float, List[Dict[str, Any]]]
+] = {}
+_CACHE_LOCK = threading.Lock()
+_CACHE_MAX = 64
+
+
+def _periodo_contem(
+    periodo: Tuple[Optional[str], Optional[str]], mes: Optional[str]
+) -> bool:
+    if mes is None:
+        return True
+    de_mes, ate_mes = periodo
+    return (not de_mes or mes >= de_mes) and (not ate_mes or mes <= ate_mes)
+
+
+def invalidar_relatorio(mes: Optional[str] = None) -> None:
+    """Descarta relatórios em cache que incluem `mes` ('YYYY-MM'; None = todos)."""
+    with _CACHE_LOCK:
+        for periodo in [p for p in _CACHE_RELATORIO if _periodo_contem(p, mes)]:
+            del _CACHE_RELATORIO[periodo]
+
+
+def relatorio_vendedores(
+    conn: sqlite3.Connection,
+    de_mes: Optional[str] = None,
+    ate_mes: Optional[str] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Uma seção por vendedor: {"vendedor_email", "qtd", "totais", "meses"},
+    vendedores em ordem alfabética e meses em ordem crescente.
+    """
+    periodo = (de_mes or None, ate_mes or None)
+    garantir_tabela(conn)
+    # lida ANTES dos totais: gravação concorrente deixa o cache com versão
+    # velha, e o próximo pedido recarrega
+    versao = versao_totais(conn)
+    if CACHE_TTL_S > 0:
+        with _CACHE_LOCK:
+            em_cache = _CACHE_RELATORIO.get(periodo)
+        if em_cache is not None and em_cache[0] == versao and time.monotonic() < em_cache[1]:
+            return copy.deepcopy(em_cache[2])
+
+    sql = """
+        SELECT vendedor_email, mes, qtd, valor_bruto_centavos, desconto_centavos,
+               valor_liquido_centavos, comissao_centavos
+          FROM comissoes_totais_mensais
+         WHERE 1=1
+    """
+    params: List[Any] = []
+    if periodo[0]:
+        sql += " AND mes >= ?"
+        params.append(periodo[0])
+    if periodo[1]:
+        sql += " AND mes <= ?"
+        params.append(periodo[1])
+    sql += " ORDER BY vendedor_email, mes"
+
+    secoes: List[Dict[str, Any]] = []
+    atual: Optional[Dict[str, Any]] = None
+    for r in conn.execute(sql, params).fetchall():
+        if atual is None or atual["vendedor_email"] != r[0]:
+            atual = {"vendedor_email": r[0], "qtd": 0, "totais": _vazio(), "meses": []}
+            secoes.append(atual)
+        linha = {
+            "mes": r[1],
+            "qtd": int(r[2]),
+            **{c: int(r[i + 3]) for i, c in enumerate(_CAMPOS)},
+        }
+        atual["meses"].append(linha)
+        atual["qtd"] += linha["qtd"]
+        for c in _CAMPOS:
+            atual["totais"][c] += linha[c]
+
+    if CACHE_TTL_S > 0:
+        with _CACHE_LOCK:
+            if len(_CACHE_RELATORIO) >= _CACHE_MAX:
+                _CACHE_RELATORIO.clear()
+            _CACHE_RELATORIO[periodo] = (versao, time.monotonic() + CACHE_TTL_S, secoes)
+    return copy.deepcopy(secoes)
+
+
+CABECALHO_RELATORIO = ["vendedor_email", "mes", "qtd", *_CAMPOS]
+
+
+def linhas_relatorio(secoes: List[Dict[str, Any]]) -> Iterator[List[Any]]:
+    """
+    Linhas de CSV: por vendedor, os meses e uma linha "TOTAL"; no fim,
+    "TOTAL GERAL" (vendedor vazio).
+    """
+    geral = _vazio()
+    qtd_geral = 0
+    for sec in secoes:
+        for m in sec["meses"]:
+            yield [sec["vendedor_email"], m["mes"], m["qtd"], *(m[c] for c in _CAMPOS)]
+        yield [
+            sec["vendedor_email"],
+            "TOTAL",
+            sec["qtd"],
+            *(sec["totais"][c] for c in _CAMPOS),
+        ]
+        qtd_geral += sec["qtd"]
+        for c in _CAMPOS:
+            geral[c] += sec["totais"][c]
+    yield ["", "TOTAL GERAL", qtd_geral, *(geral[c] for c in _CAMPOS)]
+
+
+def _main() -> None:
+    import argparse
+    import csv
+    import sys
+
+    from services.service_assinaturas import DB_PATH
+
+    ap = argparse.ArgumentParser(prog="python -m services.comissao_totais")
+    sub = ap.add_subparsers(dest="cmd")
+    sub.add_parser("reconstruir", help="recalcula comissoes_totais_mensais")
+    rel = sub.add_parser("relatorio", help="totais de todos os vendedores")
+    rel.add_argument("--from", dest="de_mes", help="mês inicial YYYY-MM")
+    rel.add_argument("--to", dest="ate_mes", help="mês final YYYY-MM")
+    rel.add_argument("--csv", dest="saida", help="arquivo de saída (padrão: stdout)")
+    args = ap.parse_args()
+
+    con = sqlite3.connect(DB_PATH)
+    try:
+        garantir_tabela(con)
+        if args.cmd == "relatorio":
+            secoes = relatorio_vendedores(con, args.de_mes, args.ate_mes)
+            out = open(args.saida, "w", newline="", encoding="utf-8") if args.saida else sys.stdout
+            try:
+                w = csv.writer(out, delimiter=";")
+                w.writerow(CABECALHO_RELATORIO)
+                w.writerows(linhas_relatorio(secoes))
+            finally:
+                if args.saida:
+                    out.close()
+            return
+        n = reconstruir_totais(con)
+        con.commit()
+        invalidar_relatorio()
+        print(f"[COMISSAO] totais mensais reconstruídos: {n} linhas em {DB_PATH}")
+    finally:
+        con.close()
+
+
+if __name__ == "__main__":
+    _main()
@@ -0,0 +1,468 @@
+# backend/services/config.py
+# -*- coding: utf-8 -*-
+"""
+config.py
+
+Configuração tipada, lida UMA vez do ambiente e trocada inteira no reload.
+
+- carregar_env_arquivos(): o único leitor de backend/.env e raiz/.env
+  (antes havia uma cópia em service_auth_central, service_auth_localiza,
+  service_email_assinatura e watchdog_live_track, e as duas primeiras
+  reabriam os arquivos a cada request). Lê os arquivos só na primeira
+  chamada; variáveis do processo não são sobrescritas, exceto com
+  sobrescrever=True para o backend/.env (o load_dotenv(override=True) que
+  o anjo_web_main sempre fez).
+- settings(): objeto imutável (dataclasses frozen) com CFG, Zenvia, SMTP,
+  SendGrid, auth da Central/Localiza e watchdog, já convertido (em vez de
+  int() no meio do SOS). Na subida, número inválido usa o padrão do campo
+  com um warning, como os leitores antigos faziam (ex.: TTL de sessão
+  inválido -> 60): uma variável errada de um módulo não derruba outro
+  processo que só lê a sua seção (ex.: o watchdog).
+- recarregar(): relê os .env, monta um Settings novo e troca a referência
+  de uma vez; quem pegou settings() antes continua com um objeto
+  consistente. Aqui a validação é estrita: com valor inválido
+  (ConfigInvalida), mantém o atual em vez de voltar ao padrão.
+  instalar_sighup() liga isso ao `kill -HUP <pid>`.
+- ao_recarregar(fn): ganchos chamados depois da troca (ex.: chaves de
+  sessão assinada).
+
+Valores lidos na subida para montar objetos de longa duração (agendador do
+Telegram, workers) continuam valendo até reiniciar o processo.
+"""
+
+import logging
+import os
+import signal
+import threading
+import time
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import Callable, Dict, List, Mapping, Optional, Tuple
+
+try:
+    from dotenv import dotenv_values  # type: ignore
+except ImportError:  # pragma: no cover
+    dotenv_values = None
+
+logger = logging.getLogger("anjo_da_guarda")
+
+_SERVICES_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.normpath(os.path.join(_SERVICES_DIR, ".."))
+ROOT_DIR = os.path.normpath(os.path.join(BACKEND_DIR, ".."))
+ENV_BACKEND = os.path.join(BACKEND_DIR, ".env")
+ENV_RAIZ = os.path.join(ROOT_DIR, ".env")
+
+_VERDADEIRO = ("1", "true", "yes", "on")
+
+
+class ConfigInvalida(ValueError):
+    """Variáveis de ambiente com valor inválido (lista em .erros)."""
+
+    def __init__(self, erros: List[str]):
+        super().__init__("; ".join(erros))
+        self.erros = erros
+
+
+# ----------------------------
+# .env
+# ----------------------------
+_env_lock = threading.Lock()
+_env_lido = False
+_env_sobrescrever = False
+# chave -> valor que veio de um .env (pode ser atualizado no reload)
+_DO_ARQUIVO: Dict[str, str] = {}
+
+
+def _ler_env(path: str) -> Dict[str, str]:
+    if not os.path.exists(path):
+        return {}
+    try:
+        if dotenv_values is not None:
+            return {k: v for k, v in dotenv_values(path).items() if k and v is not None}
+        vals: Dict[str, str] = {}
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line or line.startswith("#") or "=" not in line:
+                    continue
+                k, v = line.split("=", 1)
+                k = k.strip()
+                if k:
+                    vals[k] = v.strip().strip('"').strip("'")
+        return vals
+    except Exception as e:
+        # nunca derruba
+        logger.warning("[CONFIG] falha ao ler %s: %s", path, e)
+        return {}
+
+
+def carregar_env_arquivos(sobrescrever: bool = False, recarregar: bool = False) -> None:
+    """
+    backend/.env e raiz/.env -> os.environ (backend/.env vence). Sem
+    `recarregar`, só lê os arquivos na primeira chamada.
+    """
+    global _env_lido, _env_sobrescrever
+    if _env_lido and not recarregar and (_env_sobrescrever or not sobrescrever):
+        return
+    with _env_lock:
+        _env_sobrescrever = _env_sobrescrever or sobrescrever
+        backend = _ler_env(ENV_BACKEND)
+        valores = {**_ler_env(ENV_RAIZ), **backend}
+        for k, v in valores.items():
+            atual = os.environ.get(k)
+            if (
+                atual is None
+                or _DO_ARQUIVO.get(k) == atual
+                or (_env_sobrescrever and k in backend)
+            ):
+                os.environ[k] = v
+                _DO_ARQUIVO[k] = v
+        _env_lido = True
+
+
+# ----------------------------
+# Seções
+# ----------------------------
+@dataclass(frozen=True)
+class AppConfig:
+    """Antigo `class CFG` do anjo_web_main (mesmos nomes de campo)."""
+
+    app_title: str
+    public_base_url: str
+    # E-mail (SMTP do SOS)
+    email_enabled: bool
+    smtp_host: str
+    smtp_port: int
+    smtp_user: str
+    smtp_pass: str
+    email_from: str
+    email_from_name: str
+    email_reply_to: str
+    email_to_legacy: str
+    # Telegram
+    tg_enabled: bool
+    tg_token: str
+    tg_bot_username: str
+    tg_chat_id_legacy: str
+    tg_chat_ids: str
+    tg_global_rate: float
+    tg_per_chat_rate: float
+    tg_per_chat_burst: float
+    tg_max_retries: int
+    tg_workers: int
+
+
+@dataclass(frozen=True)
+class ZenviaConfig:
+    api_token: str
+    base_url: str
+    callback_url: str
+    wa_callback_url: str
+    proxy: str
+    sms_from: str
+    sms_to_list: Tuple[str, ...]
+    sms_simple: bool
+    sms_test: str
+    wa_enabled: bool
+    wa_from: str
+    wa_to_list: Tuple[str, ...]
+    wa_template_id: str
+    wa_simple: bool
+    wa_nome: str
+
+
+@dataclass(frozen=True)
+class SmtpConfig:
+    """SMTP_* do e-mail de boas-vindas das assinaturas."""
+
+    host: str
+    port: int
+    user: str
+    password: str
+    from_addr: str
+    from_name: str
+    link_download: str
+    url_qrcode: str
+
+
+@dataclass(frozen=True)
+class SendGridConfig:
+    api_key: str
+    from_email: str
+
+
+@dataclass(frozen=True)
+class AuthConfig:
+    """Basic/cookie da Central (CENTRAL_*) ou da Localiza (LOCALIZA_*)."""
+
+    users: Mapping[str, str]
+    cookie_name: str
+    session_ttl_min: int
+    cookie_secure: bool
+    session_secret: str
+    audit: bool
+
+
+@dataclass(frozen=True)
+class WatchdogConfig:
+    base_url: str
+    warn_s: int
+    crit_s: int
+    cooldown_s: int
+    telegram_token: str
+    telegram_chat_id: str
+    email_to: Tuple[str, ...]
+
+
+@dataclass(frozen=True)
+class Settings:
+    cfg: AppConfig
+    zenvia: ZenviaConfig
+    smtp: SmtpConfig
+    sendgrid: SendGridConfig
+    central: AuthConfig
+    localiza: AuthConfig
+    watchdog: WatchdogConfig
+    carregado_em: float
+
+
+# ----------------------------
+# Montagem (lê os.environ uma vez)
+# ----------------------------
+class _Leitor:
+    def __init__(self) -> None:
+        self.erros: List[str] = []
+
+    @staticmethod
+    def txt(*nomes: str, padrao: str = "") -> str:
+        """Primeiro nome com valor não vazio."""
+        for n in nomes:
+            v = (os.getenv(n) or "").strip()
+            if v:
+                return v
+        return padrao
+
+    def flag(self, nome: str, padrao: bool) -> bool:
+        v = (os.getenv(nome) or "").strip().lower()
+        return v in _VERDADEIRO if v else padrao
+
+    def inteiro(self, nome: str, padrao: int, minimo: Optional[int] = None) -> int:
+        v = (os.getenv(nome) or "").strip()
+        if not v:
+            return padrao
+        try:
+            n = int(v)
+        except ValueError:
+            self.erros.append(f"{nome}={v!r} não é inteiro (padrão {padrao})")
+            return padrao
+        return max(minimo, n) if minimo is not None else n
+
+    def real(self, nome: str, padrao: float) -> float:
+        v = (os.getenv(nome) or "").strip()
+        if not v:
+            return padrao
+        try:
+            n = float(v)
+        except ValueError:
+            self.erros.append(f"{nome}={v!r} não é número (padrão {padrao})")
+            return padrao
+        if n <= 0:
+            self.erros.append(f"{nome}={v!r} precisa ser > 0 (padrão {padrao})")
+            return padrao
+        return n
+
+    @staticmethod
+    def lista(*nomes: str) -> Tuple[str, ...]:
+        raw = _Leitor.txt(*nomes)
+        return tuple(x.strip() for x in raw.split(",") if x.strip())
+
+    def usuarios(self, prefixo: str) -> Mapping[str, str]:
+        """PREFIXO_USERS=a@x.com:senha;b@y.com:senha + PREFIXO_USER/PASS."""
+        users: Dict[str, str] = {}
+        for item in self.txt(f"{prefixo}_USERS").split(";"):
+            item = item.strip()
+            if not item or ":" not in item:
+                continue
+            u, p = item.split(":", 1)
+            u, p = u.strip(), p.strip()
+            if u and p:
+                users[u] = p
+        u1, p1 = self.txt(f"{prefixo}_USER"), self.txt(f"{prefixo}_PASS")
+        if u1 and p1 and u1 not in users:
+            users[u1] = p1
+        return MappingProxyType(users)
+
+    def auth(self, prefixo: str, audit_padrao: bool) -> AuthConfig:
+        cookie_padrao = f"{prefixo.lower()}_session"
+        return AuthConfig(
+            users=self.usuarios(prefixo),
+            cookie_name=self.txt(f"{prefixo}_COOKIE_NAME", padrao=cookie_padrao),
+            session_ttl_min=self.inteiro(f"{prefixo}_SESSION_TTL_MIN", 60, minimo=5),
+            cookie_secure=self.flag(f"{prefixo}_COOKIE_SECURE", True),
+            session_secret=self.txt(f"{prefixo}_SESSION_SECRET"),
+            audit=self.flag(f"{prefixo}_AUDIT", audit_padrao),
+        )
+
+
+def construir_settings(estrito: bool = False) -> Settings:
+    """
+    Lê o ambiente atual. Valores inválidos ficam no padrão do campo, com um
+    warning; com estrito=True levanta ConfigInvalida com todos os erros.
+    """
+    r = _Leitor()
+    callback = r.txt("ZENVIA_CALLBACK_URL")
+    cfg = AppConfig(
+        app_title="Anjo da Guarda (Web)",
+        public_base_url=r.txt("PUBLIC_BASE_URL", padrao="http://localhost:8000"),
+        email_enabled=r.flag("EMAIL_ENABLED", True),
+        smtp_host=r.txt("EMAIL_SMTP_HOST", padrao="smtp.gmail.com"),
+        smtp_port=r.inteiro("EMAIL_SMTP_PORT", 587),
+        smtp_user=r.txt("EMAIL_USERNAME"),
+        smtp_pass=r.txt("EMAIL_PASSWORD"),
+        email_from=r.txt("EMAIL_FROM", "EMAIL_USERNAME"),
+        email_from_name=r.txt("EMAIL_FROM_NAME"),
+        email_reply_to=r.txt("EMAIL_REPLY_TO"),
+        email_to_legacy=r.txt("EMAIL_TO_LIST"),
+        tg_enabled=r.flag("TELEGRAM_ENABLED", True),
+        tg_token=r.txt("TELEGRAM_BOT_TOKEN"),
+        tg_bot_username=r.txt("TELEGRAM_BOT_USERNAME"),
+        tg_chat_id_legacy=r.txt("TELEGRAM_CHAT_ID"),
+        tg_chat_ids=r.txt("TELEGRAM_CHAT_IDS"),
+        tg_global_rate=r.real("TELEGRAM_GLOBAL_RATE", 30.0),
+        tg_per_chat_rate=r.real("TELEGRAM_PER_CHAT_RATE", 1.0),
+        tg_per_chat_burst=r.real("TELEGRAM_PER_CHAT_BURST", 1.0),
+        tg_max_retries=r.inteiro("TELEGRAM_MAX_RETRIES", 3, minimo=0),
+        tg_workers=r.inteiro("TELEGRAM_WORKERS", 8, minimo=1),
+    )
+    zenvia = ZenviaConfig(
+        api_token=r.txt("ZENVIA_API_TOKEN"),
+        base_url=r.txt("ZENVIA_BASE_URL", padrao="https://api.zenvia.com/v2").rstrip("/"),
+        callback_url=callback,
+        wa_callback_url=r.txt("ZENVIA_WA_CALLBACK_URL", padrao=callback),
+        proxy=r.txt("ZENVIA_HTTP_PROXY", "HTTPS_PROXY", "HTTP_PROXY"),
+        sms_from=r.txt("ZENVIA_SMS_FROM", "ZENVIA_FROM", padrao="glaucusmotta"),
+        sms_to_list=r.lista("ZENVIA_SMS_TO_LIST"),
+        sms_simple=r.flag("ZENVIA_SMS_SIMPLE", False),
+        sms_test=r.txt("ZENVIA_SMS_TEST"),
+        wa_enabled=r.flag(
+            "ZENVIA_WA_ENABLED" if os.getenv("ZENVIA_WA_ENABLED") else "ZENVIA_WHATSAPP_ENABLED",
+            False,
+        ),
+        wa_from=r.txt("ZENVIA_WA_FROM", "ZENVIA_WHATSAPP_FROM"),
+        wa_to_list=r.lista("ZENVIA_WA_TO_LIST", "ZENVIA_WHATSAPP_TO_LIST"),
+        wa_template_id=r.txt("ZENVIA_WA_TEMPLATE_ID"),
+        wa_simple=r.flag("ZENVIA_WA_SIMPLE", False),
+        wa_nome=r.txt("ZENVIA_WA_NOME"),
+    )
+    smtp = SmtpConfig(
+        host=r.txt("SMTP_HOST"),
+        port=r.inteiro("SMTP_PORT", 465),
+        user=r.txt("SMTP_USER"),
+        password=r.txt("SMTP_PASS"),
+        from_addr=r.txt("SMTP_FROM"),
+        from_name=r.txt("SMTP_FROM_NAME", padrao="3G Brasil / Assinaturas Anjo da Guarda"),
+        link_download=r.txt(
+            "ANJO_DOWNLOAD_URL", padrao="https://www.3g-brasil.com/anjo-da-guarda"
+        ),
+        url_qrcode=r.txt(
+            "ANJO_QRCODE_URL",
+            padrao="https://www.3g-brasil.com/assets/qrcode-anjo-android.png",
+        ),
+    )
+    sendgrid = SendGridConfig(
+        api_key=r.txt("SENDGRID_API_KEY", "SENDGRID_KEY"),
+        from_email=r.txt("SENDGRID_FROM", "EMAIL_FROM", "MAIL_FROM"),
+    )
+    watchdog = WatchdogConfig(
+        base_url=r.txt("WATCHDOG_BASE_URL", padrao="http://127.0.0.1:8000").rstrip("/"),
+        warn_s=r.inteiro("WATCHDOG_WARN_SECONDS", 60),
+        crit_s=r.inteiro("WATCHDOG_CRIT_SECONDS", 180),
+        cooldown_s=r.inteiro("WATCHDOG_COOLDOWN_SECONDS", 300),
+        telegram_token=r.txt("TELEGRAM_BOT_TOKEN", "TELEGRAM_TOKEN", "TG_BOT_TOKEN"),
+        telegram_chat_id=r.txt("TELEGRAM_CHAT_ID", "TELEGRAM_ADMIN_CHAT_ID", "TG_CHAT_ID"),
+        email_to=r.lista("WATCHDOG_EMAIL_TO", "ALERT_EMAIL_TO", "ADMIN_EMAIL", "EMAIL_TO"),
+    )
+    central = r.auth("CENTRAL", audit_padrao=False)
+    localiza = r.auth("LOCALIZA", audit_padrao=True)
+    if r.erros:
+        if estrito:
+            raise ConfigInvalida(r.erros)
+        logger.warning(
+            "[CONFIG] valores inválidos, usando o padrão: %s", "; ".join(r.erros)
+        )
+    return Settings(
+        cfg=cfg,
+        zenvia=zenvia,
+        smtp=smtp,
+        sendgrid=sendgrid,
+        central=central,
+        localiza=localiza,
+        watchdog=watchdog,
+        carregado_em=time.time(),
+    )
+
+
+# ----------------------------
+# Instância atual + reload
+# ----------------------------
+_ATUAL: Optional[Settings] = None
+_lock = threading.Lock()
+_GANCHOS: List[Callable[[Settings], None]] = []
+
+
+def settings() -> Settings:
+    s = _ATUAL
+    if s is not None:
+        return s
+    return _montar_primeira()
+
+
+def _montar_primeira() -> Settings:
+    global _ATUAL
+    with _lock:
+        if _ATUAL is None:
+            carregar_env_arquivos()
+            _ATUAL = construir_settings()
+        return _ATUAL
+
+
+def ao_recarregar(fn: Callable[[Settings], None]) -> None:
+    _GANCHOS.append(fn)
+
+
+def recarregar() -> bool:
+    """Relê .env + ambiente e troca o Settings. False se inválido (mantém o atual)."""
+    global _ATUAL
+    with _lock:
+        carregar_env_arquivos(recarregar=True)
+        try:
+            novo = construir_settings(estrito=True)
+        except ConfigInvalida as e:
+            logger.error("[CONFIG] reload ignorado, configuração inválida: %s", e)
+            return False
+        _ATUAL = novo
+    for fn in list(_GANCHOS):
+        try:
+            fn(novo)
+        except Exception as e:
+            logger.error("[CONFIG] gancho de reload falhou (%s): %s", fn, e)
+    logger.info("[CONFIG] configuração recarregada")
+    return True
+
+
+def instalar_sighup() -> bool:
+    """`kill -HUP <pid>` recarrega. Só na thread principal e onde existe SIGHUP."""
+    if not hasattr(signal, "SIGHUP"):
+        return False
+    try:
+        # o handler só agenda: recarregar() pega locks e faz I/O
+        signal.signal(
+            signal.SIGHUP,
+            lambda *_: threading.Thread(
+                target=recarregar, name="config-reload", daemon=True
+            ).start(),
+        )
+    except ValueError:
+        # fora da thread principal (ex.: alguns runners de teste)
+        return False
+    return True
@@ -0,0 +1,96 @@
+# backend/services/csv_stream.py
+# -*- coding: utf-8 -*-
+"""
+csv_stream.py
+
+Helpers para exportar CSV em streaming (StreamingResponse):
+- csv_em_blocos(): transforma um iterador de linhas em blocos de bytes
+  (~64 KB), com gzip opcional (zlib, formato .gz);
+- intervalo_utc(): valida filtros from/to (YYYY-MM-DD ou ISO) e devolve
+  limites comparáveis com as colunas *_utc (texto ISO).
+
+O cabeçalho sai no primeiro bloco, antes da consulta começar a devolver
+linhas: o download começa na hora, e a memória não cresce com o número de
+linhas.
+"""
+
+import csv
+import io
+import zlib
+from datetime import datetime, timedelta, timezone
+from typing import Iterable, Iterator, Optional, Sequence, Tuple
+
+_BLOCO = 64 * 1024
+
+
+def intervalo_utc(
+    de: Optional[str], ate: Optional[str]
+) -> Tuple[Optional[str], Optional[str]]:
+    """
+    (de, ate) -> (limite_inferior_inclusivo, limite_superior_exclusivo).
+
+    `ate` só com data (YYYY-MM-DD) inclui o dia inteiro.
+    Levanta ValueError se alguma data for inválida.
+    """
+
+    def _parse(v: str) -> datetime:
+        v = v.strip()
+        if v.endswith("Z"):
+            v = v[:-1]
+        d = datetime.fromisoformat(v)
+        if d.tzinfo is not None:
+            d = d.astimezone(timezone.utc).replace(tzinfo=None)
+        return d
+
+    inicio = fim = None
+    if de and de.strip():
+        inicio = _parse(de).isoformat(timespec="seconds")
+    if ate and ate.strip():
+        d = _parse(ate)
+        if len(ate.strip()) == 10:
+            d = d + timedelta(days=1)
+            fim = d.isoformat(timespec="seconds")
+        else:
+            # inclusivo até o segundo informado (colunas têm sufixo 'Z')
+            fim = (d + timedelta(seconds=1)).isoformat(timespec="seconds")
+    return inicio, fim
+
+
+def csv_em_blocos(
+    cabecalho: Sequence[object],
+    linhas: Iterable[Sequence[object]],
+    gzip: bool = False,
+    delimiter: str = ";",
+) -> Iterator[bytes]:
+    buf = io.StringIO()
+    writer = csv.writer(buf, delimiter=delimiter)
+    comp = zlib.compressobj(6, zlib.DEFLATED, 31) if gzip else None  # 31 = gzip
+
+    def _saida(texto: str, flush: bool = False) -> bytes:
+        dados = texto.encode("utf-8")
+        if comp is None:
+            return dados
+        out = comp.compress(dados)
+        if flush:
+            out += comp.flush(zlib.Z_SYNC_FLUSH)
+        return out
+
+    writer.writerow(cabecalho)
+    yield _saida(buf.getvalue(), flush=True)
+    buf.seek(0)
+    buf.truncate()
+
+    for linha in linhas:
+        writer.writerow(linha)
+        if buf.tell() >= _BLOCO:
+            bloco = _saida(buf.getvalue())
+            buf.seek(0)
+            buf.truncate()
+            if bloco:
+                yield bloco
+
+    final = _saida(buf.getvalue())
+    if comp is not None:
+        final += comp.flush()
+    if final:
+        yield final
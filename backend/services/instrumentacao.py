@@ -0,0 +1,360 @@
+# backend/services/instrumentacao.py
+# -*- coding: utf-8 -*-
+"""
+instrumentacao.py
+
+Métricas em memória exportadas no formato texto do Prometheus (GET /metrics).
+
+Sem dependência de prometheus_client: Counter, Gauge e Histogram simples,
+thread-safe, com labels. Métricas já registradas:
+
+- anjo_http_request_duration_seconds{method,route,status}
+    latência por rota FastAPI (usa o template da rota, ex. /t/{session_id},
+    para não explodir cardinalidade)
+- anjo_provider_request_duration_seconds{provider,outcome}
+    chamada a email/sms/whatsapp/telegram (medida em circuit_breaker.proteger)
+- anjo_provider_short_circuited_total{provider}
+    chamadas recusadas com circuito aberto
+- anjo_db_statement_duration_seconds{op,table}
+    tempo de execute/executemany no SQLite (ConexaoInstrumentada)
+- anjo_sos_dispatch_duration_seconds{outcome}
+    /api/sos de ponta a ponta
+- gauges por callback (live tracking, filas) registrados pelo app
+"""
+
+import re
+import sqlite3
+import threading
+import time
+from functools import lru_cache
+from typing import Callable, Dict, List, Optional, Sequence, Tuple, Union
+
+# Buckets padrão (segundos): de 5 ms até o timeout dos provedores (25 s)
+BUCKETS_LATENCIA = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 25.0,
+)
+BUCKETS_SOS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 25.0, 60.0)
+
+LabelValues = Tuple[str, ...]
+
+
+def _escape(v: str) -> str:
+    return v.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _fmt_labels(nomes: Sequence[str], valores: LabelValues, extra: str = "") -> str:
+    partes = [f'{n}="{_escape(v)}"' for n, v in zip(nomes, valores)]
+    if extra:
+        partes.append(extra)
+    return "{" + ",".join(partes) + "}" if partes else ""
+
+
+def _fmt_num(v: float) -> str:
+    if v == float("inf"):
+        return "+Inf"
+    if float(v).is_integer():
+        return str(int(v))
+    return repr(float(v))
+
+
+class _Metrica:
+    tipo = ""
+
+    def __init__(self, nome: str, ajuda: str, labels: Sequence[str] = ()):
+        self.nome = nome
+        self.ajuda = ajuda
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+
+    def _chave(self, valores: Sequence[str]) -> LabelValues:
+        if len(valores) != len(self.labels):
+            raise ValueError(f"{self.nome}: esperado labels {self.labels}")
+        return tuple(str(v) for v in valores)
+
+    def _cabecalho(self) -> List[str]:
+        return [f"# HELP {self.nome} {self.ajuda}", f"# TYPE {self.nome} {self.tipo}"]
+
+    def render(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metrica):
+    tipo = "counter"
+
+    def __init__(self, nome: str, ajuda: str, labels: Sequence[str] = ()):
+        super().__init__(nome, ajuda, labels)
+        self._valores: Dict[LabelValues, float] = {}
+
+    def inc(self, *valores: str, n: float = 1.0) -> None:
+        chave = self._chave(valores)
+        with self._lock:
+            self._valores[chave] = self._valores.get(chave, 0.0) + n
+
+    def render(self) -> List[str]:
+        with self._lock:
+            itens = sorted(self._valores.items())
+        linhas = self._cabecalho()
+        for chave, v in itens:
+            linhas.append(f"{self.nome}{_fmt_labels(self.labels, chave)} {_fmt_num(v)}")
+        return linhas
+
+
+class Gauge(_Metrica):
+    """
+    Gauge com valor definido (set) ou lido na hora do scrape (set_function).
+    Com labels, a função devolve {(label1, ...): valor}.
+    """
+
+    tipo = "gauge"
+
+    def __init__(self, nome: str, ajuda: str, labels: Sequence[str] = ()):
+        super().__init__(nome, ajuda, labels)
+        self._valores: Dict[LabelValues, float] = {}
+        self._fn: Optional[Callable[[], Union[float, Dict[LabelValues, float]]]] = None
+
+    def set(self, v: float, *valores: str) -> None:
+        chave = self._chave(valores)
+        with self._lock:
+            self._valores[chave] = float(v)
+
+    def set_function(
+        self, fn: Callable[[], Union[float, Dict[LabelValues, float]]]
+    ) -> None:
+        self._fn = fn
+
+    def _coletar(self) -> Dict[LabelValues, float]:
+        if self._fn is None:
+            with self._lock:
+                return dict(self._valores)
+        try:
+            res = self._fn()
+        except Exception:
+            return {}
+        if isinstance(res, dict):
+            return {tuple(str(x) for x in k): float(v) for k, v in res.items()}
+        return {(): float(res)}
+
+    def render(self) -> List[str]:
+        linhas = self._cabecalho()
+        for chave, v in sorted(self._coletar().items()):
+            linhas.append(f"{self.nome}{_fmt_labels(self.labels, chave)} {_fmt_num(v)}")
+        return linhas
+
+
+class Histogram(_Metrica):
+    tipo = "histogram"
+
+    def __init__(
+        self,
+        nome: str,
+        ajuda: str,
+        labels: Sequence[str] = (),
+        buckets: Sequence[float] = BUCKETS_LATENCIA,
+    ):
+        super().__init__(nome, ajuda, labels)
+        self.buckets = tuple(sorted(float(b) for b in buckets))
+        # chave -> [contagens por bucket..., soma, total]
+        self._series: Dict[LabelValues, List[float]] = {}
+
+    def observe(self, v: float, *valores: str) -> None:
+        chave = self._chave(valores)
+        with self._lock:
+            serie = self._series.get(chave)
+            if serie is None:
+                serie = [0.0] * (len(self.buckets) + 2)
+                self._series[chave] = serie
+            for i, limite in enumerate(self.buckets):
+                if v <= limite:
+                    serie[i] += 1
+                    break
+            serie[-2] += v
+            serie[-1] += 1
+
+    def render(self) -> List[str]:
+        with self._lock:
+            itens = sorted((k, list(s)) for k, s in self._series.items())
+        linhas = self._cabecalho()
+        for chave, serie in itens:
+            acumulado = 0.0
+            for i, limite in enumerate(self.buckets):
+                acumulado += serie[i]
+                le = f'le="{_fmt_num(limite)}"'
+                linhas.append(
+                    f"{self.nome}_bucket{_fmt_labels(self.labels, chave, le)} {_fmt_num(acumulado)}"
+                )
+            le_inf = _fmt_labels(self.labels, chave, 'le="+Inf"')
+            linhas.append(f"{self.nome}_bucket{le_inf} {_fmt_num(serie[-1])}")
+            lbl = _fmt_labels(self.labels, chave)
+            linhas.append(f"{self.nome}_sum{lbl} {_fmt_num(serie[-2])}")
+            linhas.append(f"{self.nome}_count{lbl} {_fmt_num(serie[-1])}")
+        return linhas
+
+
+# ----------------------------
+# Registro global
+# ----------------------------
+_registro_lock = threading.Lock()
+_REGISTRO: Dict[str, _Metrica] = {}
+
+
+def _registrar(metrica: _Metrica) -> _Metrica:
+    with _registro_lock:
+        existente = _REGISTRO.get(metrica.nome)
+        if existente is not None:
+            return existente
+        _REGISTRO[metrica.nome] = metrica
+        return metrica
+
+
+def counter(nome: str, ajuda: str, labels: Sequence[str] = ()) -> Counter:
+    return _registrar(Counter(nome, ajuda, labels))  # type: ignore[return-value]
+
+
+def gauge(nome: str, ajuda: str, labels: Sequence[str] = ()) -> Gauge:
+    return _registrar(Gauge(nome, ajuda, labels))  # type: ignore[return-value]
+
+
+def histogram(
+    nome: str,
+    ajuda: str,
+    labels: Sequence[str] = (),
+    buckets: Sequence[float] = BUCKETS_LATENCIA,
+) -> Histogram:
+    return _registrar(Histogram(nome, ajuda, labels, buckets))  # type: ignore[return-value]
+
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def render_prometheus() -> str:
+    with _registro_lock:
+        metricas = [_REGISTRO[n] for n in sorted(_REGISTRO)]
+    linhas: List[str] = []
+    for m in metricas:
+        linhas.extend(m.render())
+    return "\n".join(linhas) + "\n"
+
+
+# ----------------------------
+# Métricas do app
+# ----------------------------
+HTTP_LATENCIA = histogram(
+    "anjo_http_request_duration_seconds",
+    "Latencia das requisicoes HTTP por rota.",
+    ("method", "route", "status"),
+)
+PROVEDOR_LATENCIA = histogram(
+    "anjo_provider_request_duration_seconds",
+    "Latencia das chamadas aos provedores (email, sms, whatsapp, telegram).",
+    ("provider", "outcome"),
+)
+PROVEDOR_RECUSADO = counter(
+    "anjo_provider_short_circuited_total",
+    "Chamadas recusadas com circuito aberto.",
+    ("provider",),
+)
+DB_LATENCIA = histogram(
+    "anjo_db_statement_duration_seconds",
+    "Tempo de execute/executemany no SQLite.",
+    ("op", "table"),
+)
+SOS_LATENCIA = histogram(
+    "anjo_sos_dispatch_duration_seconds",
+    "Tempo total do /api/sos (validacao, envio em todos os canais e auditoria).",
+    ("outcome",),
+    buckets=BUCKETS_SOS,
+)
+
+
+def observar_provedor(provider: str, outcome: str, latencia_s: float) -> None:
+    PROVEDOR_LATENCIA.observe(latencia_s, provider, outcome)
+
+
+def provedor_recusado(provider: str) -> None:
+    PROVEDOR_RECUSADO.inc(provider)
+
+
+# ----------------------------
+# Middleware ASGI (latência por rota)
+# ----------------------------
+class MetricsMiddleware:
+    """
+    Middleware ASGI puro (sem BaseHTTPMiddleware, não bufferiza respostas).
+    O template da rota é lido de scope["route"], preenchido pelo roteador.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope.get("type") != "http":
+            await self.app(scope, receive, send)
+            return
+
+        t0 = time.perf_counter()
+        status = {"code": 500}
+
+        async def _send(message):
+            if message.get("type") == "http.response.start":
+                status["code"] = message.get("status", 500)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, _send)
+        finally:
+            route = scope.get("route")
+            path = getattr(route, "path", None) or "<unmatched>"
+            HTTP_LATENCIA.observe(
+                time.perf_counter() - t0,
+                scope.get("method", ""),
+                path,
+                str(status["code"]),
+            )
+
+
+# ----------------------------
+# SQLite instrumentado
+# ----------------------------
+_RE_TABELA = re.compile(
+    r"\b(?:FROM|INTO|UPDATE|TABLE(?:\s+IF\s+NOT\s+EXISTS)?)\s+([A-Za-z_][A-Za-z0-9_]*)",
+    re.IGNORECASE,
+)
+
+
+@lru_cache(maxsize=512)
+def _rotulo_sql(sql: str) -> Tuple[str, str]:
+    s = sql.lstrip()
+    op = (s.split(None, 1)[0] if s else "").upper() or "?"
+    m = _RE_TABELA.search(s)
+    return op, (m.group(1).lower() if m else "")
+
+
+class ConexaoInstrumentada(sqlite3.Connection):
+    """
+    sqlite3.Connection que mede execute/executemany/executescript.
+    Uso: sqlite3.connect(path, factory=ConexaoInstrumentada).
+
+    Em SELECT o tempo medido vai até o primeiro passo do statement; o
+    fetch das linhas seguintes não entra.
+    """
+
+    def execute(self, sql, parameters=(), /):
+        t0 = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            DB_LATENCIA.observe(time.perf_counter() - t0, *_rotulo_sql(sql))
+
+    def executemany(self, sql, parameters, /):
+        t0 = time.perf_counter()
+        try:
+            return super().executemany(sql, parameters)
+        finally:
+            DB_LATENCIA.observe(time.perf_counter() - t0, *_rotulo_sql(sql))
+
+    def executescript(self, sql_script, /):
+        t0 = time.perf_counter()
+        try:
+            return super().executescript(sql_script)
+        finally:
+            DB_LATENCIA.observe(time.perf_counter() - t0, "SCRIPT", "")
@@ -0,0 +1,217 @@
+# backend/services/manutencao.py
+# -*- coding: utf-8 -*-
+"""
+manutencao.py
+
+Limpeza periódica de linhas vencidas que ninguém mais lê:
+
+- central_sessions / localiza_sessions: expiradas (expires_at_utc já
+  passou) ou revogadas. Antes só eram marcadas revoked=1 quando algum
+  request tocava nelas, e nunca saíam da tabela;
+- email_tokens: vencidos há mais de MAINT_RETENTION_DAYS dias (o token
+  usado ainda serve para o onboarding de perfil/contatos logo depois do
+  consentimento, por isso a folga);
+- live_sessions: expiradas há mais de MAINT_RETENTION_DAYS dias;
+- watchdog_state: sessões que o watchdog não vê há mais de
+  MAINT_RETENTION_DAYS dias;
+- sos_idempotency: reservas de chave de SOS já vencidas (expires_at).
+
+Cada tabela é apagada em lotes de MAINT_BATCH linhas, uma transação curta
+por lote (com uma pausa entre lotes), para não segurar o lock de escrita
+do SQLite enquanto o SOS e o tracking gravam. No fim da varredura roda
+PRAGMA optimize (atualiza as estatísticas das tabelas que mudaram).
+
+Config (env):
+- MAINT_INTERVAL_S     intervalo entre varreduras (padrão 3600; 0 desliga
+                       a thread, a CLI continua funcionando)
+- MAINT_RETENTION_DAYS folga para tokens/live/watchdog (padrão 7)
+- MAINT_BATCH          linhas por lote (padrão 500)
+
+CLI:
+    python -m services.manutencao
+"""
+
+import logging
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from services.instrumentacao import counter
+
+logger = logging.getLogger("anjo_da_guarda")
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, str(default)))
+    except Exception:
+        return default
+
+
+INTERVALO_S = _env_int("MAINT_INTERVAL_S", 3600)
+RETENCAO_DIAS = max(0, _env_int("MAINT_RETENTION_DAYS", 7))
+LOTE = max(1, _env_int("MAINT_BATCH", 500))
+_PAUSA_S = 0.05
+_PRIMEIRA_EXECUCAO_S = 60.0
+
+LINHAS_APAGADAS = counter(
+    "anjo_maintenance_rows_deleted_total",
+    "Linhas vencidas apagadas pela manutenção periódica.",
+    ("table",),
+)
+
+
+def _regras(agora: datetime) -> List[Tuple[str, str, Tuple[Any, ...]]]:
+    """
+    (tabela, WHERE, params). Os formatos de data seguem quem grava cada
+    tabela: sessões e watchdog em ISO com fuso, email_tokens,
+    live_sessions e sos_idempotency em ISO UTC sem fuso (datetime.utcnow()).
+    """
+    agora_tz = agora.isoformat()
+    limite = agora - timedelta(days=RETENCAO_DIAS)
+    limite_tz = limite.isoformat()
+    limite_naive = limite.replace(tzinfo=None).isoformat()
+    return [
+        ("central_sessions", "expires_at_utc < ?", (agora_tz,)),
+        ("central_sessions", "revoked = 1", ()),
+        ("localiza_sessions", "expires_at_utc < ?", (agora_tz,)),
+        ("localiza_sessions", "revoked = 1", ()),
+        ("email_tokens", "expires_at < ?", (limite_naive,)),
+        ("live_sessions", "expires_at < ?", (limite_naive,)),
+        (
+            "sos_idempotency",
+            "expires_at < ?",
+            (agora.replace(tzinfo=None).isoformat(),),
+        ),
+        (
+            "watchdog_state",
+            "COALESCE(last_seen_utc, last_alert_utc, '') < ?",
+            (limite_tz,),
+        ),
+    ]
+
+
+def _apagar_em_lotes(
+    conn: sqlite3.Connection,
+    tabela: str,
+    where: str,
+    params: Tuple[Any, ...],
+    lote: int,
+    pausa_s: float,
+) -> int:
+    total = 0
+    sql = (
+        f"DELETE FROM {tabela} WHERE rowid IN "
+        f"(SELECT rowid FROM {tabela} WHERE {where} LIMIT ?)"
+    )
+    while True:
+        cur = conn.execute(sql, params + (lote,))
+        conn.commit()
+        n = cur.rowcount
+        total += n
+        if n < lote:
+            return total
+        if pausa_s > 0:
+            time.sleep(pausa_s)
+
+
+def limpar_expirados(
+    conn: sqlite3.Connection,
+    *,
+    lote: int = LOTE,
+    pausa_s: float = _PAUSA_S,
+    agora: Optional[datetime] = None,
+) -> Dict[str, int]:
+    """
+    Apaga as linhas vencidas de cada tabela (as que não existirem neste
+    banco são puladas). Retorna {tabela: linhas apagadas}.
+    """
+    agora = agora or datetime.now(timezone.utc)
+    existentes = {
+        r[0]
+        for r in conn.execute("SELECT name FROM sqlite_master WHERE type='table'")
+    }
+    relatorio: Dict[str, int] = {}
+    for tabela, where, params in _regras(agora):
+        if tabela not in existentes:
+            continue
+        n = _apagar_em_lotes(conn, tabela, where, params, lote, pausa_s)
+        relatorio[tabela] = relatorio.get(tabela, 0) + n
+        if n:
+            LINHAS_APAGADAS.inc(tabela, n=n)
+    conn.execute("PRAGMA optimize")
+    return relatorio
+
+
+# ----------------------------
+# Thread periódica
+# ----------------------------
+class Manutencao:
+    def __init__(self, connect: Callable[[], sqlite3.Connection]):
+        self._connect = connect
+        self._lock = threading.Lock()
+        self._parar = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.ultima: Optional[Dict[str, Any]] = None
+
+    def iniciar(self) -> None:
+        if INTERVALO_S <= 0:
+            return
+        with self._lock:
+            if self._thread is not None:
+                return
+            th = threading.Thread(target=self._loop, name="manutencao", daemon=True)
+            th.start()
+            self._thread = th
+
+    def parar(self) -> None:
+        self._parar.set()
+
+    def executar(self) -> Dict[str, Any]:
+        """Uma varredura completa; guarda o resultado em `ultima`."""
+        inicio = time.perf_counter()
+        conn = self._connect()
+        try:
+            linhas = limpar_expirados(conn)
+        finally:
+            conn.close()
+        res = {
+            "executado_em": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "duracao_ms": round((time.perf_counter() - inicio) * 1000, 1),
+            "linhas_apagadas": linhas,
+            "total": sum(linhas.values()),
+        }
+        self.ultima = res
+        logger.info(
+            "[MANUT] %s linhas vencidas apagadas em %.0f ms: %s",
+            res["total"],
+            res["duracao_ms"],
+            linhas,
+        )
+        return res
+
+    def _loop(self) -> None:
+        espera = _PRIMEIRA_EXECUCAO_S
+        while not self._parar.wait(espera):
+            try:
+                self.executar()
+            except Exception as e:
+                logger.error("[MANUT] erro na limpeza: %s", e)
+            espera = max(INTERVALO_S, 60)
+
+
+def _main() -> None:
+    import json
+
+    from services.service_assinaturas import DB_PATH
+
+    logging.basicConfig(level=logging.INFO)
+    res = Manutencao(lambda: sqlite3.connect(DB_PATH)).executar()
+    print(json.dumps(res, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    _main()
@@ -0,0 +1,403 @@
+# backend/services/mensagens_sos.py
+# -*- coding: utf-8 -*-
+"""
+mensagens_sos.py
+
+Textos do SOS por canal (e-mail, Telegram, WhatsApp, SMS) a partir de um
+único ContextoSos.
+
+- Os templates ficam em _FONTES, por (locale, versão). compilar() monta os
+  string.Template uma vez (lru_cache) e separa as partes fixas (assunto,
+  cabeçalho, "Localização: não informada"...), que saem como str prontas.
+- O Telegram pode vir de arquivo: templates/tg_sos.<locale>.html ou
+  templates/tg_sos.html (o mesmo arquivo que o anjo_web_main já lia); sem
+  arquivo, usa o template embutido.
+- renderizar(ctx, z) gera todos os canais numa passada e devolve
+  MensagensSos; o api_sos só escolhe qual texto vai para qual envio.
+- verificar(canal, texto) / MensagensSos.verificacoes(): tamanho e
+  codificação por canal (SMS em GSM-7 ou UCS-2, com número de segmentos;
+  limites do Telegram/WhatsApp).
+
+Config (env):
+- SOS_TEMPLATE_LOCALE  locale padrão (padrão pt_BR)
+- SOS_TEMPLATE_VERSION versão padrão dos templates (padrão 1)
+"""
+
+import html as _html
+import logging
+import math
+import os
+from dataclasses import dataclass
+from functools import lru_cache
+from string import Template
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger("anjo_da_guarda")
+
+LOCALE_PADRAO = os.getenv("SOS_TEMPLATE_LOCALE", "pt_BR")
+VERSAO_PADRAO = os.getenv("SOS_TEMPLATE_VERSION", "1")
+
+TEMPLATES_DIR = os.path.normpath(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "templates")
+)
+
+# limite aplicado ao SMS depois do override (o mesmo do api_sos antigo)
+SMS_MAX_CHARS = 700
+
+_FONTES: Dict[Tuple[str, str], Dict[str, str]] = {
+    ("pt_BR", "1"): {
+        "assunto": "SOS - ANJO DA GUARDA",
+        "email_cabecalho": "Alerta de emergência (ANJO DA GUARDA)",
+        "loc_coords": "Localização: lat=$lat lon=$lon$acc",
+        "loc_precisao": " (±${metros}m)",
+        "loc_ausente": "Localização: não informada",
+        "rastreio": "Rastreamento: $url",
+        "telegram": "<b>🚨 SOS - ANJO DA GUARDA</b>\n$TEXT_LINE\n$MAPS_LINE",
+        "wa_usuario": "SOS - $maps",
+        "wa_legado": "🚨 ALERTA de $nome\nSituação: $texto\nLocalização (mapa): $maps",
+        "wa_legado_curto": "🚨 ALERTA de $nome",
+        "wa_legado_mapa": "Localização (mapa): $maps",
+        "nome_ausente": "contato",
+        "sms_simples": "SOS - $conteudo",
+        "sms_titulo": "ALERTA de $nome",
+        "sms_titulo_anonimo": "ALERTA",
+        "sms_situacao": "Situacao: $texto",
+        "sms_situacao_padrao": "SOS pessoal",
+        "sms_mapa": "Localizacao (mapa): $maps",
+        "sms_sem_mapa": "Localizacao: nao informada",
+    },
+}
+
+# troca de pontuação "tipográfica" por ASCII (mantém o SMS em GSM-7)
+_SMS_TROCAS = (
+    ("–", "-"),
+    ("—", "-"),
+    ("…", "..."),
+    ("’", "'"),
+    ("“", '"'),
+    ("”", '"'),
+)
+
+
+class TemplateInexistente(KeyError):
+    """Não há templates para o (locale, versão) pedido."""
+
+
+# ----------------------------
+# Compilação
+# ----------------------------
+@dataclass(frozen=True)
+class Pacote:
+    locale: str
+    versao: str
+    fixos: Dict[str, str]
+    variaveis: Dict[str, Template]
+
+    def texto(self, chave: str, **valores: Any) -> str:
+        if chave in self.fixos:
+            return self.fixos[chave]
+        return self.variaveis[chave].substitute(**valores)
+
+    def texto_livre(self, chave: str, **valores: Any) -> str:
+        """safe_substitute: p/ templates de arquivo, que podem ter $ soltos."""
+        if chave in self.fixos:
+            return self.fixos[chave]
+        return self.variaveis[chave].safe_substitute(**valores)
+
+
+def _telegram_do_arquivo(locale: str) -> Optional[str]:
+    for nome in (f"tg_sos.{locale}.html", "tg_sos.html"):
+        try:
+            with open(os.path.join(TEMPLATES_DIR, nome), "r", encoding="utf-8") as f:
+                return f.read()
+        except FileNotFoundError:
+            continue
+    return None
+
+
+@lru_cache(maxsize=None)
+def compilar(locale: Optional[str] = None, versao: Optional[str] = None) -> Pacote:
+    locale = locale or LOCALE_PADRAO
+    versao = str(versao or VERSAO_PADRAO)
+    try:
+        fontes = dict(_FONTES[(locale, versao)])
+    except KeyError:
+        raise TemplateInexistente(f"sem templates de SOS para {locale} v{versao}") from None
+    arquivo_tg = _telegram_do_arquivo(locale)
+    if arquivo_tg is not None:
+        fontes["telegram"] = arquivo_tg
+
+    fixos: Dict[str, str] = {}
+    variaveis: Dict[str, Template] = {}
+    for chave, fonte in fontes.items():
+        tpl = Template(fonte)
+        if tpl.pattern.search(fonte) is None:
+            fixos[chave] = fonte
+        else:
+            variaveis[chave] = tpl
+    return Pacote(locale, versao, fixos, variaveis)
+
+
+# ----------------------------
+# Contexto e renderização
+# ----------------------------
+@dataclass(frozen=True)
+class ContextoSos:
+    """
+    Dados do SOS já resolvidos pelo api_sos. maps_link vazio = sem
+    coordenadas válidas; nome = payload.nome, nome_tpl = nome do usuário
+    (perfil/template WA), s1 = nome legado do app.
+    """
+
+    text: Optional[str] = None
+    nome: Optional[str] = None
+    s1: Optional[str] = None
+    nome_tpl: Optional[str] = None
+    lat: Optional[float] = None
+    lon: Optional[float] = None
+    acc: Optional[float] = None
+    maps_link: str = ""
+    tracking_url: Optional[str] = None
+
+
+@dataclass(frozen=True)
+class MensagensSos:
+    assunto: str
+    email: str
+    telegram: str
+    botao_url: str
+    wa_usuario: str
+    wa_usuario_campos: Dict[str, str]
+    wa_legado: str
+    wa_legado_curto: str
+    wa_legado_campos: Dict[str, str]
+    sms: str
+    locale: str = LOCALE_PADRAO
+    versao: str = VERSAO_PADRAO
+
+    def verificacoes(self) -> List["Verificacao"]:
+        return [
+            verificar("email", self.email),
+            verificar("telegram", self.telegram),
+            verificar("whatsapp", self.wa_usuario),
+            verificar("whatsapp", self.wa_legado),
+            verificar("sms", self.sms),
+        ]
+
+    def problemas(self) -> List["Verificacao"]:
+        return [v for v in self.verificacoes() if v.excede]
+
+
+def _sanitizar_sms(s: str) -> str:
+    s = s or ""
+    for de, para in _SMS_TROCAS:
+        s = s.replace(de, para)
+    return s
+
+
+def _sms_override(override: str, maps_link: str, texto: str, nome: str) -> str:
+    try:
+        return override.format(
+            maps_link=maps_link,
+            MAPS_LINK=maps_link,
+            text_line=texto,
+            text=texto,
+            TEXT=texto,
+            nome=nome,
+            NOME=nome,
+        )
+    except Exception as e:
+        # chave desconhecida / chaves soltas: troca literal só das conhecidas
+        logger.warning("[SMS] override.format falhou: %s; usando fallback literal", e)
+        return (
+            override.replace("{maps_link}", maps_link)
+            .replace("{MAPS_LINK}", maps_link)
+            .replace("{text}", texto)
+            .replace("{TEXT}", texto)
+            .replace("{nome}", nome)
+            .replace("{NOME}", nome)
+        )
+
+
+def renderizar(
+    ctx: ContextoSos,
+    z: Any,
+    locale: Optional[str] = None,
+    versao: Optional[str] = None,
+) -> MensagensSos:
+    """
+    Todos os canais de uma vez. `z` é o ZenviaConfig do SOS (sms_simple,
+    sms_test, wa_nome), lido uma vez pelo api_sos.
+    """
+    p = compilar(locale, versao)
+    maps = ctx.maps_link or ""
+    url = ctx.tracking_url or ""
+    rastreio = p.texto("rastreio", url=url) if url else ""
+    texto = (ctx.text or "").strip()
+
+    # Localização (e-mail)
+    if maps:
+        acc = (
+            p.texto("loc_precisao", metros=int(ctx.acc))
+            if isinstance(ctx.acc, (int, float))
+            else ""
+        )
+        loc = [
+            p.texto(
+                "loc_coords",
+                lat=f"{float(ctx.lat):.5f}",
+                lon=f"{float(ctx.lon):.5f}",
+                acc=acc,
+            ),
+            maps,
+        ]
+        if rastreio:
+            loc.append(rastreio)
+    else:
+        loc = [p.texto("loc_ausente")]
+
+    email_linhas = [p.texto("email_cabecalho"), ""]
+    if ctx.text:
+        email_linhas += [ctx.text, ""]
+    email = "\n".join(email_linhas + loc)
+
+    # Telegram (HTML)
+    tg_maps = "\n".join(x for x in (maps, rastreio) if x)
+    telegram = p.texto_livre(
+        "telegram",
+        TEXT_LINE=_html.escape(ctx.text) if ctx.text else "",
+        MAPS_LINE=_html.escape(tg_maps),
+    ).strip()
+
+    # WhatsApp
+    def _com_rastreio(s: str) -> str:
+        return f"{s}\n{rastreio}".strip() if rastreio else s
+
+    nome_contato = ctx.nome_tpl or p.texto("nome_ausente")
+    wa_usuario = _com_rastreio(p.texto("wa_usuario", maps=maps).strip())
+    wa_legado = _com_rastreio(
+        p.texto("wa_legado", nome=nome_contato, texto=texto, maps=maps)
+    ).strip()
+    curto = [p.texto("wa_legado_curto", nome=nome_contato)]
+    if maps:
+        curto.append(p.texto("wa_legado_mapa", maps=maps))
+    if rastreio:
+        curto.append(rastreio)
+    wa_legado_curto = "\n".join(curto).strip()
+
+    nome_env = getattr(z, "wa_nome", "") or (ctx.s1 or "").strip()
+    wa_usuario_campos = {"1": ctx.nome_tpl or nome_env or "", "2": maps, "3": url}
+    wa_legado_campos = {"1": ctx.nome_tpl or "", "2": maps, "3": url}
+
+    # SMS (legado)
+    nome_sms = (ctx.nome or getattr(z, "wa_nome", "") or "").strip()
+    if getattr(z, "sms_simple", False):
+        sms = p.texto("sms_simples", conteudo=maps or texto or p.texto("sms_situacao_padrao"))
+        sms = _com_rastreio(sms.strip())
+    else:
+        linhas = [
+            p.texto("sms_titulo", nome=nome_sms) if nome_sms else p.texto("sms_titulo_anonimo"),
+            p.texto("sms_situacao", texto=texto or p.texto("sms_situacao_padrao")),
+            p.texto("sms_mapa", maps=maps) if maps else p.texto("sms_sem_mapa"),
+        ]
+        if rastreio:
+            linhas.append(rastreio)
+        sms = "\n".join(linhas).strip()
+    sms = _sanitizar_sms(sms)
+    override = getattr(z, "sms_test", "")
+    if override:
+        sms = _sms_override(override, maps, texto, nome_sms)
+    sms = _sanitizar_sms(sms.replace("\\n", "\n").replace("\\r\\n", "\n"))[:SMS_MAX_CHARS]
+
+    return MensagensSos(
+        assunto=p.texto("assunto"),
+        email=email,
+        telegram=telegram,
+        botao_url=url or maps,
+        wa_usuario=wa_usuario,
+        wa_usuario_campos=wa_usuario_campos,
+        wa_legado=wa_legado,
+        wa_legado_curto=wa_legado_curto,
+        wa_legado_campos=wa_legado_campos,
+        sms=sms,
+        locale=p.locale,
+        versao=p.versao,
+    )
+
+
+# ----------------------------
+# Tamanho e codificação
+# ----------------------------
+_GSM7_BASICO = frozenset(
+    "@£$¥èéùìòÇ\nØø\rÅåΔ_ΦΓΛΩΠΨΣΘΞÆæßÉ !\"#¤%&'()*+,-./0123456789:;<=>?"
+    "¡ABCDEFGHIJKLMNOPQRSTUVWXYZÄÖÑÜ§¿abcdefghijklmnopqrstuvwxyzäöñüà"
+)
+# tabela de extensão: cada um ocupa 2 septetos (ESC + caractere)
+_GSM7_EXTENSAO = frozenset("^{}\\[~]|€\f")
+
+# limite de caracteres por canal (None = sem limite prático)
+LIMITES: Dict[str, Optional[int]] = {
+    "email": None,
+    "telegram": 4096,
+    "whatsapp": 4096,
+    "sms": SMS_MAX_CHARS,
+}
+
+
+@dataclass(frozen=True)
+class Verificacao:
+    canal: str
+    caracteres: int
+    codificacao: str
+    segmentos: int
+    limite: Optional[int]
+    excede: bool
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "canal": self.canal,
+            "caracteres": self.caracteres,
+            "codificacao": self.codificacao,
+            "segmentos": self.segmentos,
+            "limite": self.limite,
+            "excede": self.excede,
+        }
+
+
+def codificacao_sms(texto: str) -> Tuple[str, int]:
+    """("gsm7" | "ucs2", unidades): septetos no GSM-7, UTF-16 no UCS-2."""
+    unidades = 0
+    for ch in texto:
+        if ch in _GSM7_BASICO:
+            unidades += 1
+        elif ch in _GSM7_EXTENSAO:
+            unidades += 2
+        else:
+            return "ucs2", len(texto.encode("utf-16-le")) // 2
+    return "gsm7", unidades
+
+
+def segmentos_sms(texto: str) -> int:
+    cod, unidades = codificacao_sms(texto)
+    inteiro, parte = (160, 153) if cod == "gsm7" else (70, 67)
+    if unidades <= inteiro:
+        return 1 if unidades else 0
+    return math.ceil(unidades / parte)
+
+
+def verificar(canal: str, texto: str) -> Verificacao:
+    texto = texto or ""
+    limite = LIMITES.get(canal)
+    if canal == "sms":
+        cod, _ = codificacao_sms(texto)
+        segs = segmentos_sms(texto)
+    else:
+        cod, segs = "utf8", 1 if texto else 0
+    return Verificacao(
+        canal=canal,
+        caracteres=len(texto),
+        codificacao=cod,
+        segmentos=segs,
+        limite=limite,
+        excede=limite is not None and len(texto) > limite,
+    )
@@ -0,0 +1,47 @@
+# backend/services/paginacao.py
+# -*- coding: utf-8 -*-
+"""
+paginacao.py
+
+Cursor opaco para paginação por keyset ("seek"): em vez de OFFSET, cada
+página continua a partir da chave da última linha devolvida, usando o
+índice. O cliente só repassa `next_cursor` sem interpretar.
+
+Formato interno: base64url(JSON compacto) sem padding.
+"""
+
+import base64
+import binascii
+import json
+from typing import Any, Dict, Optional
+
+LIMITE_MAX = 1000
+
+
+def codificar_cursor(chave: Dict[str, Any]) -> str:
+    raw = json.dumps(chave, separators=(",", ":"), sort_keys=True).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decodificar_cursor(cursor: Optional[str]) -> Optional[Dict[str, Any]]:
+    """None/"" -> None (primeira página). Cursor inválido -> ValueError."""
+    if not cursor:
+        return None
+    try:
+        pad = "=" * (-len(cursor) % 4)
+        dados = json.loads(base64.urlsafe_b64decode(cursor + pad))
+    except (binascii.Error, ValueError, UnicodeDecodeError):
+        raise ValueError("cursor inválido")
+    if not isinstance(dados, dict):
+        raise ValueError("cursor inválido")
+    return dados
+
+
+def limitar(limit: int, padrao: int = 100) -> int:
+    try:
+        n = int(limit)
+    except Exception:
+        return padrao
+    if n <= 0:
+        return padrao
+    return min(n, LIMITE_MAX)
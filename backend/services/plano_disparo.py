@@ -0,0 +1,175 @@
+# backend/services/plano_disparo.py
+# -*- coding: utf-8 -*-
+"""
+plano_disparo.py
+
+"Plano de disparo" do SOS por usuário: o que o api_sos precisa saber de um
+usuário cadastrado antes do primeiro envio, resolvido numa consulta só e
+guardado em memória.
+
+- users (id, email_verified) + profiles (full_name) + contacts
+  (pending/active) + telegram_contacts (chat_id dos contatos ativos) num
+  único SELECT com LEFT JOIN. Antes eram quatro consultas, cada uma com a
+  sua conexão, no caminho crítico do SOS. O nome vem de subconsulta
+  escalar (o perfil mais antigo): profiles.user_id não é único, e um JOIN
+  com perfil duplicado duplicaria cada contato (SOS em dobro).
+- Cache por e-mail (minúsculo), com TTL de DISPATCH_PLAN_TTL_S segundos
+  (padrão 300; 0 desliga o cache). E-mail sem usuário também fica em cache
+  (plano None), para um app mal configurado não martelar o banco.
+- Quem grava os dados do plano chama invalidar_usuario(uid) (consentimento,
+  perfil, contatos, /start do Telegram) ou invalidar_email(email)
+  (cadastro). Efeito imediato neste processo; em outros workers, vale o TTL.
+"""
+
+import logging
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable, Dict, Optional, Tuple
+
+from services.instrumentacao import counter
+
+logger = logging.getLogger("anjo_da_guarda")
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, str(default)))
+    except Exception:
+        return default
+
+
+TTL_S = _env_float("DISPATCH_PLAN_TTL_S", 300.0)
+_MAX_ENTRADAS = 10000
+
+CONSULTAS = counter(
+    "anjo_dispatch_plan_lookups_total",
+    "Planos de disparo do SOS pedidos, por resultado do cache.",
+    ("result",),
+)
+
+_SQL_PLANO = """
+    SELECT u.id AS user_id, u.email_verified,
+           (SELECT full_name FROM profiles
+             WHERE user_id = u.id ORDER BY id LIMIT 1) AS full_name,
+           c.type, c.value, tc.chat_id
+    FROM users u
+    LEFT JOIN contacts c
+           ON c.user_id = u.id AND c.status IN ('pending', 'active')
+    LEFT JOIN telegram_contacts tc
+           ON tc.contact_id = c.id AND c.type = 'telegram'
+          AND c.status = 'active' AND tc.chat_id IS NOT NULL
+    WHERE u.email = ?
+    ORDER BY c.id
+"""
+
+TIPOS = ("email", "sms", "whatsapp", "telegram")
+
+
+@dataclass(frozen=True)
+class PlanoDisparo:
+    user_id: int
+    nome_perfil: Optional[str]
+    contatos: Dict[str, Tuple[str, ...]]
+    telegram_chat_ids: Tuple[str, ...]
+
+
+def carregar_plano(con: sqlite3.Connection, email: str) -> Optional[PlanoDisparo]:
+    """
+    Plano do usuário com este e-mail; None se não existe ou se o e-mail
+    ainda não foi verificado (o SOS cai no modo legado, como antes).
+    """
+    rows = con.execute(_SQL_PLANO, (email,)).fetchall()
+    if not rows or not rows[0]["email_verified"]:
+        return None
+    contatos: Dict[str, list] = {t: [] for t in TIPOS}
+    chat_ids: list = []
+    for r in rows:
+        tipo = r["type"]
+        if tipo is None:
+            continue
+        contatos.setdefault(tipo, []).append(r["value"])
+        if r["chat_id"] is not None:
+            chat_ids.append(r["chat_id"])
+    nome = (rows[0]["full_name"] or "").strip() or None
+    return PlanoDisparo(
+        user_id=rows[0]["user_id"],
+        nome_perfil=nome,
+        contatos={t: tuple(v) for t, v in contatos.items()},
+        telegram_chat_ids=tuple(chat_ids),
+    )
+
+
+class PlanoCache:
+    def __init__(self, connect: Callable[[], sqlite3.Connection]):
+        self._connect = connect
+        self._lock = threading.Lock()
+        # email -> (plano, válido_até_monotonic)
+        self._planos: Dict[str, Tuple[Optional[PlanoDisparo], float]] = {}
+        # user_id -> email (para invalidar pelo uid)
+        self._emails: Dict[int, str] = {}
+        # incrementado a cada invalidação: carga concorrente não grava velho
+        self._geracao = 0
+
+    def obter(self, email: str) -> Optional[PlanoDisparo]:
+        email = (email or "").strip().lower()
+        if not email:
+            return None
+        if TTL_S > 0:
+            with self._lock:
+                item = self._planos.get(email)
+                if item is not None and time.monotonic() < item[1]:
+                    CONSULTAS.inc("hit")
+                    return item[0]
+                geracao = self._geracao
+        else:
+            geracao = None
+        CONSULTAS.inc("miss")
+
+        con = self._connect()
+        try:
+            plano = carregar_plano(con, email)
+        finally:
+            con.close()
+
+        if geracao is not None:
+            with self._lock:
+                if geracao == self._geracao:
+                    if len(self._planos) >= _MAX_ENTRADAS:
+                        self._planos.clear()
+                        self._emails.clear()
+                    self._planos[email] = (plano, time.monotonic() + TTL_S)
+                    if plano is not None:
+                        self._emails[plano.user_id] = email
+        return plano
+
+    def invalidar_email(self, email: Optional[str]) -> None:
+        email = (email or "").strip().lower()
+        with self._lock:
+            self._geracao += 1
+            item = self._planos.pop(email, None)
+            if item is not None and item[0] is not None:
+                self._emails.pop(item[0].user_id, None)
+
+    def invalidar_usuario(self, user_id: Optional[int]) -> None:
+        with self._lock:
+            self._geracao += 1
+            email = self._emails.pop(user_id, None) if user_id is not None else None
+            if email is not None:
+                self._planos.pop(email, None)
+            elif user_id is not None:
+                # usuário ainda sem plano (e-mail não verificado): o None em
+                # cache é pelo e-mail, que não sabemos aqui; limpa os None
+                for k in [k for k, (p, _) in self._planos.items() if p is None]:
+                    del self._planos[k]
+
+    def limpar(self) -> None:
+        with self._lock:
+            self._geracao += 1
+            self._planos.clear()
+            self._emails.clear()
+
+    def __len__(self) -> int:
+        return len(self._planos)
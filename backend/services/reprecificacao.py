@@ -0,0 +1,301 @@
+# backend/services/reprecificacao.py
+# -*- coding: utf-8 -*-
+"""
+reprecificacao.py
+
+Recalcula desconto e comissão de muitas assinaturas de uma vez quando uma
+regra muda (percentual de comissão, cupom), sem scripts avulsos.
+
+- Lê id, valor, desconto, vendedor e comissão das assinaturas filtradas em
+  colunas (arrays numpy quando disponível; senão listas puras).
+- Aplica as MESMAS regras de services/desconto.py e services/comissao.py:
+  round() half-even do Python (np.rint no numpy, mesma conta em float64),
+  desconto limitado a [0, valor], comissão só com vendedor e base > 0.
+- Mudar o desconto muda a base da comissão (valor - desconto): por isso
+  --desconto-pct/--desconto-fixo exigem --comissao, e a comissão é
+  recalculada sobre a base nova. Sem isso, a comissão gravada ficaria
+  calculada sobre o desconto antigo, fora da regra de comissao.py.
+- Sem `aplicar`, só devolve o diff (quantas mudam, deltas e amostra).
+- Com `aplicar`, grava em transações curtas de `lote` linhas; cada UPDATE
+  confere os valores antigos, então uma linha alterada no meio do caminho
+  é pulada (contada em "ignoradas") em vez de sobrescrita. No fim,
+  comissoes_totais_mensais é reconstruída.
+
+CLI (dry-run por padrão):
+    python -m services.reprecificacao --comissao 6 [--vendedor x@y] [--aplicar]
+    python -m services.reprecificacao --desconto-pct 10 --comissao 6 --plano "Mensal individual"
+"""
+
+import logging
+import sqlite3
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from services.comissao import calcular_comissao_centavos
+from services.comissao_totais import (
+    garantir_tabela,
+    invalidar_relatorio,
+    reconstruir_totais,
+)
+from services.desconto import calcular_desconto_centavos
+
+try:
+    import numpy as np  # type: ignore
+except ImportError:  # pragma: no cover
+    np = None
+
+logger = logging.getLogger("anjo_da_guarda")
+
+_AMOSTRA = 50
+
+
+def _colunas(
+    conn: sqlite3.Connection,
+    vendedor_email: Optional[str],
+    plano: Optional[str],
+    status: Optional[str],
+    de_utc: Optional[str],
+    ate_utc: Optional[str],
+) -> Dict[str, List[Any]]:
+    sql = """
+        SELECT id,
+               valor_mensal_centavos,
+               COALESCE(desconto_centavos, 0),
+               CASE WHEN COALESCE(vendedor_email, '') <> '' THEN 1 ELSE 0 END,
+               COALESCE(comissao_centavos, 0)
+          FROM assinaturas
+         WHERE 1=1
+    """
+    params: List[Any] = []
+    for cond, valor in (
+        ("vendedor_email = ?", vendedor_email),
+        ("plano = ?", plano),
+        ("status = ?", status),
+        ("created_at_utc >= ?", de_utc),
+        ("created_at_utc < ?", ate_utc),
+    ):
+        if valor:
+            sql += f" AND {cond}"
+            params.append(valor)
+    sql += " ORDER BY id"
+
+    cols: Dict[str, List[Any]] = {k: [] for k in ("id", "valor", "desc", "vend", "com")}
+    cur = conn.execute(sql, params)
+    while True:
+        rows = cur.fetchmany(10000)
+        if not rows:
+            return cols
+        for r in rows:
+            cols["id"].append(r[0])
+            cols["valor"].append(int(r[1] or 0))
+            cols["desc"].append(int(r[2]))
+            cols["vend"].append(r[3])
+            cols["com"].append(int(r[4]))
+
+
+def _recalcular_numpy(
+    cols: Dict[str, List[Any]],
+    desconto_percentual: Optional[float],
+    desconto_fixo_centavos: Optional[int],
+    percentual_comissao: Optional[float],
+):
+    valor = np.asarray(cols["valor"], dtype=np.int64)
+    desc = np.asarray(cols["desc"], dtype=np.int64)
+    com = np.asarray(cols["com"], dtype=np.int64)
+    vend = np.asarray(cols["vend"], dtype=bool)
+
+    novo_desc = desc
+    if desconto_fixo_centavos is not None or desconto_percentual is not None:
+        if desconto_fixo_centavos is not None and desconto_fixo_centavos > 0:
+            novo_desc = np.full(valor.shape, int(desconto_fixo_centavos), dtype=np.int64)
+        elif desconto_percentual is not None and desconto_percentual > 0:
+            novo_desc = np.rint(valor * (desconto_percentual / 100.0)).astype(np.int64)
+        else:
+            novo_desc = np.zeros(valor.shape, dtype=np.int64)
+        novo_desc = np.clip(novo_desc, 0, np.maximum(valor, 0))
+        novo_desc = np.where(valor <= 0, 0, novo_desc)
+
+    novo_com = com
+    if percentual_comissao is not None:
+        base = np.maximum(valor - novo_desc, 0)
+        if percentual_comissao > 0:
+            novo_com = np.rint(base * (percentual_comissao / 100.0)).astype(np.int64)
+            novo_com = np.where(vend & (base > 0), np.maximum(novo_com, 0), 0)
+        else:
+            novo_com = np.zeros(valor.shape, dtype=np.int64)
+
+    mudou = np.nonzero((novo_desc != desc) | (novo_com != com))[0]
+    return novo_desc.tolist(), novo_com.tolist(), mudou.tolist()
+
+
+def _recalcular_python(
+    cols: Dict[str, List[Any]],
+    desconto_percentual: Optional[float],
+    desconto_fixo_centavos: Optional[int],
+    percentual_comissao: Optional[float],
+):
+    muda_desc = desconto_fixo_centavos is not None or desconto_percentual is not None
+    novo_desc = [
+        calcular_desconto_centavos(v, desconto_percentual, desconto_fixo_centavos)
+        if muda_desc
+        else d
+        for v, d in zip(cols["valor"], cols["desc"])
+    ]
+    if percentual_comissao is None:
+        novo_com = list(cols["com"])
+    else:
+        novo_com = [
+            calcular_comissao_centavos(max(v - d, 0), percentual_comissao, bool(t))
+            for v, d, t in zip(cols["valor"], novo_desc, cols["vend"])
+        ]
+    mudou = [
+        i
+        for i in range(len(novo_desc))
+        if novo_desc[i] != cols["desc"][i] or novo_com[i] != cols["com"][i]
+    ]
+    return novo_desc, novo_com, mudou
+
+
+def reprecificar_assinaturas(
+    conn: sqlite3.Connection,
+    *,
+    percentual_comissao: Optional[float] = None,
+    desconto_percentual: Optional[float] = None,
+    desconto_fixo_centavos: Optional[int] = None,
+    vendedor_email: Optional[str] = None,
+    plano: Optional[str] = None,
+    status: Optional[str] = None,
+    de_utc: Optional[str] = None,
+    ate_utc: Optional[str] = None,
+    aplicar: bool = False,
+    lote: int = 2000,
+) -> Dict[str, Any]:
+    """
+    Percentuais no formato de desconto.py/comissao.py (5.0 = 5%). Regra
+    omitida (None) mantém o valor atual daquela coluna; desconto novo sem
+    `percentual_comissao` é ValueError (a comissão depende do desconto).
+
+    Retorna {"linhas", "alteradas", "delta_desconto_centavos",
+    "delta_comissao_centavos", "amostra", "aplicado", "gravadas", "ignoradas"}.
+    """
+    muda_desc = desconto_percentual is not None or desconto_fixo_centavos is not None
+    if muda_desc and percentual_comissao is None:
+        raise ValueError("desconto novo exige percentual_comissao (a base da comissão muda)")
+
+    cols = _colunas(conn, vendedor_email, plano, status, de_utc, ate_utc)
+    conn.commit()  # não segura a leitura aberta durante a gravação
+
+    calc = _recalcular_numpy if np is not None else _recalcular_python
+    novo_desc, novo_com, mudou = calc(
+        cols, desconto_percentual, desconto_fixo_centavos, percentual_comissao
+    )
+
+    rel: Dict[str, Any] = {
+        "linhas": len(cols["id"]),
+        "alteradas": len(mudou),
+        "delta_desconto_centavos": sum(novo_desc[i] - cols["desc"][i] for i in mudou),
+        "delta_comissao_centavos": sum(novo_com[i] - cols["com"][i] for i in mudou),
+        "amostra": [
+            {
+                "id": cols["id"][i],
+                "valor_mensal_centavos": cols["valor"][i],
+                "desconto_centavos": [cols["desc"][i], novo_desc[i]],
+                "comissao_centavos": [cols["com"][i], novo_com[i]],
+            }
+            for i in mudou[:_AMOSTRA]
+        ],
+        "aplicado": False,
+        "gravadas": 0,
+        "ignoradas": 0,
+    }
+    if not aplicar or not mudou:
+        return rel
+
+    agora = datetime.utcnow().isoformat(timespec="seconds") + "Z"
+    gravadas = 0
+    for ini in range(0, len(mudou), lote):
+        params = [
+            (
+                novo_desc[i],
+                novo_com[i],
+                agora,
+                cols["id"][i],
+                cols["desc"][i],
+                cols["com"][i],
+            )
+            for i in mudou[ini : ini + lote]
+        ]
+        cur = conn.executemany(
+            """
+            UPDATE assinaturas
+               SET desconto_centavos = ?, comissao_centavos = ?, updated_at_utc = ?
+             WHERE id = ?
+               AND COALESCE(desconto_centavos, 0) = ?
+               AND COALESCE(comissao_centavos, 0) = ?
+            """,
+            params,
+        )
+        conn.commit()
+        gravadas += cur.rowcount
+
+    garantir_tabela(conn)
+    reconstruir_totais(conn)
+    conn.commit()
+    invalidar_relatorio()
+
+    rel.update(aplicado=True, gravadas=gravadas, ignoradas=len(mudou) - gravadas)
+    logger.info(
+        "[REPRECO] %s assinaturas regravadas (%s ignoradas por mudança concorrente)",
+        gravadas,
+        rel["ignoradas"],
+    )
+    return rel
+
+
+def _main() -> None:
+    import argparse
+    import json
+
+    from services.service_assinaturas import DB_PATH
+
+    ap = argparse.ArgumentParser(prog="python -m services.reprecificacao")
+    ap.add_argument("--comissao", type=float, help="percentual de comissão (5 = 5%%)")
+    ap.add_argument("--desconto-pct", type=float, help="desconto percentual (10 = 10%%)")
+    ap.add_argument("--desconto-fixo", type=int, help="desconto fixo em centavos")
+    ap.add_argument("--vendedor", help="só assinaturas deste vendedor")
+    ap.add_argument("--plano", help="só assinaturas deste plano")
+    ap.add_argument("--status", help="só assinaturas com este status")
+    ap.add_argument("--from", dest="de_utc", help="created_at_utc >= (ISO)")
+    ap.add_argument("--to", dest="ate_utc", help="created_at_utc < (ISO)")
+    ap.add_argument("--aplicar", action="store_true", help="grava (sem isso: dry-run)")
+    args = ap.parse_args()
+
+    if args.comissao is None and args.desconto_pct is None and args.desconto_fixo is None:
+        ap.error("informe --comissao, --desconto-pct ou --desconto-fixo")
+    if args.comissao is None:
+        ap.error(
+            "--desconto-pct/--desconto-fixo exigem --comissao: a comissão é "
+            "calculada sobre valor - desconto e precisa ser recalculada junto"
+        )
+
+    con = sqlite3.connect(DB_PATH)
+    try:
+        rel = reprecificar_assinaturas(
+            con,
+            percentual_comissao=args.comissao,
+            desconto_percentual=args.desconto_pct,
+            desconto_fixo_centavos=args.desconto_fixo,
+            vendedor_email=args.vendedor,
+            plano=args.plano,
+            status=args.status,
+            de_utc=args.de_utc,
+            ate_utc=args.ate_utc,
+            aplicar=args.aplicar,
+        )
+    finally:
+        con.close()
+    print(json.dumps(rel, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    _main()
@@ -0,0 +1,206 @@
+# backend/services/send_ledger.py
+# -*- coding: utf-8 -*-
+"""
+send_ledger.py
+
+Ledger de envios do SOS: uma linha por destinatário/canal, com o id da
+mensagem devolvido pelo provedor (Zenvia `id`, Telegram `message_id`).
+
+- gravado logo após o disparo (registrar_envios), com o sos_id
+  (= sos_event_log.id, o mesmo devolvido pelo /api/sos; o id do sos_audit
+  é outro, gerado quando o SOS_PROJECTOR projeta a linha);
+- o status é atualizado pelos DLRs da Zenvia conforme chegam
+  (aplicar_dlrs, chamado pelo worker de services/zenvia_dlr.py);
+- timeline_sos() responde "o SOS #N foi entregue a cada contato?" com
+  buscas indexadas (send_ledger.sos_id e *_dlr.message_id), sem varrer
+  raw_json.
+
+Status: "sent" (aceito pelo provedor), "failed" (recusado/erro) e depois o
+status de DLR mais avançado (ex.: DELIVERED, READ, NOT_DELIVERED). O status
+só anda para frente (_ORDEM_STATUS): DLR fora de ordem (SENT chegando
+depois de DELIVERED) não faz o status voltar.
+"""
+
+import json
+import sqlite3
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+# canal do ledger -> tabela de DLR
+DLR_TABELAS = {"sms": "sms_dlr", "whatsapp": "wa_dlr"}
+
+# posição de cada status na vida da mensagem; desconhecido = _ORDEM_OUTRO.
+# Finais (entregue/não entregue/recusado) não trocam entre si; READ vem
+# depois de DELIVERED.
+_ORDEM_STATUS = {
+    "sent": 0,
+    "failed": 0,
+    "SENT": 1,
+    "DELIVERED": 2,
+    "NOT_DELIVERED": 2,
+    "REJECTED": 2,
+    "READ": 3,
+}
+_ORDEM_OUTRO = 1
+
+
+def _ordem_sql(coluna: str) -> str:
+    casos = " ".join(f"WHEN '{k}' THEN {v}" for k, v in _ORDEM_STATUS.items())
+    return f"(CASE {coluna} {casos} ELSE {_ORDEM_OUTRO} END)"
+
+
+def _now() -> str:
+    return datetime.utcnow().isoformat()
+
+
+def zenvia_message_id(raw: Optional[str]) -> Optional[str]:
+    """Extrai o `id` da resposta JSON da Zenvia (POST /v2/channels/*/messages)."""
+    if not raw:
+        return None
+    try:
+        mid = json.loads(raw).get("id")
+    except Exception:
+        return None
+    return str(mid) if mid else None
+
+
+def _linha(
+    sos_id: int, channel: str, res: Dict[str, Any], agora: str
+) -> Tuple[Any, ...]:
+    recipient = res.get("to") or res.get("chat_id") or ""
+    if isinstance(recipient, (list, tuple)):
+        recipient = ", ".join(str(x) for x in recipient)
+    ok = bool(res.get("ok"))
+    detail = None if ok else (res.get("reason") or res.get("status") or "")
+    mid = res.get("message_id")
+    return (
+        sos_id,
+        channel,
+        str(recipient),
+        str(mid) if mid not in (None, "") else None,
+        "sent" if ok else "failed",
+        None if detail is None else str(detail)[:500],
+        agora,
+        agora,
+    )
+
+
+def registrar_envios(
+    con: sqlite3.Connection,
+    sos_id: int,
+    envios: Iterable[Tuple[str, Dict[str, Any]]],
+) -> int:
+    """
+    Grava (canal, resultado) de cada envio do SOS. Resultados são os dicts
+    já devolvidos pelos send_* (to/chat_id, ok, message_id, reason).
+    """
+    agora = _now()
+    linhas = [_linha(sos_id, channel, res, agora) for channel, res in envios if res]
+    if not linhas:
+        return 0
+    con.executemany(
+        """
+        INSERT INTO send_ledger(
+            sos_id, channel, recipient, provider_message_id,
+            status, detail, sent_at, updated_at
+        )
+        VALUES(?,?,?,?,?,?,?,?)
+        """,
+        linhas,
+    )
+    # DLR que chegou antes do ledger ser gravado (corrida rara): aplica agora
+    for channel, tabela in DLR_TABELAS.items():
+        con.execute(
+            f"""
+            UPDATE send_ledger
+               SET status = (
+                       SELECT d.status FROM {tabela} d
+                        WHERE d.message_id = send_ledger.provider_message_id
+                        ORDER BY {_ordem_sql("d.status")} DESC, d.id DESC LIMIT 1
+                   ),
+                   updated_at = ?
+             WHERE sos_id = ? AND channel = ? AND provider_message_id IS NOT NULL
+               AND EXISTS (
+                   SELECT 1 FROM {tabela} d
+                    WHERE d.message_id = send_ledger.provider_message_id
+               )
+            """,
+            (agora, sos_id, channel),
+        )
+    return len(linhas)
+
+
+def aplicar_dlrs(
+    con: sqlite3.Connection,
+    eventos: Sequence[Tuple[str, str, str, str]],
+) -> None:
+    """
+    eventos: (channel, message_id, status, received_at) em ordem de chegada.
+    Só aplica transições para frente (ver _ORDEM_STATUS).
+    """
+    params = [
+        (status, received_at, channel, message_id, _ORDEM_STATUS.get(status, _ORDEM_OUTRO))
+        for channel, message_id, status, received_at in eventos
+        if message_id and status and status != "PING"
+    ]
+    if not params:
+        return
+    con.executemany(
+        f"""
+        UPDATE send_ledger
+           SET status = ?, updated_at = ?
+         WHERE channel = ? AND provider_message_id = ?
+           AND ? > {_ordem_sql("status")}
+        """,
+        params,
+    )
+
+
+def timeline_sos(con: sqlite3.Connection, sos_id: int) -> List[Dict[str, Any]]:
+    """
+    Um item por destinatário, com os eventos de DLR em ordem de chegada.
+    """
+    rows = con.execute(
+        """
+        SELECT id, channel, recipient, provider_message_id, status, detail,
+               sent_at, updated_at
+          FROM send_ledger
+         WHERE sos_id = ?
+         ORDER BY id
+        """,
+        (sos_id,),
+    ).fetchall()
+
+    itens: List[Dict[str, Any]] = []
+    for r in rows:
+        item = {
+            "channel": r["channel"],
+            "recipient": r["recipient"],
+            "message_id": r["provider_message_id"],
+            "status": r["status"],
+            "detail": r["detail"],
+            "sent_at": r["sent_at"],
+            "updated_at": r["updated_at"],
+            "events": [],
+        }
+        tabela = DLR_TABELAS.get(r["channel"])
+        if tabela and r["provider_message_id"]:
+            item["events"] = [
+                {
+                    "status": d["status"],
+                    "code": d["code"],
+                    "description": d["description"],
+                    "received_at": d["received_at"],
+                }
+                for d in con.execute(
+                    f"""
+                    SELECT status, code, description, received_at
+                      FROM {tabela}
+                     WHERE message_id = ?
+                     ORDER BY received_at, id
+                    """,
+                    (r["provider_message_id"],),
+                ).fetchall()
+            ]
+        itens.append(item)
+    return itens
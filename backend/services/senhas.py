@@ -0,0 +1,162 @@
+# backend/services/senhas.py
+# -*- coding: utf-8 -*-
+"""
+senhas.py
+
+Hash de senha (PBKDF2-SHA256) fora do event loop, com concorrência
+limitada.
+
+Formato gravado em users.pwd_hash (autodescritivo):
+    pbkdf2_sha256$<iteracoes>$<salt b64>$<hash b64>
+O salt também continua em users.pwd_salt (coluna NOT NULL do esquema).
+Hashes antigos (só o hash em base64 em pwd_hash + salt em pwd_salt,
+120000 iterações) continuam sendo aceitos por verificar_senha().
+
+precisa_rehash() diz se o hash está no formato antigo ou com outro número
+de iterações (SENHA_PBKDF2_ITER): no login, verificar_senha_async() já
+devolve o hash novo para gravar.
+
+Executor dedicado:
+- SENHA_HASH_WORKERS   threads de hash (padrão 2). pbkdf2_hmac libera o
+                       GIL, então o resto da API (SOS, tracking) segue
+                       rodando enquanto as senhas são calculadas;
+- SENHA_HASH_QUEUE_MAX pedidos em andamento + na fila (padrão 32). Acima
+                       disso, SenhaOcupada (o endpoint responde 503) em
+                       vez de acumular CPU atrasada.
+"""
+
+import asyncio
+import base64
+import binascii
+import hashlib
+import hmac
+import os
+import secrets
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional, Tuple, TypeVar
+
+T = TypeVar("T")
+
+PREFIXO = "pbkdf2_sha256"
+ITER_LEGADO = 120000
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, str(default)))
+    except Exception:
+        return default
+
+
+ITERACOES = max(10000, _env_int("SENHA_PBKDF2_ITER", 120000))
+_WORKERS = max(1, _env_int("SENHA_HASH_WORKERS", 2))
+_FILA_MAX = max(_WORKERS, _env_int("SENHA_HASH_QUEUE_MAX", 32))
+
+
+class SenhaOcupada(Exception):
+    """Fila de hash cheia: tente de novo em instantes."""
+
+
+def _pbkdf2(pwd: str, salt: bytes, iteracoes: int) -> bytes:
+    return hashlib.pbkdf2_hmac("sha256", pwd.encode("utf-8"), salt, iteracoes)
+
+
+def hash_senha(pwd: str) -> Tuple[str, str]:
+    """(pwd_hash no formato novo, salt b64). Bloqueante: use hash_senha_async."""
+    salt = secrets.token_bytes(16)
+    dk = _pbkdf2(pwd, salt, ITERACOES)
+    salt_b64 = base64.b64encode(salt).decode()
+    return f"{PREFIXO}${ITERACOES}${salt_b64}${base64.b64encode(dk).decode()}", salt_b64
+
+
+def _parse(armazenado: str, salt_legado: Optional[str]) -> Optional[Tuple[int, bytes, bytes]]:
+    try:
+        if armazenado.startswith(PREFIXO + "$"):
+            _, it, salt_b64, dk_b64 = armazenado.split("$", 3)
+            return int(it), base64.b64decode(salt_b64), base64.b64decode(dk_b64)
+        if salt_legado:
+            return ITER_LEGADO, base64.b64decode(salt_legado), base64.b64decode(armazenado)
+    except (ValueError, binascii.Error):
+        return None
+    return None
+
+
+def verificar_senha(pwd: str, armazenado: str, salt_legado: Optional[str] = None) -> bool:
+    """Bloqueante: use verificar_senha_async nos handlers."""
+    partes = _parse(armazenado or "", salt_legado)
+    if partes is None:
+        return False
+    iteracoes, salt, esperado = partes
+    return hmac.compare_digest(_pbkdf2(pwd, salt, iteracoes), esperado)
+
+
+def precisa_rehash(armazenado: str) -> bool:
+    if not (armazenado or "").startswith(PREFIXO + "$"):
+        return True
+    try:
+        return int(armazenado.split("$", 2)[1]) != ITERACOES
+    except (IndexError, ValueError):
+        return True
+
+
+# ----------------------------
+# Executor limitado
+# ----------------------------
+_EXECUTOR = ThreadPoolExecutor(max_workers=_WORKERS, thread_name_prefix="senha-hash")
+_VAGAS = threading.BoundedSemaphore(_FILA_MAX)
+_lock = threading.Lock()
+_em_uso = 0
+
+
+def pendentes() -> int:
+    """Pedidos de hash em andamento ou na fila (métrica)."""
+    return _em_uso
+
+
+def _executar(fn: Callable[..., T], *args) -> T:
+    global _em_uso
+    try:
+        return fn(*args)
+    finally:
+        with _lock:
+            _em_uso -= 1
+        _VAGAS.release()
+
+
+async def _no_executor(fn: Callable[..., T], *args) -> T:
+    global _em_uso
+    if not _VAGAS.acquire(blocking=False):
+        raise SenhaOcupada()
+    with _lock:
+        _em_uso += 1
+    try:
+        fut = _EXECUTOR.submit(_executar, fn, *args)
+    except BaseException:
+        with _lock:
+            _em_uso -= 1
+        _VAGAS.release()
+        raise
+    return await asyncio.wrap_future(fut)
+
+
+async def hash_senha_async(pwd: str) -> Tuple[str, str]:
+    return await _no_executor(hash_senha, pwd)
+
+
+async def verificar_senha_async(
+    pwd: str, armazenado: str, salt_legado: Optional[str] = None
+) -> Tuple[bool, Optional[Tuple[str, str]]]:
+    """
+    (ok, novo_hash). novo_hash = (pwd_hash, pwd_salt) quando a senha confere
+    e o hash gravado está desatualizado; o chamador grava no users.
+    """
+
+    def _verificar() -> Tuple[bool, Optional[Tuple[str, str]]]:
+        if not verificar_senha(pwd, armazenado, salt_legado):
+            return False, None
+        if precisa_rehash(armazenado):
+            return True, hash_senha(pwd)
+        return True, None
+
+    return await _no_executor(_verificar)
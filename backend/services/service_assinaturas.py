@@ -1,7 +1,15 @@
 import os
 import sqlite3
 from datetime import datetime, timedelta
-from typing import Any
+from typing import Any, Iterator
+
+from services.comissao_totais import (
+    acumular_totais,
+    garantir_tabela as garantir_totais_comissao,
+    invalidar_relatorio,
+    totais_vendedor,
+)
+from services.paginacao import codificar_cursor, decodificar_cursor, limitar
 
 # BASE_DIR = pasta "services"
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -32,6 +40,8 @@ def registrar_assinatura_site(
 
     - `desconto_centavos` entra no cálculo da comissão (base = valor - desconto).
     - Se não houver `vendedor_email`, a comissão fica 0.
+    - Com vendedor, soma a venda em comissoes_totais_mensais na mesma
+      transação (services/comissao_totais.py).
     """
 
     os.makedirs(DATA_DIR, exist_ok=True)
@@ -39,6 +49,7 @@ def registrar_assinatura_site(
 
     try:
         conn.execute("PRAGMA foreign_keys = ON;")
+        garantir_totais_comissao(conn)
 
         agora = _utc_now_iso()
         prox_cobranca = (
@@ -99,9 +110,21 @@ def registrar_assinatura_site(
                 comissao_centavos,
             ),
         )
+        novo_id = int(cur.lastrowid)
+
+        acumular_totais(
+            conn,
+            vendedor_email,
+            agora,
+            valor_mensal_centavos,
+            desconto_centavos,
+            comissao_centavos,
+        )
 
         conn.commit()
-        return int(cur.lastrowid)
+        if vendedor_email:
+            invalidar_relatorio(agora[:7])
+        return novo_id
 
     finally:
         conn.close()
@@ -151,14 +174,127 @@ def listar_assinaturas_debug(limit: int = 100) -> list[dict[str, Any]]:
         conn.close()
 
 
+def listar_assinaturas_pagina(
+    limit: int = 100, cursor: str | None = None
+) -> dict[str, Any]:
+    """
+    Uma página de listar_assinaturas_debug (mais novas primeiro), por
+    keyset em `id` (chave primária): a próxima página começa em
+    `id < último id`, sem OFFSET e sem teto fixo de linhas.
+
+    Retorna {"items": [...], "next_cursor": str | None}.
+    Cursor inválido -> ValueError.
+    """
+    n = limitar(limit)
+    chave = decodificar_cursor(cursor)
+
+    sql = """
+        SELECT
+            id,
+            user_email,
+            plano,
+            valor_mensal_centavos,
+            desconto_centavos,
+            vendedor_email,
+            comissao_centavos,
+            status,
+            origem,
+            billing_provider,
+            external_id,
+            data_inicio_utc,
+            data_prox_cobranca_utc,
+            data_cancelamento_utc,
+            created_at_utc,
+            updated_at_utc
+        FROM assinaturas
+    """
+    params: list[Any] = []
+    if chave is not None:
+        if not isinstance(chave.get("i"), int):
+            raise ValueError("cursor inválido")
+        sql += " WHERE id < ?"
+        params.append(chave["i"])
+    sql += " ORDER BY id DESC LIMIT ?"
+    params.append(n + 1)
+
+    os.makedirs(DATA_DIR, exist_ok=True)
+    conn = sqlite3.connect(DB_PATH)
+    conn.row_factory = sqlite3.Row
+    try:
+        rows = conn.execute(sql, params).fetchall()
+    finally:
+        conn.close()
+
+    itens = [dict(r) for r in rows[:n]]
+    proximo = None
+    if len(rows) > n:
+        proximo = codificar_cursor({"i": itens[-1]["id"]})
+    return {"items": itens, "next_cursor": proximo}
+
+
+def iterar_assinaturas(
+    de_utc: str | None = None,
+    ate_utc: str | None = None,
+    chunk: int = 500,
+) -> Iterator[dict[str, Any]]:
+    """
+    Percorre TODAS as assinaturas (mais novas primeiro) em blocos de `chunk`
+    linhas, sem carregar a tabela em memória (export CSV em streaming).
+
+    `de_utc` é inclusivo e `ate_utc` exclusivo (comparados com created_at_utc).
+    """
+    os.makedirs(DATA_DIR, exist_ok=True)
+    conn = sqlite3.connect(DB_PATH)
+    conn.row_factory = sqlite3.Row
+
+    sql = """
+        SELECT
+            id,
+            user_email,
+            plano,
+            valor_mensal_centavos,
+            status,
+            origem,
+            billing_provider,
+            external_id,
+            data_inicio_utc,
+            data_prox_cobranca_utc,
+            data_cancelamento_utc,
+            created_at_utc,
+            updated_at_utc
+        FROM assinaturas
+        WHERE 1=1
+    """
+    params: list[Any] = []
+    if de_utc:
+        sql += " AND created_at_utc >= ?"
+        params.append(de_utc)
+    if ate_utc:
+        sql += " AND created_at_utc < ?"
+        params.append(ate_utc)
+    sql += " ORDER BY id DESC"
+
+    try:
+        cur = conn.execute(sql, params)
+        while True:
+            rows = cur.fetchmany(chunk)
+            if not rows:
+                return
+            for r in rows:
+                yield dict(r)
+    finally:
+        conn.close()
+
+
 def listar_comissoes_por_vendedor(
     vendedor_email: str, limit: int = 500
 ) -> dict[str, Any]:
     """
     Retorna um resumo de comissões para UM vendedor específico.
 
-    - itens: lista de assinaturas dele
+    - itens: lista de assinaturas dele (as `limit` mais recentes)
     - totais: somatórios em centavos (bruto, desconto, líquido, comissão)
+      de todas as assinaturas do vendedor
     """
     os.makedirs(DATA_DIR, exist_ok=True)
     conn = sqlite3.connect(DB_PATH)
@@ -192,30 +328,13 @@ def listar_comissoes_por_vendedor(
         rows = cur.fetchall()
         itens = [dict(r) for r in rows]
 
-        total_bruto = 0
-        total_desc = 0
-        total_liq = 0
-        total_comissao = 0
-
-        for r in itens:
-            bruto = int(r.get("valor_mensal_centavos") or 0)
-            desc = int(r.get("desconto_centavos") or 0)
-            com = int(r.get("comissao_centavos") or 0)
-            liq = max(bruto - desc, 0)
-
-            total_bruto += bruto
-            total_desc += desc
-            total_liq += liq
-            total_comissao += com
+        # totais de TODO o histórico (não só dos `limit` itens), pela
+        # tabela mensal: custo proporcional ao nº de meses, não de vendas
+        resumo = totais_vendedor(conn, vendedor_email)
 
         return {
             "vendedor_email": vendedor_email,
-            "totais": {
-                "valor_bruto_centavos": total_bruto,
-                "desconto_centavos": total_desc,
-                "valor_liquido_centavos": total_liq,
-                "comissao_centavos": total_comissao,
-            },
+            "totais": resumo["totais"],
             "itens": itens,
         }
     finally:
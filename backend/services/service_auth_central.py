@@ -3,47 +3,21 @@ import sqlite3
 import secrets
 import hashlib
 from datetime import datetime, timezone, timedelta
-from typing import Dict, Optional
+from typing import Mapping, Optional
 
 from fastapi import Depends, HTTPException, Request, status
 from fastapi.security import HTTPBasic, HTTPBasicCredentials
 
+from services.audit_sink import AuditSink
+from services.config import carregar_env_arquivos as _load_env_from_file
+from services.config import ao_recarregar, settings
+from services.sessao_assinada import SessaoAssinada, chaves_de_env, eh_token_assinado
+from services.sessao_cache import SessaoCache
+
 # auto_error=False para auditar tentativa sem credenciais
 security = HTTPBasic(auto_error=False)
 
 
-def _load_env_from_file() -> None:
-    """
-    Carrega backend/.env e raiz/.env (se existirem), sem depender de systemd.
-    """
-    here = os.path.dirname(os.path.abspath(__file__))          # backend/services
-    backend_dir = os.path.normpath(os.path.join(here, ".."))   # backend
-    root_dir = os.path.normpath(os.path.join(backend_dir, ".."))
-
-    candidates = [
-        os.path.join(backend_dir, ".env"),
-        os.path.join(root_dir, ".env"),
-    ]
-
-    for path in candidates:
-        if not os.path.exists(path):
-            continue
-        try:
-            with open(path, "r", encoding="utf-8") as f:
-                for line in f:
-                    line = line.strip()
-                    if not line or line.startswith("#") or "=" not in line:
-                        continue
-                    k, v = line.split("=", 1)
-                    k = k.strip()
-                    v = v.strip().strip('"').strip("'")
-                    if k and k not in os.environ:
-                        os.environ[k] = v
-        except Exception:
-            # nunca derruba
-            pass
-
-
 def _root_dir() -> str:
     here = os.path.dirname(os.path.abspath(__file__))          # backend/services
     backend_dir = os.path.normpath(os.path.join(here, ".."))   # backend
@@ -76,69 +50,46 @@ def _ensure_audit_table(conn: sqlite3.Connection) -> None:
     conn.commit()
 
 
+# Fila + gravação em lote (ver services/audit_sink.py)
+_AUDIT = AuditSink("central_access_audit", lambda: sqlite3.connect(_db_path()), _ensure_audit_table)
+
+
 def _audit(username: str, ip: str, path: str, ok: bool, reason: str, user_agent: str) -> None:
-    _load_env_from_file()
-    if os.getenv("CENTRAL_AUDIT", "0").strip().lower() not in ("1", "true", "yes", "on"):
+    if not settings().central.audit:
         return
 
     try:
-        conn = sqlite3.connect(_db_path())
-        try:
-            _ensure_audit_table(conn)
-            conn.execute(
-                """
-                INSERT INTO central_access_audit(ts_utc, username, ip, path, ok, reason, user_agent)
-                VALUES(?,?,?,?,?,?,?)
-                """,
-                (
-                    datetime.now(timezone.utc).isoformat(),
-                    username or "",
-                    ip or "",
-                    path or "",
-                    1 if ok else 0,
-                    reason or "",
-                    (user_agent or "")[:300],
-                ),
+        _AUDIT.registrar(
+            (
+                datetime.now(timezone.utc).isoformat(),
+                username or "",
+                ip or "",
+                path or "",
+                1 if ok else 0,
+                reason or "",
+                (user_agent or "")[:300],
             )
-            conn.commit()
-        finally:
-            conn.close()
+        )
     except Exception:
         # auditoria nunca derruba o sistema
         pass
 
 
+def audit_pendentes() -> int:
+    """Registros de auditoria aguardando gravação (métrica de fila)."""
+    return _AUDIT.pendentes()
+
+
 # =========================================================
 # USERS (CENTRAL_USERS)
 # =========================================================
 
-def _parse_central_users() -> Dict[str, str]:
+def _parse_central_users() -> Mapping[str, str]:
     """
     CENTRAL_USERS=adm@x.com:senha1;contato@y.com:senha2
     Também aceita fallback CENTRAL_USER/CENTRAL_PASS.
     """
-    _load_env_from_file()
-    users: Dict[str, str] = {}
-
-    raw = os.getenv("CENTRAL_USERS", "").strip()
-    if raw:
-        for item in raw.split(";"):
-            item = item.strip()
-            if not item or ":" not in item:
-                continue
-            u, p = item.split(":", 1)
-            u = u.strip()
-            p = p.strip()
-            if u and p:
-                users[u] = p
-
-    # fallback (caso exista)
-    u1 = os.getenv("CENTRAL_USER", "").strip()
-    p1 = os.getenv("CENTRAL_PASS", "").strip()
-    if u1 and p1 and u1 not in users:
-        users[u1] = p1
-
-    return users
+    return settings().central.users
 
 
 def central_validate_credentials(username: str, password: str) -> bool:
@@ -211,9 +162,7 @@ def require_central_auth(
 # =========================================================
 
 def _cookie_name() -> str:
-    _load_env_from_file()
-    v = (os.getenv("CENTRAL_COOKIE_NAME") or "central_session").strip()
-    return v or "central_session"
+    return settings().central.cookie_name
 
 
 # Compatibilidade com imports antigos (ex.: anjo_web_main.py)
@@ -221,18 +170,11 @@ CENTRAL_COOKIE_NAME = _cookie_name()
 
 
 def _session_ttl_min() -> int:
-    _load_env_from_file()
-    raw = (os.getenv("CENTRAL_SESSION_TTL_MIN") or "60").strip()
-    try:
-        return max(5, int(raw))
-    except Exception:
-        return 60
+    return settings().central.session_ttl_min
 
 
 def _cookie_secure_flag() -> bool:
-    _load_env_from_file()
-    raw = (os.getenv("CENTRAL_COOKIE_SECURE", "1") or "1").strip().lower()
-    return raw in ("1", "true", "yes", "on")
+    return settings().central.cookie_secure
 
 
 def _session_secret() -> str:
@@ -240,8 +182,7 @@ def _session_secret() -> str:
     Secret para hashear o token antes de salvar no DB.
     NÃO salva token puro no DB.
     """
-    _load_env_from_file()
-    secret = (os.getenv("CENTRAL_SESSION_SECRET") or "").strip()
+    secret = settings().central.session_secret
     if not secret or len(secret) < 16:
         raise HTTPException(
             status_code=500,
@@ -275,47 +216,40 @@ def _ensure_sessions_table(conn: sqlite3.Connection) -> None:
     conn.commit()
 
 
+# Cookies antigos (sessão no DB): cache + last_seen agrupado
+# (ver services/sessao_cache.py)
+_SESSOES = SessaoCache("central_sessions", lambda: sqlite3.connect(_db_path()))
+
+
+def _chaves_sessao():
+    _load_env_from_file()
+    return chaves_de_env("CENTRAL_SESSION_SECRET")
+
+
+# Token assinado, validado sem banco (ver services/sessao_assinada.py).
+# Cookies antigos (token opaco + central_sessions) seguem válidos até expirar.
+_MOTOR = SessaoAssinada("central", _chaves_sessao)
+ao_recarregar(lambda _s: _MOTOR.recarregar_chaves())
+
+
 def create_central_session(username: str, ip: str, user_agent: str) -> str:
     """
-    Cria sessão no DB e devolve o TOKEN (vai no cookie HttpOnly).
+    Emite o TOKEN assinado (vai no cookie HttpOnly). Não grava no DB.
     """
-    token = secrets.token_urlsafe(32)
-    token_hash = _hash_session_token(token)
-
-    now = datetime.now(timezone.utc)
-    exp = now + timedelta(minutes=_session_ttl_min())
-
-    conn = sqlite3.connect(_db_path())
-    try:
-        _ensure_sessions_table(conn)
-        conn.execute(
-            """
-            INSERT INTO central_sessions(
-              token_hash, username, created_at_utc, expires_at_utc,
-              last_seen_utc, ip, user_agent, revoked
-            )
-            VALUES(?,?,?,?,?,?,?,0)
-            """,
-            (
-                token_hash,
-                (username or "").strip(),
-                now.isoformat(),
-                exp.isoformat(),
-                now.isoformat(),
-                (ip or "")[:80],
-                (user_agent or "")[:300],
-            ),
+    if not _MOTOR.configurado():
+        raise HTTPException(
+            status_code=500,
+            detail="CENTRAL_SESSION_SECRET não configurado (ou muito curto)."
         )
-        conn.commit()
-    finally:
-        conn.close()
-
-    return token
+    return _MOTOR.emitir((username or "").strip(), _session_ttl_min() * 60)
 
 
 def revoke_central_session(token: str) -> None:
     if not token:
         return
+    if eh_token_assinado(token):
+        _MOTOR.revogar(token)
+        return
     token_hash = _hash_session_token(token)
     conn = sqlite3.connect(_db_path())
     try:
@@ -324,6 +258,7 @@ def revoke_central_session(token: str) -> None:
         conn.commit()
     finally:
         conn.close()
+    _SESSOES.invalidar(token_hash)
 
 
 def validate_central_session(token: str, request: Optional[Request] = None) -> str:
@@ -333,8 +268,6 @@ def validate_central_session(token: str, request: Optional[Request] = None) -> s
     if not token:
         _raise_unauthorized_session()
 
-    token_hash = _hash_session_token(token)
-
     ip = ""
     path = ""
     ua = ""
@@ -343,6 +276,25 @@ def validate_central_session(token: str, request: Optional[Request] = None) -> s
         path = request.url.path
         ua = request.headers.get("user-agent", "") or ""
 
+    if eh_token_assinado(token):
+        dados = _MOTOR.validar(token)
+        if dados is None:
+            _audit("", ip, path, False, "SESSION_INVALID", ua)
+            _raise_unauthorized_session()
+        if request is not None:
+            _audit(str(dados["sub"]), ip, path, True, "SESSION_OK", ua)
+        return str(dados["sub"])
+
+    # cookie antigo (sessão no DB), emitido antes do token assinado
+    token_hash = _hash_session_token(token)
+
+    username = _SESSOES.get(token_hash)
+    if username is not None:
+        if request is not None:
+            _SESSOES.tocar(token_hash, datetime.now(timezone.utc).isoformat(), ip, ua)
+            _audit(username, ip, path, True, "SESSION_OK", ua)
+        return username
+
     conn = sqlite3.connect(_db_path())
     conn.row_factory = sqlite3.Row
     try:
@@ -370,18 +322,17 @@ def validate_central_session(token: str, request: Optional[Request] = None) -> s
         if not exp or now > exp:
             conn.execute("UPDATE central_sessions SET revoked=1 WHERE token_hash=?", (token_hash,))
             conn.commit()
+            _SESSOES.invalidar(token_hash)
             _audit(str(row["username"]), ip, path, False, "SESSION_EXPIRED", ua)
             _raise_unauthorized_session()
 
         # ok -> atualiza last_seen se tiver request
         if request is not None:
-            conn.execute(
-                "UPDATE central_sessions SET last_seen_utc=?, ip=?, user_agent=? WHERE token_hash=?",
-                (now.isoformat(), (ip or "")[:80], (ua or "")[:300], token_hash),
-            )
-            conn.commit()
+            # gravado em lote pelo _SESSOES (sem transação por request)
+            _SESSOES.tocar(token_hash, now.isoformat(), ip, ua)
             _audit(str(row["username"]), ip, path, True, "SESSION_OK", ua)
 
+        _SESSOES.put(token_hash, str(row["username"]), exp)
         return str(row["username"])
     finally:
         conn.close()
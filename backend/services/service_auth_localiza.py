@@ -3,47 +3,19 @@ import sqlite3
 import secrets
 import hashlib
 from datetime import datetime, timezone, timedelta
-from typing import Dict, Optional
+from typing import Mapping, Optional
 
 from fastapi import Depends, HTTPException, Request, status
 from fastapi.security import HTTPBasic, HTTPBasicCredentials
 
+from services.audit_sink import AuditSink
+from services.config import settings
+from services.sessao_cache import SessaoCache
+
 # auto_error=False para auditar tentativa sem credenciais
 security = HTTPBasic(auto_error=False)
 
 
-def _load_env_from_file() -> None:
-    """
-    Carrega backend/.env e raiz/.env (se existirem), sem depender de systemd.
-    """
-    here = os.path.dirname(os.path.abspath(__file__))          # backend/services
-    backend_dir = os.path.normpath(os.path.join(here, ".."))   # backend
-    root_dir = os.path.normpath(os.path.join(backend_dir, ".."))
-
-    candidates = [
-        os.path.join(backend_dir, ".env"),
-        os.path.join(root_dir, ".env"),
-    ]
-
-    for path in candidates:
-        if not os.path.exists(path):
-            continue
-        try:
-            with open(path, "r", encoding="utf-8") as f:
-                for line in f:
-                    line = line.strip()
-                    if not line or line.startswith("#") or "=" not in line:
-                        continue
-                    k, v = line.split("=", 1)
-                    k = k.strip()
-                    v = v.strip().strip('"').strip("'")
-                    if k and k not in os.environ:
-                        os.environ[k] = v
-        except Exception:
-            # nunca derruba
-            pass
-
-
 def _root_dir() -> str:
     here = os.path.dirname(os.path.abspath(__file__))          # backend/services
     backend_dir = os.path.normpath(os.path.join(here, ".."))   # backend
@@ -76,33 +48,26 @@ def _ensure_audit_table(conn: sqlite3.Connection) -> None:
     conn.commit()
 
 
+# Fila + gravação em lote (ver services/audit_sink.py)
+_AUDIT = AuditSink("localiza_access_audit", lambda: sqlite3.connect(_db_path()), _ensure_audit_table)
+
+
 def _audit(username: str, ip: str, path: str, ok: bool, reason: str, user_agent: str) -> None:
-    _load_env_from_file()
-    if os.getenv("LOCALIZA_AUDIT", "1").strip().lower() not in ("1", "true", "yes", "on"):
+    if not settings().localiza.audit:
         return
 
     try:
-        conn = sqlite3.connect(_db_path())
-        try:
-            _ensure_audit_table(conn)
-            conn.execute(
-                """
-                INSERT INTO localiza_access_audit(ts_utc, username, ip, path, ok, reason, user_agent)
-                VALUES(?,?,?,?,?,?,?)
-                """,
-                (
-                    datetime.now(timezone.utc).isoformat(),
-                    username or "",
-                    ip or "",
-                    path or "",
-                    1 if ok else 0,
-                    reason or "",
-                    (user_agent or "")[:300],
-                ),
+        _AUDIT.registrar(
+            (
+                datetime.now(timezone.utc).isoformat(),
+                username or "",
+                ip or "",
+                path or "",
+                1 if ok else 0,
+                reason or "",
+                (user_agent or "")[:300],
             )
-            conn.commit()
-        finally:
-            conn.close()
+        )
     except Exception:
         # auditoria nunca derruba
         pass
@@ -112,32 +77,12 @@ def _audit(username: str, ip: str, path: str, ok: bool, reason: str, user_agent:
 # USERS (LOCALIZA_USERS)
 # =========================================================
 
-def _parse_localiza_users() -> Dict[str, str]:
+def _parse_localiza_users() -> Mapping[str, str]:
     """
     LOCALIZA_USERS=adm@x.com:senha1;contato@y.com:senha2
     Também aceita fallback LOCALIZA_USER/LOCALIZA_PASS.
     """
-    _load_env_from_file()
-    users: Dict[str, str] = {}
-
-    raw = os.getenv("LOCALIZA_USERS", "").strip()
-    if raw:
-        for item in raw.split(";"):
-            item = item.strip()
-            if not item or ":" not in item:
-                continue
-            u, p = item.split(":", 1)
-            u = u.strip()
-            p = p.strip()
-            if u and p:
-                users[u] = p
-
-    u1 = os.getenv("LOCALIZA_USER", "").strip()
-    p1 = os.getenv("LOCALIZA_PASS", "").strip()
-    if u1 and p1 and u1 not in users:
-        users[u1] = p1
-
-    return users
+    return settings().localiza.users
 
 
 def localiza_validate_credentials(username: str, password: str) -> bool:
@@ -208,24 +153,15 @@ def require_localiza_basic(
 # =========================================================
 
 def _cookie_name() -> str:
-    _load_env_from_file()
-    v = (os.getenv("LOCALIZA_COOKIE_NAME") or "localiza_session").strip()
-    return v or "localiza_session"
+    return settings().localiza.cookie_name
 
 
 def _session_ttl_min() -> int:
-    _load_env_from_file()
-    raw = (os.getenv("LOCALIZA_SESSION_TTL_MIN") or "60").strip()
-    try:
-        return max(5, int(raw))
-    except Exception:
-        return 60
+    return settings().localiza.session_ttl_min
 
 
 def _cookie_secure_flag() -> bool:
-    _load_env_from_file()
-    raw = (os.getenv("LOCALIZA_COOKIE_SECURE", "1") or "1").strip().lower()
-    return raw in ("1", "true", "yes", "on")
+    return settings().localiza.cookie_secure
 
 
 def _session_secret() -> str:
@@ -233,8 +169,7 @@ def _session_secret() -> str:
     Secret para hashear o token antes de salvar no DB.
     NÃO é login/senha.
     """
-    _load_env_from_file()
-    secret = (os.getenv("LOCALIZA_SESSION_SECRET") or "").strip()
+    secret = settings().localiza.session_secret
     if not secret or len(secret) < 16:
         raise HTTPException(
             status_code=500,
@@ -268,6 +203,10 @@ def _ensure_sessions_table(conn: sqlite3.Connection) -> None:
     conn.commit()
 
 
+# Sessões já validadas + last_seen agrupado (ver services/sessao_cache.py)
+_SESSOES = SessaoCache("localiza_sessions", lambda: sqlite3.connect(_db_path()))
+
+
 def create_localiza_session(username: str, ip: str, user_agent: str) -> str:
     token = secrets.token_urlsafe(32)
     token_hash = _hash_session_token(token)
@@ -314,6 +253,7 @@ def revoke_localiza_session(token: str) -> None:
         conn.commit()
     finally:
         conn.close()
+    _SESSOES.invalidar(token_hash)
 
 
 def validate_localiza_session(token: str, request: Optional[Request] = None) -> str:
@@ -330,6 +270,13 @@ def validate_localiza_session(token: str, request: Optional[Request] = None) ->
         path = request.url.path
         ua = request.headers.get("user-agent", "") or ""
 
+    username = _SESSOES.get(token_hash)
+    if username is not None:
+        if request is not None:
+            _SESSOES.tocar(token_hash, datetime.now(timezone.utc).isoformat(), ip, ua)
+            _audit(username, ip, path, True, "SESSION_OK", ua)
+        return username
+
     conn = sqlite3.connect(_db_path())
     conn.row_factory = sqlite3.Row
     try:
@@ -357,17 +304,16 @@ def validate_localiza_session(token: str, request: Optional[Request] = None) ->
         if not exp or now > exp:
             conn.execute("UPDATE localiza_sessions SET revoked=1 WHERE token_hash=?", (token_hash,))
             conn.commit()
+            _SESSOES.invalidar(token_hash)
             _audit(str(row["username"]), ip, path, False, "SESSION_EXPIRED", ua)
             _raise_unauthorized_session()
 
         if request is not None:
-            conn.execute(
-                "UPDATE localiza_sessions SET last_seen_utc=?, ip=?, user_agent=? WHERE token_hash=?",
-                (now.isoformat(), (ip or "")[:80], (ua or "")[:300], token_hash),
-            )
-            conn.commit()
+            # gravado em lote pelo _SESSOES (sem transação por request)
+            _SESSOES.tocar(token_hash, now.isoformat(), ip, ua)
             _audit(str(row["username"]), ip, path, True, "SESSION_OK", ua)
 
+        _SESSOES.put(token_hash, str(row["username"]), exp)
         return str(row["username"])
     finally:
         conn.close()
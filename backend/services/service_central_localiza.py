@@ -13,9 +13,13 @@ from typing import Optional, Dict
 from fastapi import Request
 from fastapi.responses import HTMLResponse, RedirectResponse, Response
 
+from services.config import ao_recarregar
+from services.sessao_assinada import SessaoAssinada, chaves_de_env, eh_token_assinado
+
 logger = logging.getLogger("anjo_da_guarda")
 
 COOKIE_NAME = "localiza_session"
+SESSION_TTL_S = 8 * 60 * 60
 
 
 # ----------------------------
@@ -76,11 +80,24 @@ def _is_https(request: Request) -> bool:
     return (proto or "").lower() == "https"
 
 
+# Mesmo motor de sessão da Central (services/sessao_assinada.py), com
+# aud="localiza". _make_cookie/_read_cookie ficam só para cookies antigos.
+_MOTOR = SessaoAssinada(
+    "localiza",
+    lambda: chaves_de_env("CENTRAL_LOCALIZA_SESSION_SECRET", aceitar_curto=True),
+)
+ao_recarregar(lambda _s: _MOTOR.recarregar_chaves())
+
+
 def _get_session_email(request: Request) -> Optional[str]:
+    valor = request.cookies.get(COOKIE_NAME, "")
+    if eh_token_assinado(valor):
+        dados = _MOTOR.validar(valor)
+        return str(dados["sub"]) if dados else None
     secret = _env("CENTRAL_LOCALIZA_SESSION_SECRET")
     if not secret:
         return None
-    return _read_cookie(request.cookies.get(COOKIE_NAME, ""), secret)
+    return _read_cookie(valor, secret)
 
 def _parse_supervisors() -> Dict[str, str]:
     raw = _env("CENTRAL_LOCALIZA_SUPERVISORS", "")
@@ -1033,9 +1050,8 @@ async def central_localiza_login(request: Request) -> Response:
 
     # valida config (sem mostrar os nomes das vars na tela)
     allowed = _parse_supervisors()
-    env_secret = _env("CENTRAL_LOCALIZA_SESSION_SECRET")
 
-    if not allowed or not env_secret:
+    if not allowed or not _MOTOR.configurado():
         logger.error("[LOCALIZA] .env incompleto: CENTRAL_LOCALIZA_SUPERVISORS ou CENTRAL_LOCALIZA_SESSION_SECRET ausente")
         return HTMLResponse(
             _login_html(
@@ -1073,7 +1089,7 @@ async def central_localiza_login(request: Request) -> Response:
 
 
     # OK: cria sessão
-    cookie_val = _make_cookie(email=email, secret=env_secret)
+    cookie_val = _MOTOR.emitir(email, SESSION_TTL_S)
     https = _is_https(request)
 
     logger.info("[LOCALIZA] login OK email=%s ip=%s", email, (request.client.host if request.client else ""))
@@ -1087,7 +1103,7 @@ async def central_localiza_login(request: Request) -> Response:
         httponly=True,
         secure=https,  # em local (http) fica False, em produção (https) fica True
         samesite="lax",
-        max_age=8 * 60 * 60,
+        max_age=SESSION_TTL_S,
         path="/",
     )
     return resp
@@ -1098,6 +1114,8 @@ async def central_localiza_logout(request: Request) -> Response:
     path = request.url.path or ""
     target = "/central/login" if path == "/central/logout" else "/central/localiza"
 
+    _MOTOR.revogar(request.cookies.get(COOKIE_NAME, ""))
+
     resp = RedirectResponse(url=target, status_code=303)
     resp.delete_cookie(COOKIE_NAME, path="/")
     return resp
@@ -1112,6 +1130,7 @@ async def central_localiza_forgot(request: Request) -> HTMLResponse:
 
 async def central_localiza_exit(request: Request) -> Response:
     # Sai do Localiza indo pra Central, limpando cookie (exige senha ao voltar)
+    _MOTOR.revogar(request.cookies.get(COOKIE_NAME, ""))
     resp = RedirectResponse(url="/central", status_code=303)
     resp.delete_cookie(COOKIE_NAME, path="/")
     return resp
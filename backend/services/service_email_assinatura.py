@@ -1,44 +1,11 @@
-import os
 import smtplib
 from email.message import EmailMessage
-from pathlib import Path
 from typing import Optional
 
-
-def _load_env_from_file() -> None:
-    """
-    Carrega variáveis do .env para o os.environ
-    para funcionar mesmo quando rodar via:
-      python -m services.service_email_assinatura
-    """
-    # pasta raiz do projeto: C:\dev\anjo_da_guarda_app
-    root_dir = Path(__file__).resolve().parents[2]
-
-    # Preferência: primeiro backend/.env, depois .env na raiz (se existir)
-    candidates = [
-        root_dir / "backend" / ".env",
-        root_dir / ".env",
-    ]
-
-    for path in candidates:
-        if path.exists():
-            try:
-                with open(path, "r", encoding="utf-8") as f:
-                    for line in f:
-                        line = line.strip()
-                        if not line or line.startswith("#"):
-                            continue
-                        if "=" not in line:
-                            continue
-                        k, v = line.split("=", 1)
-                        k = k.strip()
-                        v = v.strip()
-                        if k and k not in os.environ:
-                            os.environ[k] = v
-                print(f"[ASSINATURAS] .env carregado de {path}")
-            except Exception as e:
-                print(f"[ASSINATURAS] Erro ao ler {path}: {e}")
-            break
+# Leitor único do .env (funciona também via
+# python -m services.service_email_assinatura)
+from services.config import carregar_env_arquivos as _load_env_from_file
+from services.config import settings
 
 
 # Carrega o .env logo na importação
@@ -55,12 +22,13 @@ def enviar_email_boas_vindas_assinatura(
     Usa as variáveis SMTP_ já configuradas no .env.
     """
 
-    host = os.getenv("SMTP_HOST")
-    port = int(os.getenv("SMTP_PORT", "465"))
-    user = os.getenv("SMTP_USER")
-    password = os.getenv("SMTP_PASS")
-    from_addr = os.getenv("SMTP_FROM")
-    from_name = os.getenv("SMTP_FROM_NAME", "3G Brasil / Assinaturas Anjo da Guarda")
+    smtp = settings().smtp
+    host = smtp.host
+    port = smtp.port
+    user = smtp.user
+    password = smtp.password
+    from_addr = smtp.from_addr
+    from_name = smtp.from_name
 
     if not all([host, port, user, password, from_addr]):
         print(
@@ -70,20 +38,14 @@ def enviar_email_boas_vindas_assinatura(
         return
 
     # Link padrão da página pública
-    link_download = os.getenv(
-        "ANJO_DOWNLOAD_URL",
-        "https://www.3g-brasil.com/anjo-da-guarda",
-    )
+    link_download = smtp.link_download
 
     # Se vier um checkout_url (Mercado Pago), usamos ele;
     # senão, caímos no link público padrão.
     link_principal = checkout_url or link_download
 
     # URL da imagem do QR Code (você depois sobe essa imagem no seu site)
-    url_qrcode = os.getenv(
-        "ANJO_QRCODE_URL",
-        "https://www.3g-brasil.com/assets/qrcode-anjo-android.png",
-    )
+    url_qrcode = smtp.url_qrcode
 
     assunto = f"Bem-vindo ao Anjo da Guarda — plano {plano}"
 
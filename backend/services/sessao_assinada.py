@@ -0,0 +1,282 @@
+# backend/services/sessao_assinada.py
+# -*- coding: utf-8 -*-
+"""
+sessao_assinada.py
+
+Sessão por cookie assinada (HMAC-SHA256), validada sem acesso ao banco.
+Um motor só para a Central (/central) e a Central Localiza.
+
+Token: v1.<kid>.<payload>.<assinatura>
+- payload = base64url(JSON {"sub", "aud", "iat", "exp", "jti"})
+- aud separa Central ("central") de Localiza ("localiza"): um cookie de
+  um não vale no outro mesmo com a mesma chave.
+
+Chaves (rotação):
+    CENTRAL_SESSION_KEYS=2026b:segredo_novo,2026a:segredo_antigo
+A primeira assina; todas validam. Para rotacionar: coloque a nova na
+frente, mantenha a antiga até o maior TTL passar e depois remova.
+Sem CENTRAL_SESSION_KEYS, cada motor usa o segredo que já existia
+(CENTRAL_SESSION_SECRET / CENTRAL_LOCALIZA_SESSION_SECRET) como kid "0".
+
+Revogação (logout): o jti vai para a tabela session_denylist (com o exp do
+token, para poder ser apagado depois) e para um set em memória. Cada
+processo recarrega o set do banco a cada SESSION_DENYLIST_REFRESH_S
+segundos (padrão 5), então um logout vale em todos os workers nesse prazo,
+sem estado compartilhado além do banco.
+"""
+
+import base64
+import binascii
+import hashlib
+import hmac
+import json
+import logging
+import os
+import secrets
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger("anjo_da_guarda")
+
+# Mesmo banco dos outros serviços (service_assinaturas, vendedor_comissao)
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DATA_DIR = os.path.normpath(os.path.join(BASE_DIR, "..", "..", "data"))
+DB_PATH = os.path.join(DATA_DIR, "anjo.db")
+
+PREFIXO = "v1."
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, str(default)))
+    except Exception:
+        return default
+
+
+def _b64u(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).decode("ascii").rstrip("=")
+
+
+def _b64u_decode(s: str) -> bytes:
+    pad = "=" * (-len(s) % 4)
+    return base64.urlsafe_b64decode(s + pad)
+
+
+def eh_token_assinado(token: Optional[str]) -> bool:
+    return bool(token) and token.startswith(PREFIXO)
+
+
+def chaves_de_env(fallback_env: str, aceitar_curto: bool = False) -> List[Tuple[str, bytes]]:
+    """
+    [(kid, segredo)], a primeira é a de assinatura. Segredos com menos de
+    16 caracteres são ignorados, exceto o de `fallback_env` com
+    `aceitar_curto` (compatibilidade: a Localiza sempre aceitou qualquer
+    CENTRAL_LOCALIZA_SESSION_SECRET não vazio), que vale com um aviso no log.
+    """
+    chaves: List[Tuple[str, bytes]] = []
+    for item in (os.getenv("CENTRAL_SESSION_KEYS") or "").split(","):
+        item = item.strip()
+        if ":" not in item:
+            continue
+        kid, segredo = item.split(":", 1)
+        kid, segredo = kid.strip(), segredo.strip()
+        if kid and len(segredo) >= 16 and "." not in kid:
+            chaves.append((kid, segredo.encode("utf-8")))
+    if not chaves:
+        segredo = (os.getenv(fallback_env) or "").strip()
+        if len(segredo) >= 16:
+            chaves.append(("0", segredo.encode("utf-8")))
+        elif segredo and aceitar_curto:
+            logger.warning(
+                "[SESSAO] %s tem menos de 16 caracteres; aceito por compatibilidade, "
+                "troque por um segredo mais longo (ou use CENTRAL_SESSION_KEYS)",
+                fallback_env,
+            )
+            chaves.append(("0", segredo.encode("utf-8")))
+    return chaves
+
+
+# ----------------------------
+# Denylist (jti revogados)
+# ----------------------------
+class Denylist:
+    def __init__(self, connect: Callable[[], sqlite3.Connection]):
+        self._connect = connect
+        self._lock = threading.Lock()
+        self._jtis: Dict[str, int] = {}
+        # revogados por este processo: sobrevivem a um reload concorrente
+        self._locais: Dict[str, int] = {}
+        self._carregado_em = 0.0
+        self._refresh_s = _env_float("SESSION_DENYLIST_REFRESH_S", 5.0)
+        self._tabela_ok = False
+
+    def _garantir_tabela(self, conn: sqlite3.Connection) -> None:
+        if self._tabela_ok:
+            return
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS session_denylist (
+                jti TEXT PRIMARY KEY,
+                exp INTEGER NOT NULL,
+                revoked_at INTEGER NOT NULL
+            ) WITHOUT ROWID
+            """
+        )
+        conn.commit()
+        self._tabela_ok = True
+
+    def contem(self, jti: str) -> bool:
+        agora = time.monotonic()
+        if agora - self._carregado_em >= self._refresh_s:
+            self._recarregar(agora)
+        return jti in self._jtis
+
+    def adicionar(self, jti: str, exp: int) -> None:
+        with self._lock:
+            self._jtis[jti] = exp
+            self._locais[jti] = exp
+        agora = int(time.time())
+        conn = self._connect()
+        try:
+            self._garantir_tabela(conn)
+            conn.execute(
+                "INSERT OR REPLACE INTO session_denylist(jti, exp, revoked_at) VALUES(?,?,?)",
+                (jti, int(exp), agora),
+            )
+            # tokens já expirados não precisam mais estar na lista
+            conn.execute("DELETE FROM session_denylist WHERE exp < ?", (agora,))
+            conn.commit()
+        finally:
+            conn.close()
+
+    def _recarregar(self, agora_mono: float) -> None:
+        try:
+            conn = self._connect()
+            try:
+                self._garantir_tabela(conn)
+                rows = conn.execute(
+                    "SELECT jti, exp FROM session_denylist WHERE exp >= ?",
+                    (int(time.time()),),
+                ).fetchall()
+            finally:
+                conn.close()
+        except Exception as e:
+            # mantém o set atual; tenta de novo no próximo intervalo
+            logger.error("[SESSAO] erro ao recarregar denylist: %s", e)
+            self._carregado_em = agora_mono
+            return
+        agora = int(time.time())
+        with self._lock:
+            self._locais = {j: e for j, e in self._locais.items() if e >= agora}
+            jtis = {r[0]: int(r[1]) for r in rows}
+            jtis.update(self._locais)
+            self._jtis = jtis
+            self._carregado_em = agora_mono
+
+
+def _connect_padrao() -> sqlite3.Connection:
+    os.makedirs(DATA_DIR, exist_ok=True)
+    return sqlite3.connect(DB_PATH)
+
+
+# Uma denylist por processo, compartilhada pela Central e pela Localiza
+DENYLIST = Denylist(_connect_padrao)
+
+
+# ----------------------------
+# Motor
+# ----------------------------
+class SessaoAssinada:
+    def __init__(
+        self,
+        aud: str,
+        chaves: Callable[[], List[Tuple[str, bytes]]],
+        denylist: Denylist = DENYLIST,
+    ):
+        self.aud = aud
+        self._chaves_fn = chaves
+        self._chaves: Optional[List[Tuple[str, bytes]]] = None
+        self._denylist = denylist
+
+    def _ring(self) -> List[Tuple[str, bytes]]:
+        # só guarda quando há chave: .env carregado depois ainda é visto
+        if not self._chaves:
+            self._chaves = self._chaves_fn()
+        return self._chaves
+
+    def recarregar_chaves(self) -> None:
+        self._chaves = None
+
+    def configurado(self) -> bool:
+        return bool(self._ring())
+
+    @staticmethod
+    def _assinar(segredo: bytes, kid: str, payload: str) -> str:
+        msg = f"{kid}.{payload}".encode("utf-8")
+        return _b64u(hmac.new(segredo, msg, hashlib.sha256).digest())
+
+    def emitir(self, sub: str, ttl_s: int) -> str:
+        """Levanta RuntimeError se não houver chave configurada."""
+        ring = self._ring()
+        if not ring:
+            raise RuntimeError("nenhuma chave de sessão configurada")
+        kid, segredo = ring[0]
+        agora = int(time.time())
+        payload = _b64u(
+            json.dumps(
+                {
+                    "sub": sub,
+                    "aud": self.aud,
+                    "iat": agora,
+                    "exp": agora + int(ttl_s),
+                    "jti": secrets.token_urlsafe(12),
+                },
+                separators=(",", ":"),
+                ensure_ascii=False,
+            ).encode("utf-8")
+        )
+        return f"{PREFIXO}{kid}.{payload}.{self._assinar(segredo, kid, payload)}"
+
+    def _decodificar(self, token: str) -> Optional[Dict[str, Any]]:
+        """Assinatura, aud e exp; não consulta a denylist."""
+        if not eh_token_assinado(token):
+            return None
+        partes = token[len(PREFIXO):].split(".")
+        if len(partes) != 3:
+            return None
+        kid, payload, sig = partes
+        segredo = dict(self._ring()).get(kid)
+        if segredo is None:
+            return None
+        if not hmac.compare_digest(self._assinar(segredo, kid, payload), sig):
+            return None
+        try:
+            dados = json.loads(_b64u_decode(payload).decode("utf-8"))
+        except (binascii.Error, ValueError, UnicodeDecodeError):
+            return None
+        if not isinstance(dados, dict) or dados.get("aud") != self.aud:
+            return None
+        try:
+            if int(dados.get("exp", 0)) < int(time.time()):
+                return None
+        except (TypeError, ValueError):
+            return None
+        if not dados.get("sub") or not dados.get("jti"):
+            return None
+        return dados
+
+    def validar(self, token: Optional[str]) -> Optional[Dict[str, Any]]:
+        """Payload do token válido, ou None (inválido, expirado ou revogado)."""
+        dados = self._decodificar(token or "")
+        if dados is None or self._denylist.contem(str(dados["jti"])):
+            return None
+        return dados
+
+    def revogar(self, token: Optional[str]) -> bool:
+        dados = self._decodificar(token or "")
+        if dados is None:
+            return False
+        self._denylist.adicionar(str(dados["jti"]), int(dados["exp"]))
+        return True
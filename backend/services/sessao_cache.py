@@ -0,0 +1,139 @@
+# backend/services/sessao_cache.py
+# -*- coding: utf-8 -*-
+"""
+sessao_cache.py
+
+Cache em memória das sessões por cookie (central_sessions e
+localiza_sessions), usado por service_auth_central e service_auth_localiza.
+
+- Sessão validada no banco fica em cache por SESSION_CACHE_TTL_S segundos
+  (padrão 30), nunca além do expires_at da própria sessão. O polling do
+  dashboard (/api/live-track/list a cada 3 s) deixa de abrir conexão e de
+  fazer SELECT a cada request.
+- last_seen_utc/ip/user_agent não são mais gravados a cada request: ficam
+  pendentes (1 por token, o mais recente vence) e uma thread grava tudo
+  numa transação a cada SESSION_LAST_SEEN_FLUSH_S segundos (padrão 15), e
+  também na saída do processo.
+- revoke/logout/expiração chamam invalidar(): efeito imediato neste
+  processo. Em outros workers, a sessão revogada vale no máximo até o TTL
+  do cache.
+"""
+
+import atexit
+import logging
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from typing import Callable, Dict, Optional, Tuple
+
+logger = logging.getLogger("anjo_da_guarda")
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, str(default)))
+    except Exception:
+        return default
+
+
+CACHE_TTL_S = _env_float("SESSION_CACHE_TTL_S", 30.0)
+FLUSH_S = _env_float("SESSION_LAST_SEEN_FLUSH_S", 15.0)
+_MAX_ENTRADAS = 10000
+
+
+class SessaoCache:
+    def __init__(self, tabela: str, connect: Callable[[], sqlite3.Connection]):
+        self._tabela = tabela
+        self._connect = connect
+        self._lock = threading.Lock()
+        # token_hash -> (username, válido_até_monotonic)
+        self._validas: Dict[str, Tuple[str, float]] = {}
+        # token_hash -> (last_seen_iso, ip, user_agent)
+        self._vistos: Dict[str, Tuple[str, str, str]] = {}
+        self._thread: Optional[threading.Thread] = None
+        self._parar = threading.Event()
+
+    # ----------------------------
+    # Validação
+    # ----------------------------
+    def get(self, token_hash: str) -> Optional[str]:
+        if CACHE_TTL_S <= 0:
+            return None
+        with self._lock:
+            item = self._validas.get(token_hash)
+            if item is None:
+                return None
+            if time.monotonic() >= item[1]:
+                del self._validas[token_hash]
+                return None
+            return item[0]
+
+    def put(self, token_hash: str, username: str, expires_at: datetime) -> None:
+        if CACHE_TTL_S <= 0:
+            return
+        now_mono = time.monotonic()
+        restante = (expires_at - datetime.now(expires_at.tzinfo)).total_seconds()
+        ate = now_mono + min(CACHE_TTL_S, max(restante, 0.0))
+        with self._lock:
+            if len(self._validas) >= _MAX_ENTRADAS:
+                vencidas = [k for k, v in self._validas.items() if v[1] <= now_mono]
+                for k in vencidas:
+                    del self._validas[k]
+                if len(self._validas) >= _MAX_ENTRADAS:
+                    self._validas.clear()
+            self._validas[token_hash] = (username, ate)
+
+    def invalidar(self, token_hash: str) -> None:
+        with self._lock:
+            self._validas.pop(token_hash, None)
+            self._vistos.pop(token_hash, None)
+
+    # ----------------------------
+    # last_seen agrupado
+    # ----------------------------
+    def tocar(self, token_hash: str, last_seen_iso: str, ip: str, user_agent: str) -> None:
+        with self._lock:
+            self._vistos[token_hash] = (last_seen_iso, (ip or "")[:80], (user_agent or "")[:300])
+            if self._thread is None:
+                th = threading.Thread(
+                    target=self._loop, name=f"{self._tabela}-last-seen", daemon=True
+                )
+                th.start()
+                self._thread = th
+                atexit.register(self.flush)
+
+    def pendentes(self) -> int:
+        with self._lock:
+            return len(self._vistos)
+
+    def flush(self) -> int:
+        with self._lock:
+            lote = self._vistos
+            self._vistos = {}
+        if not lote:
+            return 0
+        try:
+            conn = self._connect()
+            try:
+                conn.executemany(
+                    f"UPDATE {self._tabela} SET last_seen_utc=?, ip=?, user_agent=? "
+                    "WHERE token_hash=?",
+                    [(v[0], v[1], v[2], k) for k, v in lote.items()],
+                )
+                conn.commit()
+            finally:
+                conn.close()
+        except Exception as e:
+            logger.error("[SESSAO] erro ao gravar last_seen em %s: %s", self._tabela, e)
+            with self._lock:
+                # devolve o lote; o que chegou depois é mais recente e fica
+                for k, v in lote.items():
+                    self._vistos.setdefault(k, v)
+            return 0
+        return len(lote)
+
+    def _loop(self) -> None:
+        while not self._parar.wait(max(FLUSH_S, 0.5)):
+            self.flush()
@@ -0,0 +1,365 @@
+# backend/services/sos_idempotencia.py
+# -*- coding: utf-8 -*-
+"""
+sos_idempotencia.py
+
+Supressão de SOS duplicado: retry do app depois de timeout e toques
+repetidos no botão de pânico não geram nova sessão de rastreio nem novo
+disparo para todos os contatos.
+
+Chave do SOS:
+- header Idempotency-Key do app (escopo: telefone/e-mail do remetente),
+  válida por SOS_IDEM_TTL_S segundos (padrão 600);
+- sem header: derivada do telefone (ou e-mail) do remetente, válida por
+  SOS_DEDUP_WINDOW_S segundos (padrão 60) a partir do primeiro SOS, e só
+  para SOS a até SOS_DEDUP_RADIUS_M metros (padrão 150) do original (SOS
+  sem localização, de um lado ou do outro, conta como o mesmo lugar). A
+  janela e o raio contam do primeiro pedido, sem baldes fixos de relógio
+  ou de grade: dois toques seguidos nunca caem em baldes vizinhos. Mais
+  longe que o raio é outro SOS (dispara e passa a ser o original). SOS
+  anônimo (sem telefone nem e-mail) não tem chave derivada e sempre
+  dispara.
+
+O primeiro pedido com a chave dispara; os repetidos esperam o resultado
+dele (até SOS_IDEM_WAIT_S segundos) e recebem a mesma resposta (sos_id,
+tracking_url), com "duplicate": true. Passou da espera: 202 com o sos_id e
+o rastreio do original ("pending": true). Cada repetido é gravado em
+sos_duplicates, ligado ao sos_id original, e contado em
+anjo_sos_duplicates_total{source}.
+
+Se o disparo original não entregou em nenhum canal (ok = false) ou deu
+erro, a chave é liberada: quem já estava esperando recebe a mesma resposta,
+mas o próximo retry dispara de novo.
+
+A reserva fica no banco (tabela sos_idempotency, chave primária idem_key),
+gravada com BEGIN IMMEDIATE: vale para todos os workers que dividem o
+arquivo SQLite. Repetido no mesmo worker espera o Future do original;
+em outro worker, lê a linha a cada _CONSULTA_S até ela ter a resposta.
+Reserva ainda "pending" há mais de SOS_IDEM_PENDING_MAX_S segundos (padrão
+120; worker que caiu no meio do disparo) é abandonada e o próximo pedido
+dispara. Se o banco falhar na reserva, o SOS dispara assim mesmo (sem
+deduplicar). Linhas vencidas saem na manutenção (services/manutencao.py).
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import math
+import os
+import re
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from services.instrumentacao import counter
+
+logger = logging.getLogger("anjo_da_guarda")
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, str(default)))
+    except Exception:
+        return default
+
+
+IDEM_TTL_S = _env_float("SOS_IDEM_TTL_S", 600.0)
+JANELA_S = _env_float("SOS_DEDUP_WINDOW_S", 60.0)
+RAIO_M = _env_float("SOS_DEDUP_RADIUS_M", 150.0)
+ESPERA_S = _env_float("SOS_IDEM_WAIT_S", 30.0)
+PENDENTE_MAX_S = _env_float("SOS_IDEM_PENDING_MAX_S", 120.0)
+_MAX_CHAVE = 200
+_CONSULTA_S = 0.2
+
+DUPLICADOS = counter(
+    "anjo_sos_duplicates_total",
+    "SOS repetidos respondidos com o resultado do original (sem novo disparo).",
+    ("source",),
+)
+
+# Resultado do disparo: (status HTTP, corpo JSON)
+Resposta = Tuple[int, Dict[str, Any]]
+
+
+def _now() -> str:
+    return datetime.utcnow().isoformat()
+
+
+# ----------------------------
+# Chaves
+# ----------------------------
+def _remetente(phone: Optional[str], user_email: Optional[str]) -> str:
+    digitos = re.sub(r"\D", "", phone or "")
+    if digitos:
+        return f"tel:{digitos}"
+    email = (user_email or "").strip().lower()
+    return f"email:{email}" if email else ""
+
+
+def chave_sos(
+    idempotency_key: Optional[str],
+    phone: Optional[str],
+    user_email: Optional[str],
+) -> Optional[Tuple[str, str, float]]:
+    """(chave, origem "header" | "derived", validade em s) ou None."""
+    remetente = _remetente(phone, user_email)
+    cliente = (idempotency_key or "").strip()[:_MAX_CHAVE]
+    if cliente:
+        base, origem, ttl = f"{remetente}|{cliente}", "header", IDEM_TTL_S
+    elif remetente and JANELA_S > 0:
+        base, origem, ttl = remetente, "derived", JANELA_S
+    else:
+        return None
+    return hashlib.sha256(base.encode("utf-8")).hexdigest(), origem, ttl
+
+
+# ----------------------------
+# Registro no banco
+# ----------------------------
+class OriginalFalhou(Exception):
+    """O disparo original deu erro (ou a reserva sumiu) antes de responder."""
+
+
+@dataclass
+class Entrada:
+    chave: str
+    origem: str
+    # created_at da reserva: identifica ESTA reserva da chave
+    criado: str
+    lat: Optional[float] = None
+    lon: Optional[float] = None
+    sos_id: Optional[int] = None
+    tracking_url: Optional[str] = None
+    # só no worker que dispara; nos outros, a espera lê o banco
+    futuro: Optional[Future] = field(default=None)
+
+
+def _distancia_m(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    # equiretangular: sobra para distâncias de centenas de metros
+    x = math.radians(lon2 - lon1) * math.cos(math.radians((lat1 + lat2) / 2))
+    y = math.radians(lat2 - lat1)
+    return 6371000.0 * math.hypot(x, y)
+
+
+def _mesmo_lugar(e: Entrada, lat: Optional[float], lon: Optional[float]) -> bool:
+    if e.origem == "header":
+        return True
+    if e.lat is None or e.lon is None or lat is None or lon is None:
+        return True
+    return _distancia_m(e.lat, e.lon, lat, lon) <= RAIO_M
+
+
+def _entrada_da_linha(row: sqlite3.Row) -> Entrada:
+    return Entrada(
+        chave=row["idem_key"],
+        origem=row["key_source"],
+        criado=row["created_at"],
+        lat=row["lat"],
+        lon=row["lon"],
+        sos_id=row["sos_id"],
+        tracking_url=row["tracking_url"],
+    )
+
+
+class SosIdempotencia:
+    def __init__(self, connect: Callable[[], sqlite3.Connection]):
+        self._connect = connect
+        self._lock = threading.Lock()
+        # reservas deste processo ainda em disparo: chave -> entrada
+        self._locais: Dict[str, Entrada] = {}
+
+    def reservar(
+        self,
+        chave: str,
+        origem: str,
+        ttl_s: float,
+        lat: Optional[float] = None,
+        lon: Optional[float] = None,
+    ) -> Tuple[bool, Entrada]:
+        """(primeiro, entrada). primeiro=False: SOS repetido, use esperar()."""
+        agora = datetime.utcnow()
+        try:
+            con = self._connect()
+            try:
+                con.execute("BEGIN IMMEDIATE")
+                row = con.execute(
+                    "SELECT * FROM sos_idempotency WHERE idem_key=?", (chave,)
+                ).fetchone()
+                if row is not None and self._vigente(row, agora):
+                    atual = _entrada_da_linha(row)
+                    if _mesmo_lugar(atual, lat, lon):
+                        con.rollback()
+                        with self._lock:
+                            local = self._locais.get(chave)
+                        if local is not None and local.criado == atual.criado:
+                            return False, local
+                        return False, atual
+                nova = Entrada(
+                    chave=chave,
+                    origem=origem,
+                    criado=agora.isoformat(),
+                    lat=lat,
+                    lon=lon,
+                    futuro=Future(),
+                )
+                con.execute(
+                    """
+                    INSERT OR REPLACE INTO sos_idempotency(
+                        idem_key, key_source, lat, lon, state, created_at, expires_at
+                    )
+                    VALUES(?,?,?,?,'pending',?,?)
+                    """,
+                    (
+                        chave,
+                        origem,
+                        lat,
+                        lon,
+                        nova.criado,
+                        (agora + timedelta(seconds=ttl_s)).isoformat(),
+                    ),
+                )
+                con.commit()
+            finally:
+                con.close()
+        except Exception as e:
+            # SOS nunca deixa de sair por causa da deduplicação
+            logger.error("[SOS] erro ao reservar chave de idempotência: %s", e)
+            nova = Entrada(
+                chave=chave, origem=origem, criado="", lat=lat, lon=lon, futuro=Future()
+            )
+            return True, nova
+        with self._lock:
+            self._locais[chave] = nova
+        return True, nova
+
+    @staticmethod
+    def _vigente(row: sqlite3.Row, agora: datetime) -> bool:
+        if row["expires_at"] <= agora.isoformat():
+            return False
+        if row["state"] == "pending":
+            limite = (agora - timedelta(seconds=PENDENTE_MAX_S)).isoformat()
+            return row["created_at"] >= limite
+        return True
+
+    def iniciado(
+        self, entrada: Entrada, sos_id: int, tracking_url: Optional[str]
+    ) -> None:
+        """Grava o sos_id/rastreio: repetidos que cansarem de esperar já os recebem."""
+        entrada.sos_id, entrada.tracking_url = sos_id, tracking_url
+        self._atualizar(
+            entrada,
+            "sos_id=?, tracking_url=?",
+            (sos_id, tracking_url),
+        )
+
+    def concluir(self, chave: str, entrada: Entrada, resposta: Resposta) -> None:
+        agora = datetime.utcnow().isoformat()
+        if resposta[1].get("ok"):
+            self._atualizar(
+                entrada,
+                "state='done', status_code=?, response_json=?",
+                (resposta[0], json.dumps(resposta[1])),
+            )
+        else:
+            # libera a chave (vence agora), mas quem já espera lê a resposta
+            self._atualizar(
+                entrada,
+                "state='done', status_code=?, response_json=?, expires_at=?",
+                (resposta[0], json.dumps(resposta[1]), agora),
+            )
+        self._soltar(chave, entrada)
+        if entrada.futuro is not None:
+            entrada.futuro.set_result(resposta)
+
+    def falhar(self, chave: str, entrada: Entrada, erro: BaseException) -> None:
+        self._atualizar(
+            entrada, "state='failed', expires_at=?", (datetime.utcnow().isoformat(),)
+        )
+        self._soltar(chave, entrada)
+        if entrada.futuro is not None:
+            entrada.futuro.set_exception(erro)
+
+    async def esperar(self, entrada: Entrada, timeout_s: float) -> Resposta:
+        """
+        Resposta do original. asyncio.TimeoutError se passar de `timeout_s`;
+        OriginalFalhou (ou o erro do original) se ele não respondeu.
+        """
+        if entrada.futuro is not None:
+            return await asyncio.wait_for(
+                asyncio.shield(asyncio.wrap_future(entrada.futuro)), timeout_s
+            )
+        limite = time.monotonic() + timeout_s
+        while True:
+            row = await asyncio.to_thread(self._ler, entrada)
+            if row is None:
+                raise OriginalFalhou("reserva substituída")
+            entrada.sos_id, entrada.tracking_url = row["sos_id"], row["tracking_url"]
+            if row["state"] == "done":
+                return int(row["status_code"]), json.loads(row["response_json"])
+            if row["state"] == "failed":
+                raise OriginalFalhou("disparo original falhou")
+            if time.monotonic() >= limite:
+                raise asyncio.TimeoutError()
+            await asyncio.sleep(_CONSULTA_S)
+
+    def _ler(self, entrada: Entrada) -> Optional[sqlite3.Row]:
+        con = self._connect()
+        try:
+            return con.execute(
+                "SELECT * FROM sos_idempotency WHERE idem_key=? AND created_at=?",
+                (entrada.chave, entrada.criado),
+            ).fetchone()
+        finally:
+            con.close()
+
+    def _atualizar(self, entrada: Entrada, campos: str, params: Tuple[Any, ...]) -> None:
+        if not entrada.criado:
+            return  # reserva não chegou ao banco
+        try:
+            con = self._connect()
+            try:
+                with con:
+                    con.execute(
+                        f"UPDATE sos_idempotency SET {campos} "
+                        "WHERE idem_key=? AND created_at=?",
+                        (*params, entrada.chave, entrada.criado),
+                    )
+            finally:
+                con.close()
+        except Exception as e:
+            logger.error("[SOS] erro ao gravar idempotência do SOS %s: %s", entrada.sos_id, e)
+
+    def _soltar(self, chave: str, entrada: Entrada) -> None:
+        with self._lock:
+            if self._locais.get(chave) is entrada:
+                del self._locais[chave]
+
+    def __len__(self) -> int:
+        return len(self._locais)
+
+
+# ----------------------------
+# Duplicados no banco
+# ----------------------------
+def registrar_duplicado(
+    con: sqlite3.Connection,
+    *,
+    sos_id: Optional[int],
+    chave: str,
+    origem: str,
+    phone: Optional[str],
+    payload_json: str,
+) -> None:
+    con.execute(
+        """
+        INSERT INTO sos_duplicates(sos_id, idem_key, key_source, phone, payload_json, created_at)
+        VALUES(?,?,?,?,?,?)
+        """,
+        (sos_id, chave, origem, phone, payload_json, _now()),
+    )
+    DUPLICADOS.inc(origem)
@@ -0,0 +1,340 @@
+# backend/services/sos_projector.py
+# -*- coding: utf-8 -*-
+"""
+sos_projector.py
+
+Registro único do SOS + projeções assíncronas.
+
+O /api/sos grava UMA linha em sos_event_log (append-only) numa transação
+ANTES do disparo; depois do disparo, na mesma transação, completa a linha
+com o resultado (dispatch_json) e grava o send_ledger. Se o processo cair no
+meio do disparo, o registro do SOS já está no banco.
+
+As tabelas derivadas são preenchidas por este projetor, numa thread de fundo:
+- sos_audit, metrics_events e os rollups por hora/dia
+  (services/sos_rollup.py), no mesmo banco e na mesma transação que
+  marca projected_at: ou projeta tudo ou nada;
+- sos_events (services/metrics.py, outro arquivo): melhor esforço, só loga
+  em caso de erro (como antes).
+
+Vários processos podem dividir o mesmo arquivo SQLite: cada projetor
+reivindica as linhas dentro de BEGIN IMMEDIATE (o SELECT de pendentes roda
+já com o lock de escrita e a mesma transação grava projected_at), então
+uma linha é projetada uma vez só, por um projetor só.
+
+Linhas sem dispatched_at só são projetadas depois de SOS_DISPATCH_TIMEOUT_S
+segundos (padrão 300) do created_at: disparo que nunca terminou (queda no
+meio) entra com canais = 0 e dispatch_json = {"incomplete": true}. Um SOS
+ainda em disparo em outro worker não é tocado. O projetor também acorda a
+cada _VARREDURA_S segundos para pegar essas linhas. Se o resultado chegar
+depois disso (disparo mais lento que o timeout), registrar_sos_resultado
+corrige a projeção na mesma transação: canais do sos_audit (ligado por
+sos_audit.sos_id) e rollups (estorna os canais projetados, aplica os
+reais). metrics_events não depende dos canais; sos_events (outro banco,
+melhor esforço) não é corrigido.
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional
+
+from services.sos_rollup import aplicar_rollup, estornar_rollup, reconstruir_rollups
+
+logger = logging.getLogger("anjo_da_guarda")
+
+_LOTE = 200
+_VARREDURA_S = 60.0
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, str(default)))
+    except Exception:
+        return default
+
+
+TIMEOUT_DISPARO_S = _env_float("SOS_DISPATCH_TIMEOUT_S", 300.0)
+
+
+def _now() -> str:
+    return datetime.utcnow().isoformat()
+
+
+# ----------------------------
+# Escrita síncrona (usada pelo /api/sos)
+# ----------------------------
+def registrar_sos_inicio(
+    con: sqlite3.Connection,
+    *,
+    user_id: Optional[int],
+    phone: Optional[str],
+    payload_json: str,
+    lat: Optional[float],
+    lon: Optional[float],
+    tracking_id: Optional[str],
+    tracking_url: Optional[str],
+) -> int:
+    cur = con.execute(
+        """
+        INSERT INTO sos_event_log(
+            created_at, user_id, phone, payload_json, lat, lon,
+            tracking_id, tracking_url
+        )
+        VALUES(?,?,?,?,?,?,?,?)
+        """,
+        (_now(), user_id, phone, payload_json, lat, lon, tracking_id, tracking_url),
+    )
+    return int(cur.lastrowid)
+
+
+def registrar_sos_resultado(
+    con: sqlite3.Connection,
+    sos_id: int,
+    channels: Dict[str, int],
+    erro: Optional[str] = None,
+) -> None:
+    """
+    `erro`: o disparo parou no meio por exceção; canais = o que já saiu.
+    Linha já projetada (como incompleta): a projeção é refeita aqui.
+    """
+    resultado: Dict[str, Any] = {"channels": channels}
+    if erro:
+        resultado["error"] = erro
+    # o UPDATE primeiro pega o lock de escrita: o SELECT abaixo já não
+    # corre com o projetor
+    con.execute("UPDATE sos_event_log SET dispatched_at=? WHERE id=?", (_now(), sos_id))
+    row = con.execute(
+        "SELECT projected_at, dispatch_json, created_at, phone FROM sos_event_log WHERE id=?",
+        (sos_id,),
+    ).fetchone()
+    con.execute(
+        "UPDATE sos_event_log SET dispatch_json=? WHERE id=?",
+        (json.dumps(resultado), sos_id),
+    )
+    if row is None or row["projected_at"] is None:
+        return
+    try:
+        projetados = dict(json.loads(row["dispatch_json"] or "{}").get("channels") or {})
+    except Exception:
+        projetados = {}
+    con.execute(
+        """
+        UPDATE sos_audit
+           SET sent_email=?, sent_sms=?, sent_whatsapp=?, sent_telegram=?
+         WHERE sos_id=?
+        """,
+        (
+            int(channels.get("email", 0)),
+            int(channels.get("sms", 0)),
+            int(channels.get("whatsapp", 0)),
+            int(channels.get("telegram", 0)),
+            sos_id,
+        ),
+    )
+    estornar_rollup(con, [(row["created_at"], row["phone"], projetados)])
+    aplicar_rollup(con, [(row["created_at"], row["phone"], channels)])
+    logger.warning(
+        "[SOS PROJ] resultado do SOS %s chegou depois da projeção; corrigido", sos_id
+    )
+
+
+# ----------------------------
+# Projetor
+# ----------------------------
+class SosProjector:
+    def __init__(
+        self,
+        connect: Callable[[], sqlite3.Connection],
+        registrar_sos_event: Optional[Callable[..., Any]] = None,
+    ):
+        self._connect = connect
+        self._registrar_sos_event = registrar_sos_event
+        self._acordar = threading.Event()
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    def iniciar(self) -> None:
+        with self._lock:
+            if self._thread is not None:
+                return
+            th = threading.Thread(target=self._loop, name="sos-projector", daemon=True)
+            th.start()
+            self._thread = th
+        self._acordar.set()  # reprocessa pendentes da execução anterior
+
+    def notificar(self) -> None:
+        self.iniciar()
+        self._acordar.set()
+
+    def pendentes(self) -> int:
+        try:
+            with self._connect() as con:
+                return int(
+                    con.execute(
+                        "SELECT COUNT(*) FROM sos_event_log WHERE projected_at IS NULL"
+                    ).fetchone()[0]
+                )
+        except Exception:
+            return 0
+
+    def projetar_pendentes(self) -> int:
+        """Projeta tudo que estiver pronto; devolve quantas linhas."""
+        total = 0
+        while True:
+            with self._connect() as con:
+                rows = self._reivindicar(con)
+                if not rows:
+                    con.rollback()
+                    return total
+                self._projetar_banco(con, rows)
+            self._projetar_sos_events(rows)
+            total += len(rows)
+
+    # ----------------------------
+    # Internos
+    # ----------------------------
+    @staticmethod
+    def _reivindicar(con: sqlite3.Connection) -> List[sqlite3.Row]:
+        """
+        Abre a transação de escrita (BEGIN IMMEDIATE), lê o lote pendente
+        já com o lock e marca projected_at. Devolve só as linhas que este
+        UPDATE de fato marcou: é com elas, e só com elas, que sos_audit,
+        metrics_events e os rollups são alimentados. A transação fica
+        aberta para _projetar_banco; quem chama faz o commit (ou rollback
+        se vazio).
+        """
+        limite = (datetime.utcnow() - timedelta(seconds=TIMEOUT_DISPARO_S)).isoformat()
+        con.execute("BEGIN IMMEDIATE")
+        rows = con.execute(
+            """
+            SELECT * FROM sos_event_log
+             WHERE projected_at IS NULL
+               AND (dispatched_at IS NOT NULL OR created_at < ?)
+             ORDER BY id
+             LIMIT ?
+            """,
+            (limite, _LOTE),
+        ).fetchall()
+        agora = _now()
+        return [
+            r
+            for r in rows
+            if con.execute(
+                "UPDATE sos_event_log SET projected_at=? WHERE id=? AND projected_at IS NULL",
+                (agora, r["id"]),
+            ).rowcount
+            == 1
+        ]
+
+    def _loop(self) -> None:
+        try:
+            with self._connect() as con:
+                n = reconstruir_rollups(con)
+            if n:
+                logger.info("[SOS PROJ] rollups reconstruídos a partir de %s SOS", n)
+        except Exception as e:
+            logger.error("[SOS PROJ] erro ao reconstruir rollups: %s", e)
+
+        while True:
+            # acorda também sem notificar(): disparos que nunca terminaram
+            self._acordar.wait(_VARREDURA_S)
+            self._acordar.clear()
+            try:
+                self.projetar_pendentes()
+            except Exception as e:
+                logger.error("[SOS PROJ] erro ao projetar: %s", e)
+
+    @staticmethod
+    def _channels(row: sqlite3.Row) -> Dict[str, int]:
+        try:
+            return dict(json.loads(row["dispatch_json"] or "{}").get("channels") or {})
+        except Exception:
+            return {}
+
+    def _projetar_banco(self, con: sqlite3.Connection, rows: List[sqlite3.Row]) -> None:
+        audit, metrics, incompletos, rollup = [], [], [], []
+        for r in rows:
+            ch = self._channels(r)
+            rollup.append((r["created_at"], r["phone"], ch))
+            if r["dispatched_at"] is None:
+                incompletos.append((json.dumps({"incomplete": True}), r["id"]))
+            audit.append(
+                (
+                    r["id"],
+                    r["user_id"],
+                    r["payload_json"],
+                    int(ch.get("email", 0)),
+                    int(ch.get("sms", 0)),
+                    int(ch.get("whatsapp", 0)),
+                    int(ch.get("telegram", 0)),
+                    r["created_at"],
+                    r["phone"],
+                )
+            )
+            metrics.append(
+                (
+                    r["user_id"],
+                    "sos_trigger",
+                    "multi",
+                    r["lat"],
+                    r["lon"],
+                    r["created_at"],
+                    r["phone"],
+                )
+            )
+
+        con.executemany(
+            """
+            INSERT INTO sos_audit(
+                sos_id, user_id, payload_json, sent_email, sent_sms,
+                sent_whatsapp, sent_telegram, created_at, phone
+            )
+            VALUES(?,?,?,?,?,?,?,?,?)
+            """,
+            audit,
+        )
+        con.executemany(
+            """
+            INSERT INTO metrics_events(
+                user_id, event_type, channel, lat, lon, created_at, phone
+            )
+            VALUES(?,?,?,?,?,?,?)
+            """,
+            metrics,
+        )
+        aplicar_rollup(con, rollup)
+        if incompletos:
+            con.executemany(
+                "UPDATE sos_event_log SET dispatch_json=? WHERE id=?", incompletos
+            )
+
+    def _projetar_sos_events(self, rows: List[sqlite3.Row]) -> None:
+        if self._registrar_sos_event is None:
+            return
+        for r in rows:
+            try:
+                self._registrar_sos_event(
+                    extra={
+                        "sos_id": r["id"],
+                        "user_id": r["user_id"],
+                        "phone": r["phone"],
+                        "lat": r["lat"],
+                        "lon": r["lon"],
+                        "payload": json.loads(r["payload_json"] or "{}"),
+                        "channels": self._channels(r),
+                        "tracking": {
+                            "id": r["tracking_id"],
+                            "url": r["tracking_url"],
+                        },
+                    }
+                )
+            except Exception as e:
+                logger.error(
+                    "[SOS_EVENTS] erro ao registrar evento detalhado (sos %s): %s",
+                    r["id"],
+                    e,
+                )
@@ -0,0 +1,209 @@
+# backend/services/sos_rollup.py
+# -*- coding: utf-8 -*-
+"""
+sos_rollup.py
+
+Rollups pré-agregados de SOS (por hora e por dia) para dashboards/Power BI.
+
+Chave: (bucket, phone, channel, outcome)
+- bucket  : 'YYYY-MM-DDTHH' (hora, UTC) ou 'YYYY-MM-DD' (dia, UTC)
+- channel : email | sms | whatsapp | telegram | any
+            ('any' = 1 linha por SOS; é dela que sai o total de disparos)
+- outcome : sent | failed
+
+Mantidos pelo SOS_PROJECTOR na MESMA transação que grava sos_audit e
+reivindica as linhas do sos_event_log (projected_at), então rollup e
+auditoria nunca divergem e um SOS nunca é somado duas vezes, mesmo com
+vários workers projetando. Na primeira subida com as tabelas vazias, o
+histórico de sos_audit é agregado uma vez (reconstruir_rollups), sob o
+lock de escrita: só um worker reconstrói.
+"""
+
+import sqlite3
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+CANAIS = ("email", "sms", "whatsapp", "telegram")
+
+_UPSERT = """
+    INSERT INTO {tabela}(bucket, phone, channel, outcome, total, first_at, last_at)
+    VALUES(?,?,?,?,?,?,?)
+    ON CONFLICT(bucket, phone, channel, outcome) DO UPDATE SET
+        total = total + excluded.total,
+        first_at = MIN(first_at, excluded.first_at),
+        last_at = MAX(last_at, excluded.last_at)
+"""
+
+
+def _linhas_sos(
+    created_at: str, phone: Optional[str], channels: Dict[str, Any]
+) -> List[Tuple[str, str, str, str]]:
+    """(created_at, phone, channel, outcome) de um SOS."""
+    phone = phone or ""
+    linhas = []
+    algum = False
+    for ch in CANAIS:
+        ok = bool(int(channels.get(ch, 0) or 0))
+        algum = algum or ok
+        linhas.append((created_at, phone, ch, "sent" if ok else "failed"))
+    linhas.append((created_at, phone, "any", "sent" if algum else "failed"))
+    return linhas
+
+
+def _agregar(
+    sos: Iterable[Tuple[str, Optional[str], Dict[str, Any]]],
+) -> Tuple[Dict[Tuple[str, str, str, str], List[Any]], Dict[Tuple[str, str, str, str], List[Any]]]:
+    """(por hora, por dia): chave -> [total, first_at, last_at]."""
+    hora: Dict[Tuple[str, str, str, str], List[Any]] = {}
+    dia: Dict[Tuple[str, str, str, str], List[Any]] = {}
+    for created_at, phone, channels in sos:
+        for ts, ph, ch, outcome in _linhas_sos(created_at, phone, channels):
+            for agg, bucket in ((hora, ts[:13]), (dia, ts[:10])):
+                k = (bucket, ph, ch, outcome)
+                cur = agg.get(k)
+                if cur is None:
+                    agg[k] = [1, ts, ts]
+                else:
+                    cur[0] += 1
+                    cur[1] = min(cur[1], ts)
+                    cur[2] = max(cur[2], ts)
+    return hora, dia
+
+
+def aplicar_rollup(
+    con: sqlite3.Connection,
+    sos: Iterable[Tuple[str, Optional[str], Dict[str, Any]]],
+) -> None:
+    """
+    sos: (created_at ISO UTC, phone, {"email": 0/1, "sms": ..., ...})
+    Agrega em memória e faz 1 upsert por chave em cada tabela. O upsert
+    soma: passe só SOS reivindicados nesta mesma transação.
+    """
+    hora, dia = _agregar(sos)
+    for tabela, agg in (("sos_rollup_hourly", hora), ("sos_rollup_daily", dia)):
+        if agg:
+            con.executemany(
+                _UPSERT.format(tabela=tabela),
+                [(*k, v[0], v[1], v[2]) for k, v in agg.items()],
+            )
+
+
+def estornar_rollup(
+    con: sqlite3.Connection,
+    sos: Iterable[Tuple[str, Optional[str], Dict[str, Any]]],
+) -> None:
+    """
+    Desfaz aplicar_rollup dos mesmos SOS (resultado que chegou depois da
+    projeção). first_at/last_at ficam como estão; chave zerada sai.
+    """
+    hora, dia = _agregar(sos)
+    for tabela, agg in (("sos_rollup_hourly", hora), ("sos_rollup_daily", dia)):
+        if not agg:
+            continue
+        con.executemany(
+            f"UPDATE {tabela} SET total = total - ? "
+            "WHERE bucket=? AND phone=? AND channel=? AND outcome=?",
+            [(v[0], *k) for k, v in agg.items()],
+        )
+        con.executemany(
+            f"DELETE FROM {tabela} "
+            "WHERE bucket=? AND phone=? AND channel=? AND outcome=? AND total <= 0",
+            list(agg),
+        )
+
+
+def reconstruir_rollups(con: sqlite3.Connection, forcar: bool = False) -> int:
+    """
+    Agrega todo o sos_audit. Sem `forcar`, só roda se os rollups estiverem
+    vazios (primeira subida). Devolve quantos SOS foram agregados.
+
+    Abre BEGIN IMMEDIATE (se não houver transação aberta): a checagem de
+    vazio e a reconstrução rodam com o lock de escrita, então dois workers
+    subindo juntos não reconstroem em cima um do outro.
+    """
+    if not con.in_transaction:
+        con.execute("BEGIN IMMEDIATE")
+    if not forcar:
+        tem = con.execute("SELECT 1 FROM sos_rollup_daily LIMIT 1").fetchone()
+        if tem:
+            return 0
+    con.execute("DELETE FROM sos_rollup_hourly")
+    con.execute("DELETE FROM sos_rollup_daily")
+
+    total = 0
+    cur = con.execute(
+        """
+        SELECT created_at, phone, sent_email, sent_sms, sent_whatsapp, sent_telegram
+          FROM sos_audit
+        """
+    )
+    while True:
+        rows = cur.fetchmany(1000)
+        if not rows:
+            return total
+        aplicar_rollup(
+            con,
+            (
+                (
+                    r["created_at"],
+                    r["phone"],
+                    {
+                        "email": r["sent_email"],
+                        "sms": r["sent_sms"],
+                        "whatsapp": r["sent_whatsapp"],
+                        "telegram": r["sent_telegram"],
+                    },
+                )
+                for r in rows
+            ),
+        )
+        total += len(rows)
+
+
+def sos_por_telefone(con: sqlite3.Connection, days: int) -> List[Dict[str, Any]]:
+    """
+    Disparos por telefone nos últimos `days` dias (precisão de 1 hora):
+    dias completos vêm do rollup diário, o dia do corte do rollup horário.
+    """
+    corte = datetime.utcnow() - timedelta(days=days)
+    dia_corte = corte.strftime("%Y-%m-%d")
+    hora_corte = corte.strftime("%Y-%m-%dT%H")
+    rows = con.execute(
+        """
+        SELECT phone,
+               SUM(total) AS total_sos,
+               MIN(first_at) AS first_sos,
+               MAX(last_at) AS last_sos
+          FROM (
+                SELECT phone, total, first_at, last_at
+                  FROM sos_rollup_daily
+                 WHERE bucket > ? AND channel = 'any' AND phone <> ''
+                UNION ALL
+                SELECT phone, total, first_at, last_at
+                  FROM sos_rollup_hourly
+                 WHERE bucket >= ? AND bucket < ? AND channel = 'any' AND phone <> ''
+               )
+         GROUP BY phone
+         ORDER BY total_sos DESC
+        """,
+        (dia_corte, hora_corte, dia_corte + "U"),  # 'U' > 'T': fecha o dia do corte
+    ).fetchall()
+    return [dict(r) for r in rows]
+
+
+def rollup_diario(
+    con: sqlite3.Connection, days: int, phone: Optional[str] = None
+) -> List[Dict[str, Any]]:
+    """Linhas do rollup diário (para Power BI), mais recentes primeiro."""
+    desde = (datetime.utcnow() - timedelta(days=days)).strftime("%Y-%m-%d")
+    sql = """
+        SELECT bucket AS day, phone, channel, outcome, total, first_at, last_at
+          FROM sos_rollup_daily
+         WHERE bucket >= ?
+    """
+    params: List[Any] = [desde]
+    if phone:
+        sql += " AND phone = ?"
+        params.append(phone)
+    sql += " ORDER BY bucket DESC, phone, channel, outcome"
+    return [dict(r) for r in con.execute(sql, params).fetchall()]
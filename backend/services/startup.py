@@ -0,0 +1,135 @@
+# backend/services/startup.py
+# -*- coding: utf-8 -*-
+"""
+startup.py
+
+Subida rápida do anjo_web_main e relatório de tempo por fase.
+
+- BOOT.marco("nome") / BOOT.fase("nome"): medem trechos da subida
+  (imports, config, db_init...). O relatório sai em /debug/startup e no
+  log "[BOOT] pronto em X ms".
+- BOOT.em_segundo_plano("nome", fn): roda fn numa thread depois da subida
+  (aquecimento do banco, projeções pendentes); também entra no relatório,
+  marcado como background, com erro se houver.
+- Preguicoso("services.x"): módulo importado só no primeiro uso de um
+  atributo (pagamentos/Mercado Pago, comissões, e-mail de assinatura). O
+  primeiro acesso entra no relatório como "lazy:services.x".
+
+O relógio começa no import deste módulo (primeira linha do anjo_web_main);
+o tempo do interpretador e do uvicorn antes disso não aparece.
+"""
+
+import importlib
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from types import ModuleType
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+logger = logging.getLogger("anjo_da_guarda")
+
+_T0 = time.perf_counter()
+
+
+def _ms(t: float) -> float:
+    return round(t * 1000, 1)
+
+
+class RelatorioBoot:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._fases: List[Dict[str, Any]] = []
+        self._pronto_ms: Optional[float] = None
+        self._ultimo_marco = _T0
+
+    @contextmanager
+    def fase(self, nome: str, background: bool = False) -> Iterator[None]:
+        inicio = time.perf_counter()
+        erro: Optional[str] = None
+        try:
+            yield
+        except Exception as e:
+            erro = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            fim = time.perf_counter()
+            item: Dict[str, Any] = {
+                "fase": nome,
+                "inicio_ms": _ms(inicio - _T0),
+                "duracao_ms": _ms(fim - inicio),
+            }
+            if background:
+                item["background"] = True
+            if erro:
+                item["erro"] = erro
+            with self._lock:
+                self._fases.append(item)
+
+    def marco(self, nome: str) -> None:
+        """Fase = do marco anterior (ou do início) até agora; p/ código de módulo."""
+        agora = time.perf_counter()
+        with self._lock:
+            inicio = self._ultimo_marco
+            self._ultimo_marco = agora
+            self._fases.append(
+                {
+                    "fase": nome,
+                    "inicio_ms": _ms(inicio - _T0),
+                    "duracao_ms": _ms(agora - inicio),
+                }
+            )
+
+    def marcar_pronto(self) -> float:
+        """Fim da parte síncrona da subida (app montado, rotas registradas)."""
+        self._pronto_ms = _ms(time.perf_counter() - _T0)
+        logger.info("[BOOT] pronto em %.0f ms", self._pronto_ms)
+        return self._pronto_ms
+
+    def em_segundo_plano(self, nome: str, fn: Callable[[], Any]) -> threading.Thread:
+        def _rodar() -> None:
+            try:
+                with self.fase(nome, background=True):
+                    fn()
+            except Exception as e:
+                logger.error("[BOOT] %s falhou em background: %s", nome, e)
+
+        th = threading.Thread(target=_rodar, name=f"boot-{nome}", daemon=True)
+        th.start()
+        return th
+
+    def relatorio(self) -> Dict[str, Any]:
+        with self._lock:
+            fases = [dict(f) for f in self._fases]
+        sincronas = [f for f in fases if not f.get("background")]
+        return {
+            "pronto_ms": self._pronto_ms,
+            "uptime_s": round(time.perf_counter() - _T0, 1),
+            "fases": sorted(fases, key=lambda f: f["inicio_ms"]),
+            "mais_lentas": sorted(sincronas, key=lambda f: -f["duracao_ms"])[:5],
+        }
+
+
+BOOT = RelatorioBoot()
+
+
+class Preguicoso:
+    """Proxy de módulo: `Preguicoso("services.x").funcao(...)` importa na 1ª vez."""
+
+    def __init__(self, nome: str):
+        self._nome = nome
+        self._modulo: Optional[ModuleType] = None
+        self._lock = threading.Lock()
+
+    def _carregar(self) -> ModuleType:
+        mod = self._modulo
+        if mod is not None:
+            return mod
+        with self._lock:
+            if self._modulo is None:
+                with BOOT.fase(f"lazy:{self._nome}", background=True):
+                    self._modulo = importlib.import_module(self._nome)
+            return self._modulo
+
+    def __getattr__(self, attr: str) -> Any:
+        return getattr(self._carregar(), attr)
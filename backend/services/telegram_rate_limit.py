@@ -0,0 +1,250 @@
+# backend/services/telegram_rate_limit.py
+# -*- coding: utf-8 -*-
+"""
+telegram_rate_limit.py
+
+Agendador único para TODAS as chamadas à Bot API do Telegram.
+
+Limites respeitados (documentação oficial do Telegram):
+- ~30 mensagens/s no total do bot  -> bucket global
+- ~1 mensagem/s por chat            -> bucket por chat
+- HTTP 429 traz `parameters.retry_after`: o chat fica bloqueado por esse
+  tempo e a chamada volta para a fila (até `max_retries` vezes).
+
+Prioridade (menor número sai primeiro):
+  PRIORIDADE_SOS > PRIORIDADE_LOCALIZACAO > PRIORIDADE_EDICAO
+
+Quem chama recebe um Future com o dict de resultado; nenhum handler
+precisa mais de time.sleep() entre chats.
+"""
+
+import contextvars
+import heapq
+import itertools
+import logging
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger("anjo_da_guarda")
+
+PRIORIDADE_SOS = 0
+PRIORIDADE_LOCALIZACAO = 1
+PRIORIDADE_EDICAO = 2
+
+# Acima disso, buckets de chats ociosos são descartados
+_MAX_CHAT_BUCKETS = 1000
+
+
+class _TokenBucket:
+    """
+    Token bucket simples (não é thread-safe; o agendador protege com lock).
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = max(float(rate), 0.001)
+        self.capacity = max(float(capacity), 1.0)
+        self.tokens = self.capacity
+        self.ts = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        if now > self.ts:
+            self.tokens = min(self.capacity, self.tokens + (now - self.ts) * self.rate)
+            self.ts = now
+
+    def wait_time(self, now: float) -> float:
+        """Segundos até existir 1 token (0 = pode enviar já)."""
+        self._refill(now)
+        if self.tokens >= 1.0:
+            return 0.0
+        return (1.0 - self.tokens) / self.rate
+
+    def take(self, now: float) -> None:
+        self._refill(now)
+        self.tokens -= 1.0
+
+    def idle(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+
+class _Job:
+    __slots__ = ("prioridade", "seq", "chat_id", "fn", "future", "tentativas", "ctx")
+
+    def __init__(self, prioridade: int, seq: int, chat_id: str, fn: Callable[[], Dict[str, Any]]):
+        self.prioridade = prioridade
+        self.seq = seq
+        self.chat_id = chat_id
+        self.fn = fn
+        self.future: Future = Future()
+        self.tentativas = 0
+        # contexto de quem enfileirou (trace da requisição)
+        self.ctx = contextvars.copy_context()
+
+
+class TelegramScheduler:
+    """
+    Fila de prioridade + buckets (global e por chat).
+
+    Uma thread "despachante" escolhe o próximo job elegível e entrega para
+    um pool pequeno de threads que fazem o HTTP; assim vários chats recebem
+    em paralelo, até o limite global.
+    """
+
+    def __init__(
+        self,
+        global_rate: float = 30.0,
+        per_chat_rate: float = 1.0,
+        per_chat_burst: float = 1.0,
+        max_workers: int = 8,
+        max_retries: int = 3,
+    ):
+        self._global = _TokenBucket(global_rate, global_rate)
+        self._per_chat_rate = per_chat_rate
+        self._per_chat_burst = per_chat_burst
+        self._max_workers = max(1, int(max_workers))
+        self._max_retries = max(0, int(max_retries))
+
+        self._chats: Dict[str, _TokenBucket] = {}
+        self._bloqueado_ate: Dict[str, float] = {}
+        self._heap: List[Tuple[int, int, _Job]] = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._thread: Optional[threading.Thread] = None
+
+    # ----------------------------
+    # API pública
+    # ----------------------------
+    def submit(
+        self,
+        chat_id: str,
+        fn: Callable[[], Dict[str, Any]],
+        prioridade: int = PRIORIDADE_SOS,
+    ) -> Future:
+        """
+        Enfileira `fn` (que faz o HTTP e devolve dict) para o chat indicado.
+        """
+        job = _Job(prioridade, next(self._seq), str(chat_id), fn)
+        with self._cond:
+            self._ensure_started()
+            heapq.heappush(self._heap, (job.prioridade, job.seq, job))
+            self._cond.notify()
+        return job.future
+
+    def pending(self) -> int:
+        """Quantidade de chamadas aguardando vez (para métricas/debug)."""
+        with self._cond:
+            return len(self._heap)
+
+    # ----------------------------
+    # Internos
+    # ----------------------------
+    def _ensure_started(self) -> None:
+        if self._thread is not None:
+            return
+        self._pool = ThreadPoolExecutor(
+            max_workers=self._max_workers, thread_name_prefix="tg-send"
+        )
+        self._thread = threading.Thread(
+            target=self._loop, name="tg-scheduler", daemon=True
+        )
+        self._thread.start()
+
+    def _chat_bucket(self, chat_id: str) -> _TokenBucket:
+        b = self._chats.get(chat_id)
+        if b is None:
+            if len(self._chats) >= _MAX_CHAT_BUCKETS:
+                self._prune(time.monotonic())
+            b = _TokenBucket(self._per_chat_rate, self._per_chat_burst)
+            self._chats[chat_id] = b
+        return b
+
+    def _prune(self, now: float) -> None:
+        ativos = {entry[2].chat_id for entry in self._heap}
+        for cid in list(self._chats.keys()):
+            if cid not in ativos and self._chats[cid].idle(now):
+                del self._chats[cid]
+        for cid in list(self._bloqueado_ate.keys()):
+            if self._bloqueado_ate[cid] <= now:
+                del self._bloqueado_ate[cid]
+
+    def _next_job(self) -> Tuple[Optional[_Job], Optional[float]]:
+        """
+        Devolve (job, None) se algum job pode sair agora,
+        ou (None, espera) com quanto tempo dormir até reavaliar.
+        """
+        if not self._heap:
+            return None, None
+
+        now = time.monotonic()
+        espera_global = self._global.wait_time(now)
+        if espera_global > 0:
+            return None, espera_global
+
+        menor_espera: Optional[float] = None
+        # fila costuma ser pequena; percorre em ordem de prioridade e pula
+        # chats que ainda estão no limite (não trava os outros chats)
+        for entry in sorted(self._heap):
+            job = entry[2]
+            bucket = self._chat_bucket(job.chat_id)
+            espera = max(
+                self._bloqueado_ate.get(job.chat_id, 0.0) - now,
+                bucket.wait_time(now),
+            )
+            if espera <= 0:
+                self._heap.remove(entry)
+                heapq.heapify(self._heap)
+                bucket.take(now)
+                self._global.take(now)
+                return job, None
+            if menor_espera is None or espera < menor_espera:
+                menor_espera = espera
+
+        return None, menor_espera
+
+    def _loop(self) -> None:
+        while True:
+            with self._cond:
+                job, espera = self._next_job()
+                if job is None:
+                    self._cond.wait(timeout=espera)
+                    continue
+            self._pool.submit(self._run, job)
+
+    def _run(self, job: _Job) -> None:
+        try:
+            res = job.ctx.run(job.fn)
+        except Exception as e:
+            logger.error("[TG SCHED] EXC chat=%s %s", job.chat_id, e)
+            res = {"ok": False, "reason": str(e), "chat_id": job.chat_id}
+
+        retry_after = res.get("retry_after") if isinstance(res, dict) else None
+        if retry_after and job.tentativas < self._max_retries:
+            job.tentativas += 1
+            logger.warning(
+                "[TG SCHED] 429 chat=%s retry_after=%ss tentativa=%s",
+                job.chat_id,
+                retry_after,
+                job.tentativas,
+            )
+            with self._cond:
+                ate = time.monotonic() + float(retry_after)
+                self._bloqueado_ate[job.chat_id] = max(
+                    self._bloqueado_ate.get(job.chat_id, 0.0), ate
+                )
+                heapq.heappush(self._heap, (job.prioridade, job.seq, job))
+                self._cond.notify()
+            return
+
+        job.future.set_result(res)
+
+
+def resultado_imediato(res: Dict[str, Any]) -> Future:
+    """
+    Future já resolvido (validações que não chegam a chamar o Telegram).
+    """
+    fut: Future = Future()
+    fut.set_result(res)
+    return fut
@@ -0,0 +1,265 @@
+# backend/services/tracing.py
+# -*- coding: utf-8 -*-
+"""
+tracing.py
+
+Tracing leve por requisição (sem dependência de OpenTelemetry).
+
+- TracingMiddleware abre um trace por requisição HTTP, com request id
+  (header X-Request-ID recebido ou gerado) devolvido na resposta.
+- span("nome", **attrs) cria spans aninhados com tempo monotônico; fora de
+  um trace é no-op. O contexto vai junto para as threads do envio em lote
+  (zenvia_batch) e do agendador do Telegram.
+- Requisição acima de TRACE_SLOW_MS (padrão 2000) gera um log WARNING com
+  os spans que passaram de TRACE_SLOW_SPAN_MS (padrão 50).
+- TRACE_OTLP_FILE=/caminho/traces.jsonl grava cada trace instrumentado
+  como uma linha OTLP/JSON (ExportTraceServiceRequest), o mesmo formato do
+  "file exporter" do OpenTelemetry Collector, para análise offline.
+"""
+
+import contextvars
+import json
+import logging
+import os
+import secrets
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+
+logger = logging.getLogger("anjo_da_guarda")
+
+SERVICE_NAME = "anjo-da-guarda"
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, str(default)))
+    except Exception:
+        return default
+
+
+class Span:
+    __slots__ = (
+        "span_id", "parent_id", "nome", "attrs", "t0", "t1", "erro",
+    )
+
+    def __init__(self, nome: str, parent_id: Optional[str], attrs: Dict[str, Any]):
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.nome = nome
+        self.attrs = attrs
+        self.t0 = time.monotonic()
+        self.t1: Optional[float] = None
+        self.erro: Optional[str] = None
+
+    def set(self, **attrs: Any) -> None:
+        self.attrs.update(attrs)
+
+    @property
+    def duracao_ms(self) -> float:
+        fim = self.t1 if self.t1 is not None else time.monotonic()
+        return (fim - self.t0) * 1000.0
+
+
+class Trace:
+    def __init__(self, nome: str, request_id: str):
+        self.trace_id = secrets.token_hex(16)
+        self.request_id = request_id
+        # âncora para converter monotônico -> epoch (OTLP usa unix nano)
+        self._mono0 = time.monotonic()
+        self._epoch0_ns = time.time_ns()
+        self._lock = threading.Lock()
+        self.fechado = False
+        self.raiz = Span(nome, None, {"request.id": request_id})
+        self.spans: List[Span] = [self.raiz]
+
+    def _add(self, sp: Span) -> None:
+        with self._lock:
+            if not self.fechado:
+                self.spans.append(sp)
+
+    def _unix_nano(self, t: float) -> str:
+        return str(self._epoch0_ns + int((t - self._mono0) * 1e9))
+
+    def fechar(self) -> None:
+        with self._lock:
+            self.fechado = True
+            self.raiz.t1 = time.monotonic()
+
+    # ----------------------------
+    # Saídas
+    # ----------------------------
+    def log_lento(self, limite_span_ms: float) -> None:
+        linhas = []
+        for sp in sorted(self.spans, key=lambda s: s.t0):
+            if sp is self.raiz or sp.t1 is None or sp.duracao_ms < limite_span_ms:
+                continue
+            linhas.append(
+                f"  {sp.nome} {sp.duracao_ms:.1f}ms"
+                + (f" erro={sp.erro}" if sp.erro else "")
+            )
+        logger.warning(
+            "[TRACE] lento req=%s %s total=%.1fms trace=%s\n%s",
+            self.request_id,
+            self.raiz.nome,
+            self.raiz.duracao_ms,
+            self.trace_id,
+            "\n".join(linhas) or "  (nenhum span acima do limite)",
+        )
+
+    def otlp(self) -> Dict[str, Any]:
+        spans = []
+        for sp in self.spans:
+            if sp.t1 is None:
+                continue
+            item: Dict[str, Any] = {
+                "traceId": self.trace_id,
+                "spanId": sp.span_id,
+                "name": sp.nome,
+                # 2 = SERVER (raiz), 1 = INTERNAL
+                "kind": 2 if sp is self.raiz else 1,
+                "startTimeUnixNano": self._unix_nano(sp.t0),
+                "endTimeUnixNano": self._unix_nano(sp.t1),
+                "attributes": [_otlp_attr(k, v) for k, v in sp.attrs.items()],
+                "status": (
+                    {"code": 2, "message": sp.erro} if sp.erro else {"code": 1}
+                ),
+            }
+            if sp.parent_id:
+                item["parentSpanId"] = sp.parent_id
+            spans.append(item)
+        return {
+            "resourceSpans": [
+                {
+                    "resource": {
+                        "attributes": [_otlp_attr("service.name", SERVICE_NAME)]
+                    },
+                    "scopeSpans": [
+                        {"scope": {"name": "anjo_da_guarda"}, "spans": spans}
+                    ],
+                }
+            ]
+        }
+
+
+def _otlp_attr(chave: str, valor: Any) -> Dict[str, Any]:
+    if isinstance(valor, bool):
+        v = {"boolValue": valor}
+    elif isinstance(valor, int):
+        v = {"intValue": str(valor)}
+    elif isinstance(valor, float):
+        v = {"doubleValue": valor}
+    else:
+        v = {"stringValue": str(valor)}
+    return {"key": chave, "value": v}
+
+
+_trace_atual: contextvars.ContextVar[Optional[Trace]] = contextvars.ContextVar(
+    "anjo_trace", default=None
+)
+_span_atual: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar(
+    "anjo_span", default=None
+)
+
+
+def request_id_atual() -> Optional[str]:
+    tr = _trace_atual.get()
+    return tr.request_id if tr else None
+
+
+@contextmanager
+def span(nome: str, **attrs: Any) -> Iterator[Optional[Span]]:
+    """
+    Span filho do span atual. Sem trace ativo não faz nada (yield None).
+    """
+    tr = _trace_atual.get()
+    if tr is None:
+        yield None
+        return
+    pai = _span_atual.get() or tr.raiz
+    sp = Span(nome, pai.span_id, attrs)
+    token = _span_atual.set(sp)
+    try:
+        yield sp
+    except BaseException as e:
+        sp.erro = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        sp.t1 = time.monotonic()
+        _span_atual.reset(token)
+        tr._add(sp)
+
+
+# ----------------------------
+# Exportador OTLP/JSON (arquivo)
+# ----------------------------
+_export_lock = threading.Lock()
+
+
+def _exportar(tr: Trace) -> None:
+    path = (os.getenv("TRACE_OTLP_FILE") or "").strip()
+    if not path:
+        return
+    linha = json.dumps(tr.otlp(), ensure_ascii=False, separators=(",", ":"))
+    try:
+        with _export_lock, open(path, "a", encoding="utf-8") as f:
+            f.write(linha + "\n")
+    except Exception as e:
+        logger.error("[TRACE] falha ao exportar para %s: %s", path, e)
+
+
+def _finalizar(tr: Trace) -> None:
+    tr.fechar()
+    instrumentado = len(tr.spans) > 1
+    lento = tr.raiz.duracao_ms >= _env_float("TRACE_SLOW_MS", 2000.0)
+    if lento:
+        tr.log_lento(_env_float("TRACE_SLOW_SPAN_MS", 50.0))
+    # health/metrics e rotas sem spans não poluem o arquivo (a menos que lentas)
+    if instrumentado or lento:
+        _exportar(tr)
+
+
+# ----------------------------
+# Middleware ASGI
+# ----------------------------
+class TracingMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope.get("type") != "http":
+            await self.app(scope, receive, send)
+            return
+
+        rid = ""
+        for k, v in scope.get("headers") or []:
+            if k == b"x-request-id":
+                rid = v.decode("latin-1").strip()[:64]
+                break
+        rid = rid or secrets.token_hex(8)
+
+        tr = Trace(f"{scope.get('method', '')} {scope.get('path', '')}", rid)
+        token_tr = _trace_atual.set(tr)
+        token_sp = _span_atual.set(tr.raiz)
+
+        async def _send(message):
+            if message.get("type") == "http.response.start":
+                tr.raiz.set(**{"http.status_code": message.get("status", 0)})
+                headers = list(message.get("headers") or [])
+                headers.append((b"x-request-id", rid.encode("latin-1")))
+                message = dict(message, headers=headers)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, _send)
+        except BaseException as e:
+            tr.raiz.erro = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            route = scope.get("route")
+            if getattr(route, "path", None):
+                tr.raiz.nome = f"{scope.get('method', '')} {route.path}"
+            _trace_atual.reset(token_tr)
+            _span_atual.reset(token_sp)
+            _finalizar(tr)
@@ -1,6 +1,10 @@
 import os
 import sqlite3
-from typing import List, Dict, Any
+import threading
+from typing import List, Dict, Any, Iterator, Optional
+
+from services.comissao_totais import relatorio_vendedores, totais_vendedor
+from services.paginacao import codificar_cursor, decodificar_cursor, limitar
 
 # Mesmo esquema dos outros serviços (service_assinaturas, service_mapa etc.)
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -15,6 +19,30 @@ def _connect():
     return conn
 
 
+# Índice composto que cobre "WHERE vendedor_email = ? ORDER BY
+# created_at_utc DESC, id DESC" (listagens, CSV e paginação por cursor).
+# Também criado por tabelas.py; aqui garante uma vez por processo.
+_INDICE_OK = False
+_INDICE_LOCK = threading.Lock()
+
+
+def _garantir_indice(conn: sqlite3.Connection) -> None:
+    global _INDICE_OK
+    if _INDICE_OK:
+        return
+    with _INDICE_LOCK:
+        if _INDICE_OK:
+            return
+        conn.execute(
+            """
+            CREATE INDEX IF NOT EXISTS idx_assinaturas_vendedor_created
+                ON assinaturas (vendedor_email, created_at_utc, id)
+            """
+        )
+        conn.commit()
+        _INDICE_OK = True
+
+
 def listar_comissoes_por_vendedor(vendedor_email: str) -> List[Dict[str, Any]]:
     """
     Lista as assinaturas relacionadas a um vendedor específico,
@@ -22,6 +50,7 @@ def listar_comissoes_por_vendedor(vendedor_email: str) -> List[Dict[str, Any]]:
     """
     conn = _connect()
     try:
+        _garantir_indice(conn)
         cur = conn.cursor()
         cur.execute(
             """
@@ -31,8 +60,8 @@ def listar_comissoes_por_vendedor(vendedor_email: str) -> List[Dict[str, Any]]:
                 plano,
                 valor_mensal_centavos,
                 COALESCE(desconto_centavos, 0) AS desconto_centavos,
-                -- valor líquido = bruto - desconto
-                (valor_mensal_centavos - COALESCE(desconto_centavos, 0)) AS valor_liquido_centavos,
+                -- valor líquido = max(bruto - desconto, 0) (mesma regra de comissao_totais)
+                MAX(valor_mensal_centavos - COALESCE(desconto_centavos, 0), 0) AS valor_liquido_centavos,
                 COALESCE(comissao_centavos, 0) AS comissao_centavos,
                 vendedor_email,
                 status,
@@ -50,26 +79,169 @@ def listar_comissoes_por_vendedor(vendedor_email: str) -> List[Dict[str, Any]]:
         conn.close()
 
 
+def iterar_comissoes_por_vendedor(
+    vendedor_email: str,
+    de_utc: Optional[str] = None,
+    ate_utc: Optional[str] = None,
+    chunk: int = 500,
+) -> Iterator[Dict[str, Any]]:
+    """
+    Mesmas colunas de listar_comissoes_por_vendedor, em blocos de `chunk`
+    linhas (export CSV em streaming). `de_utc` inclusivo, `ate_utc`
+    exclusivo, comparados com created_at_utc.
+    """
+    sql = """
+        SELECT
+            id,
+            user_email,
+            plano,
+            valor_mensal_centavos,
+            COALESCE(desconto_centavos, 0) AS desconto_centavos,
+            MAX(valor_mensal_centavos - COALESCE(desconto_centavos, 0), 0) AS valor_liquido_centavos,
+            COALESCE(comissao_centavos, 0) AS comissao_centavos,
+            vendedor_email,
+            status,
+            data_inicio_utc,
+            created_at_utc
+        FROM assinaturas
+        WHERE vendedor_email = ?
+    """
+    params: List[Any] = [vendedor_email]
+    if de_utc:
+        sql += " AND created_at_utc >= ?"
+        params.append(de_utc)
+    if ate_utc:
+        sql += " AND created_at_utc < ?"
+        params.append(ate_utc)
+    sql += " ORDER BY created_at_utc DESC, id DESC"
+
+    conn = _connect()
+    try:
+        _garantir_indice(conn)
+        cur = conn.execute(sql, params)
+        while True:
+            rows = cur.fetchmany(chunk)
+            if not rows:
+                return
+            for r in rows:
+                yield dict(r)
+    finally:
+        conn.close()
+
+
+def listar_comissoes_pagina(
+    vendedor_email: str,
+    limit: int = 100,
+    cursor: Optional[str] = None,
+) -> Dict[str, Any]:
+    """
+    Uma página das comissões do vendedor (mesma ordem e colunas de
+    listar_comissoes_por_vendedor), por keyset: a próxima página começa
+    depois de (created_at_utc, id) da última linha, usando o índice
+    idx_assinaturas_vendedor_created, sem OFFSET.
+
+    Retorna {"items": [...], "next_cursor": str | None}.
+    Cursor inválido (ou de outro vendedor) -> ValueError.
+    """
+    n = limitar(limit)
+    chave = decodificar_cursor(cursor)
+
+    sql = """
+        SELECT
+            id,
+            user_email,
+            plano,
+            valor_mensal_centavos,
+            COALESCE(desconto_centavos, 0) AS desconto_centavos,
+            MAX(valor_mensal_centavos - COALESCE(desconto_centavos, 0), 0) AS valor_liquido_centavos,
+            COALESCE(comissao_centavos, 0) AS comissao_centavos,
+            vendedor_email,
+            status,
+            data_inicio_utc,
+            created_at_utc
+        FROM assinaturas
+        WHERE vendedor_email = ?
+    """
+    params: List[Any] = [vendedor_email]
+    if chave is not None:
+        if (
+            chave.get("v") != vendedor_email
+            or not isinstance(chave.get("c"), str)
+            or not isinstance(chave.get("i"), int)
+        ):
+            raise ValueError("cursor inválido")
+        sql += " AND (created_at_utc, id) < (?, ?)"
+        params += [chave["c"], chave["i"]]
+    sql += " ORDER BY created_at_utc DESC, id DESC LIMIT ?"
+    params.append(n + 1)
+
+    conn = _connect()
+    try:
+        _garantir_indice(conn)
+        rows = conn.execute(sql, params).fetchall()
+    finally:
+        conn.close()
+
+    itens = [dict(r) for r in rows[:n]]
+    proximo = None
+    if len(rows) > n:
+        ultimo = itens[-1]
+        proximo = codificar_cursor(
+            {"v": vendedor_email, "c": ultimo["created_at_utc"], "i": ultimo["id"]}
+        )
+    return {"items": itens, "next_cursor": proximo}
+
+
+def totais_comissao_vendedor(
+    vendedor_email: str,
+    de_mes: Optional[str] = None,
+    ate_mes: Optional[str] = None,
+) -> Dict[str, Any]:
+    """
+    Só os totais (e a quebra por mês 'YYYY-MM') do vendedor, lidos da tabela
+    mensal: custo não depende do tamanho do histórico.
+    """
+    conn = _connect()
+    try:
+        resumo = totais_vendedor(conn, vendedor_email, de_mes, ate_mes)
+    finally:
+        conn.close()
+    return {"vendedor_email": vendedor_email, **resumo}
+
+
+def relatorio_comissoes(
+    de_mes: Optional[str] = None, ate_mes: Optional[str] = None
+) -> List[Dict[str, Any]]:
+    """
+    Fechamento de TODOS os vendedores no período (meses 'YYYY-MM'
+    inclusivos), numa consulta só; ver comissao_totais.relatorio_vendedores.
+    """
+    conn = _connect()
+    try:
+        return relatorio_vendedores(conn, de_mes, ate_mes)
+    finally:
+        conn.close()
+
+
 def resumir_comissoes_por_vendedor(vendedor_email: str) -> Dict[str, Any]:
     """
     Monta um resumo (totais) + lista de itens para o vendedor.
     Usado tanto no JSON quanto para gerar o CSV.
+
+    Os totais vêm de comissoes_totais_mensais (services/comissao_totais.py),
+    não da soma dos itens em Python.
     """
     itens = listar_comissoes_por_vendedor(vendedor_email)
 
-    total_bruto = sum(i.get("valor_mensal_centavos", 0) or 0 for i in itens)
-    total_desc = sum(i.get("desconto_centavos", 0) or 0 for i in itens)
-    total_liq = sum(i.get("valor_liquido_centavos", 0) or 0 for i in itens)
-    total_comissao = sum(i.get("comissao_centavos", 0) or 0 for i in itens)
+    conn = _connect()
+    try:
+        resumo = totais_vendedor(conn, vendedor_email)
+    finally:
+        conn.close()
 
     return {
         "vendedor_email": vendedor_email,
-        "totais": {
-            "valor_bruto_centavos": total_bruto,
-            "desconto_centavos": total_desc,
-            "valor_liquido_centavos": total_liq,
-            "comissao_centavos": total_comissao,
-        },
+        "totais": resumo["totais"],
         "items": itens,
     }
 
@@ -6,45 +6,13 @@ import urllib.request
 import urllib.error
 from datetime import datetime, timezone
 
+# .env + config tipada (services/config.py)
+from services.config import carregar_env_arquivos as _load_env_from_file
+from services.config import settings
+
 logger = logging.getLogger("watchdog")
 logging.basicConfig(level=logging.INFO)
 
-# ===== util: carregar .env (fallback) =====
-def _load_env_from_file() -> None:
-    # tenta backend/.env e raiz/.env
-    here = os.path.dirname(os.path.abspath(__file__))          # backend/services
-    backend_dir = os.path.normpath(os.path.join(here, ".."))   # backend
-    root_dir = os.path.normpath(os.path.join(backend_dir, ".."))
-
-    candidates = [
-        os.path.join(backend_dir, ".env"),
-        os.path.join(root_dir, ".env"),
-    ]
-
-    for path in candidates:
-        if not os.path.exists(path):
-            continue
-        try:
-            with open(path, "r", encoding="utf-8") as f:
-                for line in f:
-                    line = line.strip()
-                    if not line or line.startswith("#") or "=" not in line:
-                        continue
-                    k, v = line.split("=", 1)
-                    k = k.strip()
-                    v = v.strip().strip('"').strip("'")
-                    if k and k not in os.environ:
-                        os.environ[k] = v
-        except Exception as e:
-            logger.warning("Falha ao ler .env (%s): %s", path, e)
-
-def _getenv_any(*keys: str, default: str = "") -> str:
-    for k in keys:
-        v = os.getenv(k, "")
-        if v:
-            return v
-    return default
-
 def _parse_ts_to_utc(ts_raw: str) -> datetime | None:
     if not ts_raw:
         return None
@@ -130,8 +98,9 @@ def _set_state(conn: sqlite3.Connection, session_id: str, state: str, last_alert
 
 # ===== Envio Telegram =====
 def _send_telegram(msg: str) -> None:
-    token = _getenv_any("TELEGRAM_BOT_TOKEN", "TELEGRAM_TOKEN", "TG_BOT_TOKEN")
-    chat_id = _getenv_any("TELEGRAM_CHAT_ID", "TELEGRAM_ADMIN_CHAT_ID", "TG_CHAT_ID")
+    wd = settings().watchdog
+    token = wd.telegram_token
+    chat_id = wd.telegram_chat_id
     if not token or not chat_id:
         logger.info("[watchdog] Telegram não configurado (token/chat_id). Pulando.")
         return
@@ -148,18 +117,15 @@ def _send_telegram(msg: str) -> None:
 
 # ===== Envio Email (SendGrid HTTP) =====
 def _send_email(msg: str, subject: str) -> None:
-    api_key = _getenv_any("SENDGRID_API_KEY", "SENDGRID_KEY")
-    from_email = _getenv_any("SENDGRID_FROM", "EMAIL_FROM", "MAIL_FROM")
-    to_emails = _getenv_any("WATCHDOG_EMAIL_TO", "ALERT_EMAIL_TO", "ADMIN_EMAIL", "EMAIL_TO")
+    sg = settings().sendgrid
+    api_key = sg.api_key
+    from_email = sg.from_email
+    tos = settings().watchdog.email_to
 
-    if not api_key or not from_email or not to_emails:
+    if not api_key or not from_email or not tos:
         logger.info("[watchdog] Email (SendGrid) não configurado (API_KEY/FROM/TO). Pulando.")
         return
 
-    tos = [e.strip() for e in to_emails.split(",") if e.strip()]
-    if not tos:
-        return
-
     url = "https://api.sendgrid.com/v3/mail/send"
     body = {
         "personalizations": [{"to": [{"email": e} for e in tos], "subject": subject}],
@@ -184,11 +150,12 @@ def _send_email(msg: str, subject: str) -> None:
 
 def main() -> None:
     _load_env_from_file()
+    wd = settings().watchdog
 
-    base_url = _getenv_any("WATCHDOG_BASE_URL", default="http://127.0.0.1:8000").rstrip("/")
-    warn_s = int(_getenv_any("WATCHDOG_WARN_SECONDS", default="60"))
-    crit_s = int(_getenv_any("WATCHDOG_CRIT_SECONDS", default="180"))
-    cooldown_s = int(_getenv_any("WATCHDOG_COOLDOWN_SECONDS", default="300"))  # 5 min antispam
+    base_url = wd.base_url
+    warn_s = wd.warn_s
+    crit_s = wd.crit_s
+    cooldown_s = wd.cooldown_s  # 5 min antispam
 
     now = datetime.now(timezone.utc)
 
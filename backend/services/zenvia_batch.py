@@ -0,0 +1,131 @@
+# backend/services/zenvia_batch.py
+# -*- coding: utf-8 -*-
+"""
+zenvia_batch.py
+
+Envio em lote para a API v2 da Zenvia (SMS e WhatsApp).
+
+A v2 não tem endpoint síncrono "vários destinatários numa chamada" para
+mensagens (o /v2/batches é assíncrono e baseado em arquivo de contatos).
+Então o lote aqui é concorrente:
+- uma requests.Session compartilhada (keep-alive / pool de conexões);
+- um pool limitado de threads (ZENVIA_MAX_PARALLEL, padrão 10);
+- um resultado por destinatário, na MESMA ordem da lista de entrada.
+
+ZENVIA_BASE_URL permite apontar para um stand-in local em testes
+(mesma variável usada por services/zenvia.py).
+"""
+
+import contextvars
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, TypeVar
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from services.config import settings
+
+T = TypeVar("T")
+
+DEFAULT_BASE_URL = "https://api.zenvia.com/v2"
+
+_lock = threading.Lock()
+_session: Optional[requests.Session] = None
+_executor: Optional[ThreadPoolExecutor] = None
+_em_uso = 0
+
+
+def _max_paralelo() -> int:
+    try:
+        return max(1, int(os.getenv("ZENVIA_MAX_PARALLEL", "10")))
+    except Exception:
+        return 10
+
+
+def zenvia_base_url() -> str:
+    return settings().zenvia.base_url or DEFAULT_BASE_URL
+
+
+def zenvia_session() -> requests.Session:
+    """
+    Session única (thread-safe para POSTs simples) com pool do tamanho
+    do paralelismo, para reaproveitar TLS entre destinatários.
+    """
+    global _session
+    if _session is None:
+        with _lock:
+            if _session is None:
+                n = _max_paralelo()
+                s = requests.Session()
+                adapter = HTTPAdapter(pool_connections=2, pool_maxsize=n)
+                s.mount("https://", adapter)
+                s.mount("http://", adapter)
+                _session = s
+    return _session
+
+
+def _pool() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        with _lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=_max_paralelo(), thread_name_prefix="zenvia"
+                )
+    return _executor
+
+
+def fila_pendente() -> int:
+    """Envios do pool em andamento ou aguardando thread livre (para /metrics)."""
+    return _em_uso
+
+
+def enviar_em_lote(
+    itens: List[T],
+    enviar: Callable[[T], Dict[str, Any]],
+) -> List[Dict[str, Any]]:
+    """
+    Executa `enviar(item)` para cada item com paralelismo limitado.
+
+    - 0 ou 1 item: roda na própria thread (sem custo de pool).
+    - Exceção em um item vira {"ok": False, "reason": ...} só daquele item.
+    - O contexto (trace da requisição) vai junto para cada thread.
+    """
+    if not itens:
+        return []
+    if len(itens) == 1:
+        return [_safe(enviar, itens[0])]
+
+    global _em_uso
+    pool = _pool()
+    futures = []
+    for item in itens:
+        with _lock:
+            _em_uso += 1
+        try:
+            futures.append(
+                pool.submit(contextvars.copy_context().run, _no_pool, enviar, item)
+            )
+        except BaseException:
+            with _lock:
+                _em_uso -= 1
+            raise
+    return [f.result() for f in futures]
+
+
+def _no_pool(enviar: Callable[[T], Dict[str, Any]], item: T) -> Dict[str, Any]:
+    global _em_uso
+    try:
+        return _safe(enviar, item)
+    finally:
+        with _lock:
+            _em_uso -= 1
+
+
+def _safe(enviar: Callable[[T], Dict[str, Any]], item: T) -> Dict[str, Any]:
+    try:
+        return enviar(item)
+    except Exception as e:
+        return {"ok": False, "reason": str(e), "to": str(item)}
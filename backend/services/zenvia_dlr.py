@@ -0,0 +1,365 @@
+# backend/services/zenvia_dlr.py
+# -*- coding: utf-8 -*-
+"""
+zenvia_dlr.py
+
+Ingestão dos callbacks de status (DLR) da Zenvia.
+
+O webhook só coloca o corpo bruto numa fila limitada e responde na hora;
+uma thread de fundo faz o parse e grava em lote (executemany, uma
+transação por lote) em sms_dlr / wa_dlr, atualizando o status no
+send_ledger na mesma transação. Assim a latência do callback não
+sobe durante a "tempestade" de DLRs que vem depois de um SOS em massa.
+
+Config (env):
+- DLR_QUEUE_MAX      tamanho da fila (padrão 10000). Cheia -> grava inline.
+- DLR_BATCH_MAX      corpos por lote (padrão 500)
+- DLR_BATCH_WAIT_MS  espera para juntar um lote (padrão 50)
+- DLR_WRITE_RETRIES  tentativas de gravar um lote quando o banco está
+                     ocupado/travado (padrão 6), com espera dobrando de
+                     0,1 s até 5 s entre elas. O webhook já respondeu 200 e
+                     a Zenvia não reenvia: SQLITE_BUSY enquanto a
+                     manutenção ou o projetor seguram o lock de escrita não
+                     pode descartar o lote.
+- DLR_LOG_SAMPLE     fração dos corpos logados em INFO (padrão 0.01);
+                     em DEBUG todos são logados. O corpo inteiro já fica
+                     em raw_json.
+"""
+
+import json
+import logging
+import os
+import queue
+import random
+import secrets
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+
+from services.instrumentacao import counter
+from services.send_ledger import aplicar_dlrs
+
+logger = logging.getLogger("anjo_da_guarda")
+
+DLR_EVENTOS = counter(
+    "anjo_dlr_events_total",
+    "Eventos DLR da Zenvia gravados, por canal.",
+    ("channel",),
+)
+DLR_FALHAS = counter(
+    "anjo_dlr_failures_total",
+    "Lotes de DLR que falharam ao gravar (db: eventos perdidos; retry: nova "
+    "tentativa com o banco ocupado) ou gravados inline.",
+    ("kind",),
+)
+
+SQL_SMS = (
+    "INSERT INTO sms_dlr (message_id, to_number, status, code, description, raw_json, received_at) "
+    "VALUES (?,?,?,?,?,?,?)"
+)
+SQL_WA = (
+    "INSERT INTO wa_dlr (message_id, to_number, status, code, description, channel, raw_json, received_at) "
+    "VALUES (?,?,?,?,?,?,?,?)"
+)
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, str(default)))
+    except Exception:
+        return default
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, str(default)))
+    except Exception:
+        return default
+
+
+_ESPERA_S = 0.1
+_ESPERA_MAX_S = 5.0
+
+
+def _now() -> str:
+    return datetime.utcnow().isoformat()
+
+
+# ----------------------------
+# Parse
+# ----------------------------
+def _extract_to(obj: dict) -> str:
+    to_raw = obj.get("to") or obj.get("destination") or obj.get("recipient")
+    if isinstance(to_raw, dict):
+        return str(
+            to_raw.get("phoneNumber")
+            or to_raw.get("id")
+            or to_raw.get("number")
+            or ""
+        ).strip()
+    return str(to_raw or "").strip()
+
+
+def _parse_evento(ev: dict) -> Dict[str, str]:
+    msg_node = ev.get("message") or {}
+
+    msg_id = (
+        (ev.get("messageId") or ev.get("id") or "")
+        or (msg_node.get("messageId") or msg_node.get("id") or "")
+    )
+    msg_id = str(msg_id).strip()
+
+    channel = (
+        (ev.get("channel") or ev.get("type") or "")
+        or (msg_node.get("channel") or msg_node.get("type") or "")
+        or (
+            isinstance(ev.get("to"), dict)
+            and ev.get("to", {}).get("type")
+            or ""
+        )
+    )
+    channel = str(channel).strip().lower()
+
+    to_number = _extract_to(ev) or _extract_to(msg_node)
+
+    st = (
+        ev.get("status")
+        or ev.get("messageStatus")
+        or ev.get("event")
+        or ev.get("state")
+    )
+    code = description = status = ""
+    if isinstance(st, dict):
+        code = str(
+            st.get("code")
+            or st.get("status")
+            or st.get("event")
+            or st.get("state")
+            or ""
+        ).strip()
+        description = str(
+            st.get("description")
+            or st.get("reason")
+            or st.get("detail")
+            or ""
+        ).strip()
+        status = code or "UNKNOWN"
+    elif isinstance(st, str):
+        status = code = description = st.strip()
+    else:
+        status = "UNKNOWN"
+
+    return {
+        "message_id": msg_id,
+        "to_number": to_number,
+        "status": status,
+        "code": code,
+        "description": description,
+        "channel": channel,
+    }
+
+
+def parse_dlr(raw_str: str) -> List[Dict[str, str]]:
+    """
+    Corpo bruto do webhook -> lista de eventos normalizados.
+    O ping de verificação da Zenvia vira um evento PING (gravado em sms_dlr).
+    """
+    try:
+        payload = json.loads(raw_str)
+    except Exception:
+        payload = None
+
+    if isinstance(payload, dict):
+        events = [payload]
+    elif isinstance(payload, list):
+        events = payload
+    else:
+        events = []
+
+    if (
+        len(events) == 1
+        and isinstance(events[0], dict)
+        and events[0].get("ping") == "ok"
+    ):
+        msg_id = events[0].get("messageId") or f"ping-{secrets.token_hex(4)}"
+        return [
+            {
+                "message_id": msg_id,
+                "to_number": "",
+                "status": "PING",
+                "code": "PING",
+                "description": "PING",
+                "channel": "",
+            }
+        ]
+
+    return [_parse_evento(ev) for ev in events if isinstance(ev, dict)]
+
+
+def _linhas(
+    itens: List[Tuple[str, str]]
+) -> Tuple[List[tuple], List[tuple], List[Tuple[str, str, str, str]]]:
+    sms: List[tuple] = []
+    wa: List[tuple] = []
+    ledger: List[Tuple[str, str, str, str]] = []
+    for raw_str, received_at in itens:
+        for ev in parse_dlr(raw_str):
+            ledger.append(
+                (
+                    "whatsapp" if ev["channel"] == "whatsapp" else "sms",
+                    ev["message_id"],
+                    ev["status"],
+                    received_at,
+                )
+            )
+            if ev["channel"] == "whatsapp":
+                wa.append(
+                    (
+                        ev["message_id"], ev["to_number"], ev["status"], ev["code"],
+                        ev["description"], ev["channel"], raw_str, received_at,
+                    )
+                )
+            else:
+                sms.append(
+                    (
+                        ev["message_id"], ev["to_number"], ev["status"], ev["code"],
+                        ev["description"], raw_str, received_at,
+                    )
+                )
+    return sms, wa, ledger
+
+
+# ----------------------------
+# Fila + worker
+# ----------------------------
+class DlrIngestor:
+    def __init__(self, connect: Callable[[], sqlite3.Connection]):
+        self._connect = connect
+        self._fila: "queue.Queue[Optional[Tuple[str, str]]]" = queue.Queue(
+            maxsize=max(1, _env_int("DLR_QUEUE_MAX", 10000))
+        )
+        self._batch_max = max(1, _env_int("DLR_BATCH_MAX", 500))
+        self._batch_wait = max(0.0, _env_float("DLR_BATCH_WAIT_MS", 50.0) / 1000.0)
+        self._log_sample = _env_float("DLR_LOG_SAMPLE", 0.01)
+        self._tentativas = max(1, _env_int("DLR_WRITE_RETRIES", 6))
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    def pendentes(self) -> int:
+        return self._fila.qsize()
+
+    def receber(self, raw_str: str) -> None:
+        """
+        Chamado pelo webhook: enfileira e volta. Fila cheia -> grava inline
+        (mais lento, mas não perde o evento).
+        """
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("[ZENVIA WH] %s", raw_str)
+        elif self._log_sample > 0 and random.random() < self._log_sample:
+            logger.info("[ZENVIA WH][amostra] %s", raw_str)
+
+        item = (raw_str, _now())
+        self._ensure_started()
+        try:
+            self._fila.put_nowait(item)
+        except queue.Full:
+            DLR_FALHAS.inc("inline")
+            logger.warning("[ZENVIA WH] fila cheia; gravando inline")
+            self._gravar([item])
+
+    def parar(self, timeout: float = 5.0) -> None:
+        """Drena a fila (usado no encerramento do processo)."""
+        th = self._thread
+        if th is None:
+            return
+        try:
+            self._fila.put(None, timeout=timeout)
+        except queue.Full:
+            return
+        th.join(timeout)
+
+    # ----------------------------
+    # Internos
+    # ----------------------------
+    def _ensure_started(self) -> None:
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                th = threading.Thread(target=self._loop, name="zenvia-dlr", daemon=True)
+                th.start()
+                self._thread = th
+
+    def _loop(self) -> None:
+        while True:
+            item = self._fila.get()
+            if item is None:
+                return
+            lote = [item]
+            limite = time.monotonic() + self._batch_wait
+            fim = False
+            while len(lote) < self._batch_max:
+                resto = limite - time.monotonic()
+                try:
+                    prox = (
+                        self._fila.get(timeout=resto) if resto > 0 else self._fila.get_nowait()
+                    )
+                except queue.Empty:
+                    break
+                if prox is None:
+                    fim = True
+                    break
+                lote.append(prox)
+            self._gravar(lote)
+            if fim:
+                return
+
+    def _gravar(self, itens: List[Tuple[str, str]]) -> None:
+        try:
+            sms, wa, ledger = _linhas(itens)
+            if not sms and not wa:
+                return
+            for tentativa in range(self._tentativas):
+                try:
+                    self._gravar_banco(sms, wa, ledger)
+                    break
+                except sqlite3.OperationalError as e:
+                    # busy/locked: transitório; o resto (ex.: IntegrityError) não
+                    if tentativa + 1 >= self._tentativas:
+                        raise
+                    espera = min(_ESPERA_MAX_S, _ESPERA_S * 2**tentativa)
+                    DLR_FALHAS.inc("retry")
+                    logger.warning(
+                        "[ZENVIA WH][DB] lote de %s corpos: %s; nova tentativa em %.1fs",
+                        len(itens),
+                        e,
+                        espera,
+                    )
+                    time.sleep(espera)
+            if sms:
+                DLR_EVENTOS.inc("sms", n=len(sms))
+            if wa:
+                DLR_EVENTOS.inc("whatsapp", n=len(wa))
+        except Exception as e:
+            DLR_FALHAS.inc("db")
+            logger.error("[ZENVIA WH][DB] lote de %s corpos: %s", len(itens), e)
+
+    def _gravar_banco(
+        self,
+        sms: List[tuple],
+        wa: List[tuple],
+        ledger: List[Tuple[str, str, str, str]],
+    ) -> None:
+        """Uma transação: DLRs + status no send_ledger (tudo ou nada)."""
+        con = self._connect()
+        try:
+            with con:
+                if sms:
+                    con.executemany(SQL_SMS, sms)
+                if wa:
+                    con.executemany(SQL_WA, wa)
+                aplicar_dlrs(con, ledger)
+        finally:
+            con.close()
@@ -7,6 +7,9 @@ Evolui a tabela 'assinaturas' para incluir campos de:
 - vendedor_email         (TEXT, opcional)
 - comissao_centavos      (INT, default 0)
 
+e cria o índice (vendedor_email, created_at_utc, id), usado pelos
+relatórios/paginação de comissões por vendedor.
+
 Rode uma vez com:
   python .\tabelas.py
 """
@@ -62,6 +65,12 @@ def main() -> None:
             )
             print("[UPG] adicionada coluna comissao_centavos")
 
+        # 4) índice para "comissões do vendedor, mais novas primeiro"
+        cur.execute(
+            "CREATE INDEX IF NOT EXISTS idx_assinaturas_vendedor_created "
+            "ON assinaturas (vendedor_email, created_at_utc, id);"
+        )
+
         conn.commit()
         print(f"[UPG] tabelas.py OK em: {DB_PATH}")
 